@@ -0,0 +1,156 @@
+"""Acervo histórico em disco, em colunas: um arquivo .npy por ticker e campo.
+
+    acervo/HGLG11/data.npy          datetime64[D]
+    acervo/HGLG11/fechamento.npy    float64 (idem abertura, maxima, minima, volume)
+    acervo/HGLG11/div_data.npy      datetime64[D]
+    acervo/HGLG11/div_valor.npy     float64
+    acervo/HGLG11/meta.json         intervalo coberto e contagens
+
+As análises abrem os arrays com mmap (np.load(mmap_mode='r')): nada de
+carregar a série inteira em objetos Python nem de consultar o SQLite.
+Este módulo não usa o ORM, para poder rodar nos processos do backfill.
+"""
+import json
+import os
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+CAMPOS = ('abertura', 'maxima', 'minima', 'fechamento', 'volume')
+COLUNAS_YAHOO = {'abertura': 'Open', 'maxima': 'High', 'minima': 'Low', 'fechamento': 'Close', 'volume': 'Volume'}
+ANOS_PADRAO = 10
+
+
+def pasta_padrao():
+    return Path(getattr(settings, 'FII_ACERVO', Path(settings.BASE_DIR) / 'acervo'))
+
+
+def ler_meta(pasta, ticker):
+    try:
+        return json.loads((Path(pasta) / ticker / 'meta.json').read_text())
+    except FileNotFoundError:
+        return None
+
+
+class Serie:
+    """Séries de um ticker abertas por mmap; os atributos são arrays somente leitura."""
+
+    def __init__(self, pasta, ticker):
+        diretorio = Path(pasta) / ticker
+        self.ticker = ticker
+        self.meta = ler_meta(pasta, ticker)
+        if self.meta is None:
+            raise FileNotFoundError(f"{ticker} não está no acervo ({diretorio})")
+        # meta.json é gravado por último: o que ele conta é o que está completo
+        linhas, dividendos = self.meta['linhas'], self.meta['dividendos']
+        self.data = np.load(diretorio / 'data.npy', mmap_mode='r')[:linhas]
+        for campo in CAMPOS:
+            setattr(self, campo, np.load(diretorio / f'{campo}.npy', mmap_mode='r')[:linhas])
+        self.div_data = np.load(diretorio / 'div_data.npy', mmap_mode='r')[:dividendos]
+        self.div_valor = np.load(diretorio / 'div_valor.npy', mmap_mode='r')[:dividendos]
+
+    def __len__(self):
+        return len(self.data)
+
+    def janela(self, inicio=None, fim=None):
+        """Fatia [inicio, fim] (datas) como índices, sem copiar os dados."""
+        i = 0 if inicio is None else int(np.searchsorted(self.data, np.datetime64(inicio, 'D')))
+        j = len(self.data) if fim is None else int(np.searchsorted(self.data, np.datetime64(fim, 'D'), 'right'))
+        return slice(i, j)
+
+    def retornos_diarios(self):
+        fechamento = self.fechamento
+        return fechamento[1:] / fechamento[:-1] - 1
+
+
+def abrir(ticker, pasta=None):
+    return Serie(pasta or pasta_padrao(), ticker.upper())
+
+
+def _gravar_array(caminho, array):
+    # Grava ao lado e troca de uma vez: quem está lendo por mmap continua com o arquivo antigo
+    temporario = caminho.with_name(caminho.name + '.tmp')
+    with open(temporario, 'wb') as arquivo:
+        np.save(arquivo, array)
+    os.replace(temporario, caminho)
+
+
+def anexar(pasta, ticker, datas, colunas, div_datas, div_valores):
+    """Acrescenta ao acervo só as datas posteriores ao que já existe. Devolve (dias, dividendos) novos."""
+    diretorio = Path(pasta) / ticker
+    diretorio.mkdir(parents=True, exist_ok=True)
+    meta = ler_meta(pasta, ticker)
+
+    if meta is None:
+        antigas = {'data': np.array([], dtype='datetime64[D]'),
+                   'div_data': np.array([], dtype='datetime64[D]'),
+                   'div_valor': np.array([], dtype=np.float64),
+                   **{c: np.array([], dtype=np.float64) for c in CAMPOS}}
+    else:
+        serie = Serie(pasta, ticker)
+        antigas = {nome: np.asarray(getattr(serie, nome)) for nome in ('data', 'div_data', 'div_valor', *CAMPOS)}
+
+    ultimo = antigas['data'][-1] if len(antigas['data']) else None
+    novas = slice(None) if ultimo is None else datas > ultimo
+    ultimo_div = antigas['div_data'][-1] if len(antigas['div_data']) else None
+    novos_div = slice(None) if ultimo_div is None else div_datas > ultimo_div
+
+    final = {
+        'data': np.concatenate([antigas['data'], datas[novas]]),
+        'div_data': np.concatenate([antigas['div_data'], div_datas[novos_div]]),
+        'div_valor': np.concatenate([antigas['div_valor'], div_valores[novos_div].astype(np.float64)]),
+        **{c: np.concatenate([antigas[c], colunas[c][novas].astype(np.float64)]) for c in CAMPOS},
+    }
+    for nome, array in final.items():
+        _gravar_array(diretorio / f'{nome}.npy', array)
+
+    meta = {
+        'ticker': ticker,
+        'inicio': str(final['data'][0]) if len(final['data']) else None,
+        'fim': str(final['data'][-1]) if len(final['data']) else None,
+        'linhas': len(final['data']),
+        'dividendos': len(final['div_data']),
+        'atualizado_em': date.today().isoformat(),
+    }
+    temporario = diretorio / 'meta.json.tmp'
+    temporario.write_text(json.dumps(meta))
+    os.replace(temporario, diretorio / 'meta.json')
+    return len(final['data']) - len(antigas['data']), len(final['div_data']) - len(antigas['div_data'])
+
+
+def inicio_incremental(pasta, ticker, desde):
+    """De onde retomar: o dia seguinte ao último gravado, ou `desde` se o ticker é novo."""
+    meta = ler_meta(pasta, ticker)
+    if meta is None or not meta['fim']:
+        return desde
+    return max(desde, date.fromisoformat(meta['fim']) + timedelta(days=1))
+
+
+def baixar(ticker, pasta, inicio):
+    """Baixa e grava a história de um ticker desde `inicio`. Roda num processo do pool."""
+    import yfinance as yf
+
+    from bot.cotacoes import _simbolo
+
+    historico = yf.Ticker(_simbolo(ticker)).history(start=inicio.isoformat(), interval='1d',
+                                                    auto_adjust=False, actions=True)
+    if historico is None or historico.empty:
+        return anexar(pasta, ticker, np.array([], dtype='datetime64[D]'),
+                      {c: np.array([]) for c in CAMPOS},
+                      np.array([], dtype='datetime64[D]'), np.array([]))
+
+    todas_datas = historico.index.tz_localize(None).values.astype('datetime64[D]')
+    # Dividendos antes de filtrar os dias sem fechamento: um provento pode cair num deles
+    if 'Dividends' in historico:
+        valores = historico['Dividends'].to_numpy(dtype=np.float64)
+        div_datas, div_valores = todas_datas[valores > 0], valores[valores > 0]
+    else:
+        div_datas, div_valores = np.array([], dtype='datetime64[D]'), np.array([])
+
+    negociados = historico['Close'].notna().to_numpy()
+    datas = todas_datas[negociados]
+    colunas = {campo: historico[coluna].to_numpy(dtype=np.float64)[negociados]
+               for campo, coluna in COLUNAS_YAHOO.items()}
+    return anexar(pasta, ticker, datas, colunas, div_datas, div_valores)
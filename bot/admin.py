@@ -1,3 +1,12 @@
 from django.contrib import admin
 
+from bot.models import FeriadoB3
+
+
 # Register your models here.
+@admin.register(FeriadoB3)
+class FeriadoB3Admin(admin.ModelAdmin):
+    # A B3 publica o calendário do ano seguinte em dezembro; os novos feriados entram por aqui
+    list_display = ('data', 'descricao')
+    date_hierarchy = 'data'
+    ordering = ('-data',)
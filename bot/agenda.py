@@ -0,0 +1,143 @@
+import logging
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.utils import timezone
+
+from bot.models import FeriadoB3
+
+logger = logging.getLogger(__name__)
+
+FUSO_B3 = ZoneInfo('America/Sao_Paulo')
+
+# Valores padrão; podem ser sobrescritos por FII_AGENDA no settings.py
+PADRAO = {
+    'abertura': time(10, 0),
+    'fechamento': time(18, 0),
+    # Limites do intervalo de polling de cada ticker (segundos)
+    'intervalo_minimo': 60,
+    'intervalo_base': 300,
+    'intervalo_maximo': 1800,
+    # Distância do alvo (%) e volatilidade (%) que mantêm o intervalo base
+    'distancia_referencia': 5.0,
+    'volatilidade_referencia': 0.3,
+    # Peso do retorno mais recente na média móvel exponencial da volatilidade
+    'suavizacao': 0.3,
+}
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'FII_AGENDA', {})}
+
+
+def _limitar(valor, minimo, maximo):
+    return max(minimo, min(maximo, valor))
+
+
+class CalendarioB3:
+    """Sessões de negociação da B3: dias úteis fora da tabela de feriados, no horário do pregão."""
+
+    def __init__(self, feriados=(), abertura=PADRAO['abertura'], fechamento=PADRAO['fechamento']):
+        self.feriados = set(feriados)
+        self.abertura = abertura
+        self.fechamento = fechamento
+
+    @classmethod
+    def carregar(cls, config=None):
+        config = config or configuracao()
+        calendario = cls(FeriadoB3.objects.values_list('data', flat=True),
+                         abertura=config['abertura'], fechamento=config['fechamento'])
+        ano = timezone.now().astimezone(FUSO_B3).year
+        if not any(dia.year == ano for dia in calendario.feriados):
+            # Sem a tabela do ano, todo dia útil parece ter pregão: o vigia roda nos feriados
+            logger.warning("Nenhum feriado da B3 cadastrado para %d; cadastre o calendário no admin (FeriadoB3)", ano)
+        return calendario
+
+    def dia_util(self, dia):
+        return dia.weekday() < 5 and dia not in self.feriados
+
+    def pregao_aberto(self, instante):
+        local = instante.astimezone(FUSO_B3)
+        return self.dia_util(local.date()) and self.abertura <= local.time() < self.fechamento
+
+    def proxima_abertura(self, instante):
+        local = instante.astimezone(FUSO_B3)
+        dia = local.date()
+        if local.time() >= self.abertura:
+            dia += timedelta(days=1)
+        while not self.dia_util(dia):
+            dia += timedelta(days=1)
+        return datetime.combine(dia, self.abertura, tzinfo=FUSO_B3)
+
+
+class _EstadoTicker:
+    __slots__ = ('proxima', 'ultimo_preco', 'volatilidade', 'intervalo')
+
+    def __init__(self):
+        self.proxima = None
+        self.ultimo_preco = None
+        self.volatilidade = None
+        self.intervalo = None
+
+
+class AgendadorAdaptativo:
+    """Decide quais tickers buscar a cada rodada do vigia.
+
+    Fora do pregão nada é buscado. Dentro dele cada ticker tem seu próprio
+    intervalo: encurta quando o preço está perto do alvo ou volátil e alonga
+    quando está longe e parado, sempre entre intervalo_minimo e intervalo_maximo.
+    O relógio é injetável, então dá para simular um dia inteiro em testes.
+    """
+
+    def __init__(self, calendario, relogio=timezone.now, config=None):
+        self.calendario = calendario
+        self.relogio = relogio
+        self.config = config or configuracao()
+        self.estados = {}
+
+    def devidos(self, tickers):
+        agora = self.relogio()
+        if not self.calendario.pregao_aberto(agora):
+            return []
+        devidos = []
+        for ticker in tickers:
+            estado = self.estados.get(ticker)
+            if estado is None or estado.proxima is None or estado.proxima <= agora:
+                devidos.append(ticker)
+        return devidos
+
+    def intervalo(self, preco, alvo, volatilidade):
+        cfg = self.config
+        fator = 1.0
+        if alvo:
+            distancia = abs(preco - alvo) / alvo * 100
+            fator *= _limitar(distancia / cfg['distancia_referencia'], 0.25, 3.0)
+        if volatilidade is not None:
+            fator *= _limitar(cfg['volatilidade_referencia'] / max(volatilidade, 1e-6), 0.25, 3.0)
+        return _limitar(cfg['intervalo_base'] * fator, cfg['intervalo_minimo'], cfg['intervalo_maximo'])
+
+    def registrar(self, ticker, preco, alvo=None):
+        """Anota o preço buscado e agenda a próxima busca do ticker."""
+        estado = self.estados.setdefault(ticker, _EstadoTicker())
+        if estado.ultimo_preco:
+            retorno = abs(preco / estado.ultimo_preco - 1) * 100
+            if estado.volatilidade is None:
+                estado.volatilidade = retorno
+            else:
+                peso = self.config['suavizacao']
+                estado.volatilidade = peso * retorno + (1 - peso) * estado.volatilidade
+        estado.ultimo_preco = preco
+        estado.intervalo = self.intervalo(preco, alvo, estado.volatilidade)
+        estado.proxima = self.relogio() + timedelta(seconds=estado.intervalo)
+        return estado.intervalo
+
+    def segundos_ate_proxima(self):
+        """Quanto falta para algum ticker vencer (ou para o próximo pregão abrir)."""
+        agora = self.relogio()
+        if not self.calendario.pregao_aberto(agora):
+            return (self.calendario.proxima_abertura(agora) - agora).total_seconds()
+        proximas = [e.proxima for e in self.estados.values() if e.proxima is not None]
+        if not proximas:
+            return 0.0
+        return max(0.0, (min(proximas) - agora).total_seconds())
@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, Q, Sum, When
+
+from bot.models import FundoImobiliario
+
+_DINHEIRO = DecimalField(max_digits=20, decimal_places=2)
+
+INVESTIDO = ExpressionWrapper(F('quantidade') * F('preco_medio'), output_field=_DINHEIRO)
+ATUAL = ExpressionWrapper(F('quantidade') * F('preco_atual'), output_field=_DINHEIRO)
+# Média mensal dos proventos de 12 meses (mantida por bot.proventos); sem histórico, o último dividendo
+_PROVENTO_MENSAL = Case(When(media_mensal_dividendos__gt=0, then=F('media_mensal_dividendos')),
+                        default=F('ultimo_dividendo'))
+RENDA = ExpressionWrapper(F('quantidade') * _PROVENTO_MENSAL, output_field=_DINHEIRO)
+# O Magic Number (FundoImobiliario.magic_number) é sempre calculado sobre o último dividendo
+RENDA_MAGIC = ExpressionWrapper(F('quantidade') * F('ultimo_dividendo'), output_field=_DINHEIRO)
+# Preços e dividendos têm centavos exatos; meio centavo de folga absorve o arredondamento do SQLite
+_MEIO_CENTAVO = Decimal('0.005')
+
+
+def normalizar_tipo(tipo):
+    return (tipo or "Tijolo").capitalize()
+
+
+def resumo_carteira(detalhar=True, ordenar='-quantidade'):
+    """Totais, distribuição por tipo e (opcionalmente) resultado por fundo da carteira.
+
+    Tudo é somado pelo banco: uma consulta agrupada por tipo (de onde saem os
+    totais) e, com `detalhar`, uma segunda com as linhas por fundo já anotadas.
+    Os valores monetários voltam como Decimal.
+    """
+    ativos = FundoImobiliario.objects.filter(quantidade__gt=0)
+
+    # Bola de neve atingida: quantidade >= ceil(preço / dividendo) <=> quantidade × dividendo >= preço,
+    # com o mesmo dividendo (o último) do magic_number/progresso_magic de cada fundo
+    por_tipo = (
+        ativos.alias(renda_magic=RENDA_MAGIC)
+        .values('tipo')
+        .annotate(
+            investido=Sum(INVESTIDO),
+            atual=Sum(ATUAL),
+            renda=Sum(RENDA),
+            ativos=Count('id'),
+            magic_atingidos=Count('id', filter=Q(ultimo_dividendo__gt=0, preco_atual__gt=0,
+                                                 renda_magic__gte=F('preco_atual') - _MEIO_CENTAVO)),
+        )
+        .order_by()
+    )
+
+    totais = {'investido': Decimal(0), 'atual': Decimal(0), 'renda': Decimal(0),
+              'ativos': 0, 'magic_atingidos': 0}
+    distribuicao = {}
+    for grupo in por_tipo:
+        for chave in totais:
+            totais[chave] += grupo[chave] or 0
+        tipo = normalizar_tipo(grupo['tipo'])
+        distribuicao[tipo] = distribuicao.get(tipo, 0) + float(grupo['atual'] or 0)
+    totais['lucro'] = totais['atual'] - totais['investido']
+
+    resumo = {'totais': totais, 'distribuicao': distribuicao}
+
+    if detalhar:
+        resumo['fundos'] = list(
+            ativos.annotate(investido=INVESTIDO, atual=ATUAL, renda=RENDA)
+            .annotate(lucro=F('atual') - F('investido'))
+            .order_by(ordenar)
+            .values('ticker', 'tipo', 'quantidade', 'investido', 'atual', 'renda', 'lucro')
+        )
+
+    return resumo
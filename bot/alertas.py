@@ -0,0 +1,185 @@
+import threading
+from bisect import bisect_left, insort
+
+from django.db.models import F
+from django.utils import timezone
+
+from bot.models import RegraAlerta, Versao
+
+# tipo de regra -> (indicador avaliado, +1 dispara abaixo do limite / -1 dispara acima)
+METRICAS = {
+    RegraAlerta.PRECO_ABAIXO: ('preco', 1),
+    RegraAlerta.PRECO_ACIMA: ('preco', -1),
+    RegraAlerta.VARIACAO: ('variacao_abs', -1),
+    RegraAlerta.PVP_ABAIXO: ('pvp', 1),
+    RegraAlerta.DY_ACIMA: ('dy', -1),
+}
+CAMPOS_ESTADO = ['armada', 'ultimo_valor', 'ultimo_disparo']
+# Linha de Versao que muda quando regras ou assinaturas mudam, em qualquer processo
+VERSAO_REGRAS = 'regras'
+
+
+class _Lado:
+    """Regras de um (ticker, tipo) em três listas ordenadas.
+
+    Tudo é guardado com o sinal da direção aplicado (regras "acima de" são
+    negadas), então sempre vale: dispara quando chave >= valor. Assim cada tick
+    só toca as regras que ele realmente pode disparar ou rearmar:
+
+    - armadas:  chave = limite; disparam as do sufixo bisect_left(valor)
+    - rearme:   chave = limite com histerese; rearmam as do prefixo (chave < valor)
+    - reaviso:  chave = último valor avisado ± reaviso; avisam de novo as do sufixo
+    """
+
+    def __init__(self, sinal):
+        self.sinal = sinal
+        self.armadas = []
+        self.rearme = []
+        self.reaviso = []
+
+    def _nivel_rearme(self, regra):
+        return self.sinal * regra.limite * (1 + self.sinal * regra.histerese / 100)
+
+    def _nivel_reaviso(self, regra):
+        return self.sinal * regra.ultimo_valor * (1 - self.sinal * regra.reaviso / 100)
+
+    def adicionar(self, regra):
+        if regra.armada:
+            insort(self.armadas, (self.sinal * regra.limite, regra.id))
+        else:
+            insort(self.rearme, (self._nivel_rearme(regra), regra.id))
+            if regra.reaviso > 0 and regra.ultimo_valor is not None:
+                insort(self.reaviso, (self._nivel_reaviso(regra), regra.id))
+
+    def remover(self, regra):
+        # As chaves são recalculadas do estado atual, então remover antes de mudá-lo
+        if regra.armada:
+            _tirar(self.armadas, (self.sinal * regra.limite, regra.id))
+        else:
+            _tirar(self.rearme, (self._nivel_rearme(regra), regra.id))
+            if regra.reaviso > 0 and regra.ultimo_valor is not None:
+                _tirar(self.reaviso, (self._nivel_reaviso(regra), regra.id))
+
+
+def _tirar(lista, item):
+    i = bisect_left(lista, item)
+    if i < len(lista) and lista[i] == item:
+        del lista[i]
+
+
+def _em_cooldown(regra, agora):
+    return (regra.cooldown and regra.ultimo_disparo is not None
+            and (agora - regra.ultimo_disparo).total_seconds() < regra.cooldown)
+
+
+class IndiceAlertas:
+    """Índice em memória das regras, com avaliação por tick em O(log n + disparos)."""
+
+    def __init__(self, regras):
+        self.regras = {}
+        self.lados = {}  # ticker -> {tipo: _Lado}
+        self.alteradas = set()
+        # Menor alvo "preço abaixo de" de cada ticker, gravado como preço teto do fundo
+        self.tetos = {}
+        for regra in regras:
+            self.regras[regra.id] = regra
+            self._lado(regra).adicionar(regra)
+            if regra.tipo == RegraAlerta.PRECO_ABAIXO:
+                self.tetos[regra.ticker] = min(regra.limite, self.tetos.get(regra.ticker, regra.limite))
+
+    def _lado(self, regra):
+        por_tipo = self.lados.setdefault(regra.ticker, {})
+        if regra.tipo not in por_tipo:
+            por_tipo[regra.tipo] = _Lado(METRICAS[regra.tipo][1])
+        return por_tipo[regra.tipo]
+
+    def tickers(self):
+        return list(self.lados)
+
+    def avaliar(self, ticker, metricas, agora=None):
+        """Avalia as regras de um ticker. Devolve [(regra, valor)] que dispararam.
+
+        `metricas` traz os indicadores do tick: preco, variacao_abs, pvp, dy.
+        """
+        agora = agora or timezone.now()
+        disparos = []
+
+        for tipo, lado in self.lados.get(ticker, {}).items():
+            valor = metricas.get(METRICAS[tipo][0])
+            if valor is None:
+                continue
+            chave = lado.sinal * valor
+
+            # Rearma as regras que já se afastaram o suficiente do limite
+            fim = bisect_left(lado.rearme, (chave, -1))
+            if fim:
+                for _, regra_id in lado.rearme[:fim]:
+                    regra = self.regras[regra_id]
+                    lado.remover(regra)
+                    regra.armada = True
+                    lado.adicionar(regra)
+                    self.alteradas.add(regra)
+
+            inicio = bisect_left(lado.armadas, (chave, -1))
+            candidatas = [self.regras[i] for _, i in lado.armadas[inicio:]]
+            inicio = bisect_left(lado.reaviso, (chave, -1))
+            candidatas += [self.regras[i] for _, i in lado.reaviso[inicio:]]
+
+            for regra in candidatas:
+                if _em_cooldown(regra, agora):
+                    continue
+                lado.remover(regra)
+                regra.armada = False
+                regra.ultimo_valor = valor
+                regra.ultimo_disparo = agora
+                lado.adicionar(regra)
+                self.alteradas.add(regra)
+                disparos.append((regra, valor))
+
+        return disparos
+
+    def retirar_alteradas(self):
+        alteradas, self.alteradas = list(self.alteradas), set()
+        return alteradas
+
+
+_indice = None
+_versao = 0
+_versao_indice = None
+_lock = threading.Lock()
+
+
+def descartar_indice():
+    # Só neste processo: o próximo obter_indice() relê regras e estado do banco
+    global _versao
+    _versao += 1
+
+
+def invalidar_indice(**kwargs):
+    # Chamado pelos sinais quando regras ou assinaturas mudam. O contador no banco
+    # avisa os outros processos do bot, que também guardam o índice em memória.
+    descartar_indice()
+    if not Versao.objects.filter(nome=VERSAO_REGRAS).update(valor=F('valor') + 1):
+        Versao.objects.get_or_create(nome=VERSAO_REGRAS, defaults={'valor': 1})
+
+
+def _versao_banco():
+    return Versao.objects.filter(nome=VERSAO_REGRAS).values_list('valor', flat=True).first() or 0
+
+
+def obter_indice():
+    """Índice das regras de chats ativos; recarregado do banco só quando algo mudou (aqui ou em outro processo)."""
+    global _indice, _versao_indice
+    with _lock:
+        versao = (_versao, _versao_banco())
+        if _indice is None or _versao_indice != versao:
+            regras = RegraAlerta.objects.filter(assinatura__ativa=True).select_related('assinatura')
+            _indice = IndiceAlertas(list(regras))
+            _versao_indice = versao
+        return _indice
+
+
+def salvar_estado(regras):
+    """Grava em lote o estado (armada, último valor, último disparo) das regras alteradas."""
+    if regras:
+        RegraAlerta.objects.bulk_update(regras, CAMPOS_ESTADO)
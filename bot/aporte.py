@@ -0,0 +1,215 @@
+"""Sugestão de aporte: quantas cotas inteiras comprar de cada fundo com o orçamento do mês.
+
+É uma mochila limitada: cada fundo pode receber de 0 a N cotas, o custo é o
+preço e o ganho é a renda mensal adicionada (objetivo "renda") ou o avanço
+rumo ao Magic Number (objetivo "magic"). Só entram fundos no preço teto ou
+abaixo dele. Os pesos-alvo por tipo viram um limite de gasto por tipo.
+
+O orçamento é discretizado em até `resolucao` passos. Cada tipo é resolvido
+por programação dinâmica, com as cotas de cada fundo divididas em potências
+de 2 (1, 2, 4, ... cotas). Os tipos são combinados por convolução max-plus, e
+o troco que a discretização deixa é completado de forma gulosa.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+
+from bot.agregacao import normalizar_tipo, resumo_carteira
+from bot.indicadores import TabelaIndicadores
+from bot.models import FundoImobiliario
+
+RENDA = 'renda'
+MAGIC = 'magic'
+OBJETIVOS = (RENDA, MAGIC)
+
+# Valores padrão; podem ser sobrescritos por FII_APORTE no settings.py
+PADRAO = {
+    # Fração-alvo da carteira por tipo, ex. {'Tijolo': 0.5, 'Papel': 0.3, 'Fof': 0.2}.
+    # Tipos fora do dicionário não têm limite; vazio desliga a restrição.
+    'pesos_tipo': {},
+    # Passos em que o orçamento é dividido na programação dinâmica
+    'resolucao': 5000,
+    # Só os fundos com melhor ganho por real entram na mochila (limita memória e tempo)
+    'maximo_fundos': 300,
+    # Orçamento sugerido no painel do dashboard
+    'aporte_painel': 1000,
+    # Maior aporte aceito no /aporte e em /aporte/?valor=
+    'maximo_orcamento': 10_000_000,
+}
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'FII_APORTE', {})}
+
+
+def orcamento_valido(valor, config=None):
+    """Valor positivo e finito (float() aceita 'nan' e 'inf'), até o `maximo_orcamento`."""
+    config = config or configuracao()
+    return math.isfinite(valor) and 0 < valor <= config['maximo_orcamento']
+
+
+def carregar_universo():
+    """Fundos compráveis (no teto ou abaixo, com provento) e o valor atual da carteira por tipo."""
+    tabela = TabelaIndicadores(FundoImobiliario.objects.filter(preco_atual__gt=0))
+    provento = np.where(tabela.media_mensal_dividendos > 0, tabela.media_mensal_dividendos,
+                        tabela.ultimo_dividendo)
+    compraveis = (tabela.preco_atual <= tabela.preco_teto) & (provento > 0)
+    indices = np.flatnonzero(compraveis)
+    return {
+        'ticker': [tabela.ticker[i] for i in indices],
+        'tipo': [normalizar_tipo(tabela.tipo[i]) for i in indices],
+        'preco': tabela.preco_atual[indices],
+        'provento': provento[indices],
+        'quantidade': tabela.quantidade[indices],
+        'magic_number': tabela.magic_number[indices],
+        'faltam_para_magic': tabela.faltam_para_magic[indices],
+        'distribuicao': resumo_carteira(detalhar=False)['distribuicao'],
+    }
+
+
+def _mochila(custos, ganhos, limites, capacidade):
+    """Mochila limitada por divisão binária. Devolve (melhor ganho por capacidade, reconstrutor)."""
+    pecas = []
+    for i, limite in enumerate(limites):
+        lote = 1
+        while limite > 0:
+            quantidade = min(lote, limite)
+            if custos[i] * quantidade <= capacidade:
+                pecas.append((i, quantidade))
+            limite -= quantidade
+            lote *= 2
+
+    # melhor[b] = maior ganho gastando no máximo b passos; escolhas guarda as peças usadas
+    melhor = np.zeros(capacidade + 1)
+    escolhas = np.zeros((len(pecas), capacidade + 1), dtype=bool)
+    for p, (i, quantidade) in enumerate(pecas):
+        custo = custos[i] * quantidade
+        candidato = melhor[:capacidade + 1 - custo] + ganhos[i] * quantidade
+        ganha = candidato > melhor[custo:]
+        escolhas[p, custo:] = ganha
+        melhor[custo:] = np.where(ganha, candidato, melhor[custo:])
+
+    def reconstruir(capacidade_usada):
+        cotas = np.zeros(len(custos), dtype=np.int64)
+        b = capacidade_usada
+        for p in range(len(pecas) - 1, -1, -1):
+            if escolhas[p, b]:
+                i, quantidade = pecas[p]
+                cotas[i] += quantidade
+                b -= custos[i] * quantidade
+        return cotas
+
+    return melhor, reconstruir
+
+
+def _combinar(acumulado, grupo):
+    """Convolução max-plus: o melhor ganho dividindo cada orçamento entre o acumulado e o grupo."""
+    tamanho = len(acumulado)
+    combinado = np.full(tamanho, -np.inf)
+    corte = np.zeros(tamanho, dtype=np.int64)
+    for j in range(min(len(grupo), tamanho)):
+        candidato = acumulado[:tamanho - j] + grupo[j]
+        ganha = candidato > combinado[j:]
+        combinado[j:][ganha] = candidato[ganha]
+        corte[j:][ganha] = j
+    return combinado, corte
+
+
+def resolver(universo, orcamento, objetivo=RENDA, config=None):
+    """Cotas por fundo que maximizam o objetivo dentro do orçamento e dos limites por tipo."""
+    if objetivo not in OBJETIVOS:
+        raise ValueError(f"Objetivo desconhecido: {objetivo}")
+    config = config or configuracao()
+    if not orcamento_valido(orcamento, config):
+        raise ValueError(f"Orçamento inválido: {orcamento}")
+    preco = np.asarray(universo['preco'], dtype=np.float64)
+    tipos = universo['tipo']
+
+    if objetivo == RENDA:
+        ganho = np.asarray(universo['provento'], dtype=np.float64)
+        teto_cotas = np.floor(orcamento / preco)
+    else:
+        # Cada cota vale a fração do Magic Number que ela completa; depois dele, nada
+        magic = np.asarray(universo['magic_number'], dtype=np.float64)
+        ganho = np.divide(1.0, magic, out=np.zeros_like(magic), where=magic > 0)
+        teto_cotas = np.minimum(np.floor(orcamento / preco), universo['faltam_para_magic'])
+
+    # Limite de gasto por tipo: alvo × (carteira + aporte) − o que o tipo já tem
+    distribuicao = universo['distribuicao']
+    patrimonio = sum(distribuicao.values()) + orcamento
+    limite_tipo = {tipo: max(0.0, peso * patrimonio - distribuicao.get(tipo, 0.0))
+                   for tipo, peso in config['pesos_tipo'].items()}
+
+    candidatos = [i for i in range(len(preco)) if ganho[i] > 0 and teto_cotas[i] > 0
+                  and limite_tipo.get(tipos[i], orcamento) >= preco[i]]
+    candidatos.sort(key=lambda i: ganho[i] / preco[i], reverse=True)
+    candidatos = candidatos[:config['maximo_fundos']]
+
+    passo = max(0.01, orcamento / config['resolucao'])
+    capacidade = int(orcamento / passo)
+    # Custo arredondado para cima: a solução discreta nunca estoura o orçamento real
+    custos = {i: max(1, math.ceil(preco[i] / passo - 1e-9)) for i in candidatos}
+
+    grupos = {}
+    for i in candidatos:
+        grupos.setdefault(tipos[i] if tipos[i] in limite_tipo else None, []).append(i)
+
+    cotas = np.zeros(len(preco), dtype=np.int64)
+    resolvidos = []
+    acumulado = np.zeros(capacidade + 1)
+    for tipo, indices in grupos.items():
+        limite = capacidade if tipo is None else min(capacidade, int(limite_tipo[tipo] / passo))
+        melhor, reconstruir = _mochila([custos[i] for i in indices], ganho[indices],
+                                       [int(teto_cotas[i]) for i in indices], limite)
+        # Com menos orçamento que o limite, o grupo fica no melhor valor que alcança
+        grupo = np.concatenate([melhor, np.full(max(0, capacidade - limite), melhor[-1])])[:capacidade + 1]
+        acumulado, corte = _combinar(acumulado, grupo)
+        resolvidos.append((indices, reconstruir, corte, limite))
+
+    b = int(np.argmax(acumulado)) if len(acumulado) else 0
+    for indices, reconstruir, corte, limite in reversed(resolvidos):
+        parte = int(corte[b])
+        cotas[indices] += reconstruir(min(parte, limite))
+        b -= parte
+
+    # A discretização deixa troco: completa com as cotas de maior ganho por real que ainda cabem
+    gasto_tipo = {}
+    for i in np.flatnonzero(cotas):
+        gasto_tipo[tipos[i]] = gasto_tipo.get(tipos[i], 0.0) + cotas[i] * preco[i]
+    sobra = orcamento - float((cotas * preco).sum())
+    for i in candidatos:
+        folga = min(sobra, limite_tipo.get(tipos[i], math.inf) - gasto_tipo.get(tipos[i], 0.0))
+        extra = int(min(teto_cotas[i] - cotas[i], folga // preco[i]))
+        if extra > 0:
+            cotas[i] += extra
+            sobra -= extra * preco[i]
+            gasto_tipo[tipos[i]] = gasto_tipo.get(tipos[i], 0.0) + extra * preco[i]
+
+    compras = []
+    for i in np.flatnonzero(cotas):
+        quantidade = int(cotas[i])
+        compras.append({
+            'ticker': universo['ticker'][i],
+            'tipo': tipos[i],
+            'cotas': quantidade,
+            'preco': float(preco[i]),
+            'custo': quantidade * float(preco[i]),
+            'renda': quantidade * float(universo['provento'][i]),
+            'quantidade': int(universo['quantidade'][i]),
+            'magic_number': int(universo['magic_number'][i]),
+        })
+    compras.sort(key=lambda c: c['custo'], reverse=True)
+    gasto = sum(c['custo'] for c in compras)
+    return {
+        'objetivo': objetivo,
+        'orcamento': float(orcamento),
+        'compras': compras,
+        'gasto': gasto,
+        'sobra': float(orcamento) - gasto,
+        'renda': sum(c['renda'] for c in compras),
+    }
+
+
+def sugerir(orcamento, objetivo=RENDA, config=None):
+    return resolver(carregar_universo(), orcamento, objetivo, config)
@@ -0,0 +1,70 @@
+from django.db import transaction
+
+from bot.alertas import invalidar_indice
+from bot.models import Assinatura, RegraAlerta
+from bot.tarefas import garantir_fechamento
+
+
+def ativar(chat_id, alvos_padrao):
+    """Ativa (ou reativa) o chat. Um chat novo, sem regras, começa com `alvos_padrao`."""
+    with transaction.atomic():
+        assinatura, _ = Assinatura.objects.get_or_create(chat_id=chat_id)
+        if not assinatura.ativa:
+            assinatura.ativa = True
+            assinatura.save(update_fields=['ativa'])
+        if not assinatura.regras.exists():
+            RegraAlerta.objects.bulk_create([
+                RegraAlerta(assinatura=assinatura, ticker=ticker.upper(), tipo=RegraAlerta.PRECO_ABAIXO,
+                            limite=float(preco))
+                for ticker, preco in alvos_padrao.items()
+            ])
+            # bulk_create não dispara sinais
+            invalidar_indice()
+        garantir_fechamento(assinatura)
+    return assinatura
+
+
+def desativar(chat_id):
+    assinatura = Assinatura.objects.filter(chat_id=chat_id).first()
+    if assinatura and assinatura.ativa:
+        assinatura.ativa = False
+        assinatura.save(update_fields=['ativa'])
+
+
+def definir_alvo(chat_id, ticker, preco):
+    """Troca o alvo de compra (regra "preço abaixo de") do chat; preço zero remove."""
+    with transaction.atomic():
+        assinatura, _ = Assinatura.objects.get_or_create(chat_id=chat_id)
+        ticker = ticker.upper()
+        for regra in RegraAlerta.objects.filter(assinatura=assinatura, ticker=ticker,
+                                                tipo=RegraAlerta.PRECO_ABAIXO):
+            regra.delete()
+        if preco <= 0:
+            return None
+        return RegraAlerta.objects.create(assinatura=assinatura, ticker=ticker,
+                                          tipo=RegraAlerta.PRECO_ABAIXO, limite=float(preco))
+
+
+def listar_alvos(chat_id):
+    return list(
+        RegraAlerta.objects.filter(assinatura__chat_id=chat_id, tipo=RegraAlerta.PRECO_ABAIXO)
+        .order_by('ticker').values_list('ticker', 'limite')
+    )
+
+
+def criar_regra(chat_id, ticker, tipo, limite, cooldown=0):
+    assinatura, _ = Assinatura.objects.get_or_create(chat_id=chat_id)
+    return RegraAlerta.objects.create(assinatura=assinatura, ticker=ticker.upper(), tipo=tipo,
+                                      limite=limite, cooldown=cooldown)
+
+
+def remover_regra(chat_id, regra_id):
+    regra = RegraAlerta.objects.filter(assinatura__chat_id=chat_id, pk=regra_id).first()
+    if regra is None:
+        return False
+    regra.delete()
+    return True
+
+
+def listar_regras(chat_id):
+    return list(RegraAlerta.objects.filter(assinatura__chat_id=chat_id).order_by('ticker', 'tipo', 'limite'))
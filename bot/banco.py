@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.db import close_old_connections, connections, transaction
+
+from bot import telemetria
+
+logger = logging.getLogger(__name__)
+
+# Quantas escritas pendentes entram numa mesma transação (um único fsync)
+LOTE_MAXIMO = 64
+# Conexões de leitura: uma por thread, mantidas abertas (CONN_MAX_AGE=None)
+LEITORES = 4
+
+
+class EscritorBanco:
+    """Thread única por onde passam todas as escritas no SQLite.
+
+    As escritas pendentes são agrupadas numa só transação; cada uma roda no
+    seu próprio savepoint, então a falha de uma não desfaz as outras. Com um
+    único escritor não há disputa pelo lock de escrita dentro do processo.
+    """
+
+    def __init__(self, lote_maximo=LOTE_MAXIMO):
+        self.lote_maximo = lote_maximo
+        self.fila = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.lotes = 0
+        self.escritas = 0
+
+    def _garantir_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._rodar, name='escritor-banco', daemon=True)
+                self._thread.start()
+
+    def enviar(self, func, *args, **kwargs):
+        """Agenda `func` na thread escritora. Devolve um concurrent.futures.Future."""
+        futuro = Future()
+        self.fila.put((func, args, kwargs, futuro))
+        self._garantir_thread()
+        return futuro
+
+    def parar(self):
+        """Grava o que já está na fila, fecha a conexão da thread escritora e a encerra.
+
+        A próxima escrita sobe outra thread, com uma conexão nova.
+        """
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self.fila.put(None)
+            thread.join()
+
+    def _rodar(self):
+        while True:
+            lote = [self.fila.get()]
+            while lote[-1] is not None and len(lote) < self.lote_maximo:
+                try:
+                    lote.append(self.fila.get_nowait())
+                except queue.Empty:
+                    break
+            parar = lote[-1] is None
+            if parar:
+                lote.pop()
+            if lote:
+                self._executar(lote)
+            if parar:
+                connections.close_all()
+                return
+
+    def _executar(self, lote):
+        close_old_connections()
+        resultados = []
+        try:
+            with transaction.atomic():
+                for func, args, kwargs, futuro in lote:
+                    if not futuro.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with transaction.atomic():
+                            resultados.append((futuro, func(*args, **kwargs), None))
+                    except Exception as e:
+                        resultados.append((futuro, None, e))
+        except Exception as e:
+            # Falhou o commit do lote inteiro: ninguém foi gravado
+            logger.exception("Falha ao gravar lote de %d escritas", len(lote))
+            resultados = [(futuro, None, e) for _, _, _, futuro in lote if not futuro.cancelled()]
+
+        self.lotes += 1
+        self.escritas += len(resultados)
+        # Só responde depois do commit, para quem espera ver o dado gravado
+        for futuro, resultado, erro in resultados:
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(resultado)
+
+
+def _ler(func, args, kwargs):
+    close_old_connections()
+    return func(*args, **kwargs)
+
+
+escritor = EscritorBanco()
+_leitores = ThreadPoolExecutor(max_workers=LEITORES, thread_name_prefix='leitor-banco')
+
+
+def fechar_conexoes():
+    """Fecha as conexões do escritor e dos leitores; as próximas operações abrem conexões novas.
+
+    As conexões ficam abertas (CONN_MAX_AGE=None), então trocar o banco do
+    settings (ex.: o banco descartável do reproduzir_updates) exige isto.
+    """
+    global _leitores
+    escritor.parar()
+
+    antigos = _leitores
+    _leitores = ThreadPoolExecutor(max_workers=LEITORES, thread_name_prefix='leitor-banco')
+    # Uma tarefa por thread do pool antigo: a barreira impede que uma thread pegue duas
+    barreira = threading.Barrier(LEITORES)
+
+    def fechar():
+        barreira.wait()
+        connections.close_all()
+
+    for _ in range(LEITORES):
+        antigos.submit(fechar)
+    antigos.shutdown(wait=True)
+
+
+async def escrever(func, *args, **kwargs):
+    """Executa uma função de escrita na thread escritora e aguarda o commit."""
+    telemetria.BANCO_OPERACOES.inc(handler=telemetria.handler_atual.get(), tipo='escrita')
+    with telemetria.BANCO_SEGUNDOS.cronometrar(tipo='escrita'):
+        return await asyncio.wrap_future(escritor.enviar(func, *args, **kwargs))
+
+
+async def ler(func, *args, **kwargs):
+    """Executa uma função só de leitura no pool de conexões de leitura."""
+    loop = asyncio.get_running_loop()
+    telemetria.BANCO_OPERACOES.inc(handler=telemetria.handler_atual.get(), tipo='leitura')
+    with telemetria.BANCO_SEGUNDOS.cronometrar(tipo='leitura'):
+        return await loop.run_in_executor(_leitores, _ler, func, args, kwargs)
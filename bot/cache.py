@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Voo:
+    """Busca em andamento para uma chave; quem chega depois só espera."""
+
+    def __init__(self):
+        self.pronto = threading.Event()
+        self.valor = None
+        self.erro = None
+
+
+class CacheTTL:
+    """Cache em memória com expiração (TTL), descarte LRU e single-flight.
+
+    Chamadas concorrentes para a mesma chave disparam uma única busca no
+    provedor; as demais threads aguardam e recebem o mesmo resultado.
+    Valores None (falha na busca) não são guardados.
+    """
+
+    def __init__(self, ttl=60, max_itens=1024, relogio=time.monotonic):
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self.relogio = relogio
+        self._itens = OrderedDict()  # chave -> (expira_em, valor)
+        self._em_voo = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalescidos = 0
+        self.descartes = 0
+
+    def _ler(self, chave, agora):
+        item = self._itens.get(chave)
+        if item is None:
+            return None
+        expira_em, valor = item
+        if expira_em <= agora:
+            del self._itens[chave]
+            return None
+        self._itens.move_to_end(chave)
+        return valor
+
+    def _gravar(self, chave, valor, agora):
+        if valor is None:
+            return
+        self._itens[chave] = (agora + self.ttl, valor)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
+            self.descartes += 1
+
+    def definir(self, chave, valor, idade=0):
+        """Grava um valor conhecido (ex.: último preço salvo no banco)."""
+        with self._lock:
+            self._gravar(chave, valor, self.relogio() - idade)
+
+    def invalidar(self, chave=None):
+        with self._lock:
+            if chave is None:
+                self._itens.clear()
+            else:
+                self._itens.pop(chave, None)
+
+    def obter(self, chave, carregar):
+        return self.obter_muitos([chave], lambda chaves: {c: carregar(c) for c in chaves})[chave]
+
+    def obter_muitos(self, chaves, carregar_lote):
+        """Resolve várias chaves; só as ausentes e sem busca em voo vão para `carregar_lote`."""
+        resultado = {}
+        lider = {}
+        esperando = {}
+
+        with self._lock:
+            agora = self.relogio()
+            for chave in dict.fromkeys(chaves):
+                valor = self._ler(chave, agora)
+                if valor is not None:
+                    self.hits += 1
+                    resultado[chave] = valor
+                elif chave in self._em_voo:
+                    self.coalescidos += 1
+                    esperando[chave] = self._em_voo[chave]
+                else:
+                    self.misses += 1
+                    lider[chave] = self._em_voo[chave] = _Voo()
+
+        if lider:
+            try:
+                carregados = carregar_lote(list(lider)) or {}
+            except Exception as e:
+                carregados, erro = {}, e
+            else:
+                erro = None
+
+            with self._lock:
+                agora = self.relogio()
+                for chave, voo in lider.items():
+                    voo.valor, voo.erro = carregados.get(chave), erro
+                    self._gravar(chave, voo.valor, agora)
+                    del self._em_voo[chave]
+                    voo.pronto.set()
+
+            if erro is not None:
+                raise erro
+            for chave, voo in lider.items():
+                resultado[chave] = voo.valor
+
+        for chave, voo in esperando.items():
+            voo.pronto.wait()
+            if voo.erro is not None:
+                raise voo.erro
+            resultado[chave] = voo.valor
+
+        return resultado
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalescidos': self.coalescidos,
+                'descartes': self.descartes,
+                'tamanho': len(self._itens),
+                'taxa_acerto': (self.hits / total) if total else 0.0,
+            }
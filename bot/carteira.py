@@ -0,0 +1,186 @@
+from decimal import Decimal
+
+from django.db import transaction
+
+from bot.models import FundoImobiliario, Operacao, Posicao
+
+CENTAVOS = Decimal('0.01')
+# Mesma precisão dos campos de Posicao, para o cálculo incremental e o
+# recálculo a partir do livro chegarem exatamente ao mesmo valor
+PRECISAO = Decimal('0.000001')
+
+
+class OperacaoInvalida(ValueError):
+    pass
+
+
+def aplicar(posicao, tipo, quantidade, preco):
+    """Aplica uma operação à posição em O(1). Devolve o lucro realizado na operação.
+
+    Usa custo médio: a venda realiza (preço - médio) × quantidade e não altera o
+    preço médio; a amortização devolve capital e reduz o custo da posição.
+    """
+    preco = Decimal(preco)
+
+    if tipo == Operacao.COMPRA:
+        posicao.quantidade += quantidade
+        posicao.custo_total += preco * quantidade
+        return Decimal(0)
+
+    if tipo == Operacao.VENDA:
+        if quantidade > posicao.quantidade:
+            raise OperacaoInvalida(f"Você só tem {posicao.quantidade} cotas.")
+        custo_vendido = (posicao.custo_total * quantidade / posicao.quantidade).quantize(PRECISAO)
+        lucro = preco * quantidade - custo_vendido
+        posicao.quantidade -= quantidade
+        posicao.custo_total = posicao.custo_total - custo_vendido if posicao.quantidade else Decimal(0)
+        posicao.lucro_realizado += lucro
+        return lucro
+
+    if tipo == Operacao.AMORTIZACAO:
+        valor = preco * quantidade
+        posicao.custo_total = max(posicao.custo_total - valor, Decimal(0))
+        posicao.amortizado += valor
+        return Decimal(0)
+
+    raise OperacaoInvalida(f"Tipo de operação desconhecido: {tipo}")
+
+
+def _espelhar(fundo, posicao):
+    # FundoImobiliario continua expondo quantidade/preço médio para bot e dashboard
+    fundo.quantidade = posicao.quantidade
+    fundo.preco_medio = posicao.preco_medio.quantize(CENTAVOS)
+
+
+def registrar_operacao(ticker, tipo, quantidade, preco, tipo_fundo=None, data=None):
+    """Grava a operação no livro e atualiza a posição materializada.
+
+    Devolve (posição, lucro realizado). Levanta OperacaoInvalida se a venda
+    for maior que a posição.
+    """
+    if quantidade <= 0:
+        raise OperacaoInvalida("A quantidade precisa ser positiva.")
+    # O livro guarda centavos: a posição é calculada com o mesmo preço que fica gravado,
+    # senão a reconstrução a partir das operações não bate com a posição materializada
+    preco = Decimal(str(preco)).quantize(CENTAVOS)
+    if preco <= 0:
+        raise OperacaoInvalida("O preço precisa ser positivo.")
+
+    with transaction.atomic():
+        fundo, _ = FundoImobiliario.objects.get_or_create(ticker=ticker.upper())
+        posicao, _ = Posicao.objects.select_for_update().get_or_create(fundo=fundo)
+
+        if tipo == Operacao.AMORTIZACAO:
+            # A amortização vale para todas as cotas em carteira
+            quantidade = posicao.quantidade
+            if quantidade == 0:
+                raise OperacaoInvalida(f"Você não tem cotas de {fundo.ticker}.")
+
+        lucro = aplicar(posicao, tipo, quantidade, preco)
+        operacao = Operacao(fundo=fundo, tipo=tipo, quantidade=quantidade, preco=preco)
+        if data is not None:
+            operacao.data = data
+        operacao.save()
+        posicao.save()
+
+        _espelhar(fundo, posicao)
+        campos = ['quantidade', 'preco_medio', 'atualizado_em']
+        if tipo_fundo:
+            fundo.tipo = tipo_fundo
+            campos.append('tipo')
+        fundo.save(update_fields=campos)
+
+    return posicao, lucro
+
+
+def _salvar_reconstrucao(fundo_id, calculada, existentes, verificar, divergencias):
+    atual = existentes.get(fundo_id)
+    campos = ('quantidade', 'custo_total', 'lucro_realizado', 'amortizado')
+    if atual is not None and all(getattr(atual, c) == getattr(calculada, c) for c in campos):
+        return
+
+    divergencias.append((fundo_id, atual, calculada))
+    if verificar:
+        return
+
+    if atual is None:
+        calculada.save()
+    else:
+        for c in campos:
+            setattr(atual, c, getattr(calculada, c))
+        atual.save()
+        calculada = atual
+
+    fundo = FundoImobiliario.objects.get(pk=fundo_id)
+    _espelhar(fundo, calculada)
+    fundo.save(update_fields=['quantidade', 'preco_medio', 'atualizado_em'])
+
+
+def _posicao_vazia(fundo_id):
+    return Posicao(fundo_id=fundo_id, custo_total=Decimal(0), lucro_realizado=Decimal(0), amortizado=Decimal(0))
+
+
+def conferir_livro(fundos=None):
+    """Aplica o livro em memória, sem gravar nada, na ordem da reconstrução.
+
+    Devolve {fundo_id: motivo} dos fundos em que ele não fecha (ex.: venda
+    maior que a posição, num extrato sem as compras anteriores).
+    """
+    operacoes = Operacao.objects.order_by('fundo_id', 'data', 'id')
+    if fundos is not None:
+        operacoes = operacoes.filter(fundo_id__in=fundos)
+    problemas = {}
+    fundo_atual, calculada = None, None
+    linhas = operacoes.values_list('fundo_id', 'tipo', 'quantidade', 'preco').iterator(chunk_size=2000)
+    for fundo_id, tipo, quantidade, preco in linhas:
+        if fundo_id != fundo_atual:
+            fundo_atual, calculada = fundo_id, _posicao_vazia(fundo_id)
+        if fundo_id in problemas:
+            continue
+        try:
+            aplicar(calculada, tipo, quantidade, preco)
+        except OperacaoInvalida as e:
+            problemas[fundo_id] = str(e)
+    return problemas
+
+
+def reconstruir_posicoes(verificar=False, fundos=None):
+    """Refaz as posições a partir do livro numa única passada em streaming.
+
+    As operações são lidas em ordem (fundo, data, id) com `iterator()`, então só
+    a posição do fundo corrente fica em memória. Com `verificar=True` nada é
+    gravado. Devolve a lista de divergências (fundo_id, gravada, calculada).
+    """
+    operacoes = Operacao.objects.order_by('fundo_id', 'data', 'id')
+    posicoes = Posicao.objects.all()
+    if fundos is not None:
+        operacoes = operacoes.filter(fundo_id__in=fundos)
+        posicoes = posicoes.filter(fundo_id__in=fundos)
+    existentes = {p.fundo_id: p for p in posicoes}
+    divergencias = []
+    vistos = set()
+
+    with transaction.atomic():
+        fundo_atual, calculada = None, None
+        linhas = operacoes.values_list('fundo_id', 'tipo', 'quantidade', 'preco').iterator(chunk_size=2000)
+        for fundo_id, tipo, quantidade, preco in linhas:
+            if fundo_id != fundo_atual:
+                if calculada is not None:
+                    _salvar_reconstrucao(fundo_atual, calculada, existentes, verificar, divergencias)
+                    vistos.add(fundo_atual)
+                fundo_atual, calculada = fundo_id, _posicao_vazia(fundo_id)
+            try:
+                aplicar(calculada, tipo, quantidade, preco)
+            except OperacaoInvalida as e:
+                ticker = FundoImobiliario.objects.filter(pk=fundo_id).values_list('ticker', flat=True).first()
+                raise OperacaoInvalida(f"{ticker}: {e}") from e
+        if calculada is not None:
+            _salvar_reconstrucao(fundo_atual, calculada, existentes, verificar, divergencias)
+            vistos.add(fundo_atual)
+
+        # Posições sem nenhuma operação no livro devem estar zeradas
+        for fundo_id, atual in existentes.items():
+            if fundo_id not in vistos:
+                _salvar_reconstrucao(fundo_id, _posicao_vazia(fundo_id), existentes, verificar, divergencias)
+
+    return divergencias
@@ -0,0 +1,189 @@
+"""Leases no banco para rodar vários processos do bot ao mesmo tempo.
+
+Os tickers são divididos em `fatias` por hash (crc32, estável entre
+processos). Cada processo (Trabalhador) renova a cada ciclo um lease de
+presença e os leases das fatias que possui, e tenta ficar com
+ceil(fatias / processos vivos) delas. Quem morre para de renovar, e as fatias
+dele vencem e são assumidas pelos outros no ciclo seguinte. O vigia de cada
+processo só busca e avalia os tickers das suas fatias, então nenhum alerta
+sai duplicado. Recursos únicos (o long polling, os jobs diários) usam o
+mesmo mecanismo.
+
+Toda a coordenação é feita com UPDATE condicional ("é meu ou já venceu"),
+que o SQLite em WAL serializa entre processos.
+"""
+import logging
+import math
+import os
+import socket
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from bot.models import Concessao
+
+logger = logging.getLogger(__name__)
+
+# Valores padrão; podem ser sobrescritos por FII_CONCESSOES no settings.py
+PADRAO = {
+    'fatias': 16,
+    # Segundos sem renovação até um lease ser considerado abandonado
+    'validade': 30,
+    # Intervalo entre ciclos de renovação (bem menor que a validade)
+    'renovacao': 10,
+}
+PREFIXO_FATIA = 'fatia:'
+PREFIXO_TRABALHADOR = 'trabalhador:'
+UPDATES = 'updates'
+# Data no passado para recursos livres
+LIVRE = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'FII_CONCESSOES', {})}
+
+
+def fatia_ticker(ticker, fatias):
+    return zlib.crc32(ticker.upper().encode()) % fatias
+
+
+def fatia_chat(chat_id, fatias):
+    return zlib.crc32(str(chat_id).encode()) % fatias
+
+
+def _nome_fatia(numero):
+    return f"{PREFIXO_FATIA}{numero:03d}"
+
+
+def _disponivel(dono, agora):
+    # Livre, vencido ou já deste dono
+    return Q(dono=dono) | Q(dono='') | Q(expira_em__lt=agora)
+
+
+def adquirir(recurso, dono, validade, agora=None):
+    """Pega (ou renova) o recurso se estiver livre, vencido ou já for deste dono."""
+    agora = agora or timezone.now()
+    expira = agora + timedelta(seconds=validade)
+    if Concessao.objects.filter(_disponivel(dono, agora), recurso=recurso).update(
+            dono=dono, expira_em=expira, renovada_em=agora):
+        return True
+    try:
+        # Savepoint: a violação de unicidade não pode abortar a transação de quem chamou
+        with transaction.atomic():
+            Concessao.objects.create(recurso=recurso, dono=dono, expira_em=expira, renovada_em=agora)
+    except IntegrityError:
+        # Já existe e está com outro processo (ou outro processo acabou de criar)
+        return False
+    return True
+
+
+def liberar(recursos, dono):
+    """Devolve os recursos na hora (sem esperar vencer)."""
+    return Concessao.objects.filter(recurso__in=list(recursos), dono=dono).update(dono='', expira_em=LIVRE)
+
+
+class Trabalhador:
+    """Um processo do bot: mantém a presença, equilibra as fatias e responde quem é dono de quê."""
+
+    def __init__(self, identificador=None, config=None, relogio=timezone.now):
+        self.config = config or configuracao()
+        self.identificador = identificador or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.relogio = relogio
+        self.total_fatias = self.config['fatias']
+        self.fatias = set()
+        self.recursos = set()
+
+    @classmethod
+    def sozinho(cls, config=None):
+        """Processo único, dono de todas as fatias, sem passar pelo banco (benchmark, testes)."""
+        trabalhador = cls(identificador='sozinho', config=config)
+        trabalhador.fatias = set(range(trabalhador.total_fatias))
+        return trabalhador
+
+    @property
+    def presenca(self):
+        return f"{PREFIXO_TRABALHADOR}{self.identificador}"
+
+    def possui_ticker(self, ticker):
+        return fatia_ticker(ticker, self.total_fatias) in self.fatias
+
+    def possui_chat(self, chat_id):
+        return fatia_chat(chat_id, self.total_fatias) in self.fatias
+
+    def filtrar_tickers(self, tickers):
+        return [t for t in tickers if self.possui_ticker(t)]
+
+    def ciclo(self):
+        """Renova, equilibra e devolve (fatias ganhas, fatias perdidas). Roda no escritor do banco."""
+        # Uma transação só (IMMEDIATE): o ciclo inteiro de um processo não se intercala com o de outro
+        with transaction.atomic():
+            return self._ciclo()
+
+    def _ciclo(self):
+        agora = self.relogio()
+        validade = self.config['validade']
+        adquirir(self.presenca, self.identificador, validade, agora)
+
+        nomes = [_nome_fatia(n) for n in range(self.total_fatias)]
+        Concessao.objects.bulk_create([Concessao(recurso=nome, expira_em=LIVRE) for nome in nomes],
+                                      ignore_conflicts=True)
+        vivos = Concessao.objects.filter(recurso__startswith=PREFIXO_TRABALHADOR, expira_em__gte=agora).count()
+        alvo = math.ceil(self.total_fatias / max(vivos, 1))
+
+        # Renova o que já é meu; o que não renovou foi perdido (vencido e assumido por outro)
+        minhas = set(Concessao.objects.filter(recurso__in=nomes, dono=self.identificador, expira_em__gte=agora)
+                     .values_list('recurso', flat=True))
+        Concessao.objects.filter(recurso__in=minhas, dono=self.identificador).update(
+            expira_em=agora + timedelta(seconds=validade), renovada_em=agora)
+
+        if len(minhas) > alvo:
+            # Chegou processo novo: devolve o excedente para ele pegar
+            sobrando = sorted(minhas)[alvo:]
+            liberar(sobrando, self.identificador)
+            minhas -= set(sobrando)
+        elif len(minhas) < alvo:
+            livres = list(Concessao.objects.filter(_disponivel(self.identificador, agora), recurso__in=nomes)
+                          .exclude(recurso__in=minhas).values_list('recurso', flat=True))
+            # Cada processo começa a procurar num ponto diferente, para não disputarem a mesma fatia
+            livres.sort(key=lambda nome: zlib.crc32((self.identificador + nome).encode()))
+            for nome in livres:
+                if len(minhas) >= alvo:
+                    break
+                if adquirir(nome, self.identificador, validade, agora):
+                    minhas.add(nome)
+
+        # Presenças vencidas há muito tempo são só lixo
+        Concessao.objects.filter(recurso__startswith=PREFIXO_TRABALHADOR,
+                                 expira_em__lt=agora - timedelta(seconds=validade * 10)).delete()
+
+        atuais = {int(nome[len(PREFIXO_FATIA):]) for nome in minhas}
+        ganhas, perdidas = atuais - self.fatias, self.fatias - atuais
+        self.fatias = atuais
+        if ganhas or perdidas:
+            logger.info("%s: fatias %s (vivos: %d, +%d -%d)", self.identificador, sorted(atuais), vivos,
+                        len(ganhas), len(perdidas))
+        return ganhas, perdidas
+
+    def manter(self, recurso):
+        """Tenta pegar/renovar um recurso único (ex.: o long polling). Roda no escritor do banco."""
+        if adquirir(recurso, self.identificador, self.config['validade'], self.relogio()):
+            self.recursos.add(recurso)
+            return True
+        self.recursos.discard(recurso)
+        return False
+
+    def exclusivo(self, recurso, segundos):
+        """Pega um recurso por `segundos` sem renovar: garante que só um processo rode um job diário."""
+        return adquirir(recurso, self.identificador, segundos, self.relogio())
+
+    def encerrar(self):
+        """Devolve tudo ao sair, para os outros processos assumirem sem esperar a validade."""
+        nomes = [_nome_fatia(n) for n in self.fatias] + list(self.recursos) + [self.presenca]
+        liberar(nomes, self.identificador)
+        Concessao.objects.filter(recurso=self.presenca).delete()
+        self.fatias, self.recursos = set(), set()
@@ -0,0 +1,216 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from bot import telemetria
+from bot.cache import CacheTTL
+
+logger = logging.getLogger(__name__)
+
+# Limite de chamadas simultâneas ao Yahoo quando o lote não resolve tudo
+MAX_CONCORRENCIA = 8
+# Por quanto tempo uma cotação é reaproveitada entre chats/jobs (segundos)
+TTL_COTACOES = 60
+# O nome do fundo quase nunca muda: uma consulta por dia basta
+TTL_NOMES = 24 * 60 * 60
+
+
+def _simbolo(ticker):
+    ticker = ticker.upper().strip()
+    return ticker if ticker.endswith('.SA') else f"{ticker}.SA"
+
+
+def _ticker(simbolo):
+    return simbolo[:-3] if simbolo.endswith('.SA') else simbolo
+
+
+class ProvedorCotacoes:
+    """Interface dos provedores de cotação.
+
+    `buscar` recebe um conjunto de tickers e devolve {TICKER: preço ou None}
+    resolvendo tudo de uma vez, em vez de uma chamada por ativo.
+    """
+
+    def buscar(self, tickers):
+        raise NotImplementedError
+
+    def dividendos(self, tickers, desde):
+        """Proventos por cota pagos desde `desde`: {TICKER: [(data, valor)]}."""
+        return {}
+
+    def nomes(self, tickers):
+        """Nome completo de cada fundo: {TICKER: nome ou None}."""
+        return {}
+
+
+class ProvedorYahoo(ProvedorCotacoes):
+    def __init__(self, max_concorrencia=MAX_CONCORRENCIA):
+        self.max_concorrencia = max_concorrencia
+
+    def buscar(self, tickers):
+        tickers = sorted({t.upper().strip() for t in tickers})
+        if not tickers:
+            return {}
+
+        with telemetria.COTACOES_SEGUNDOS.cronometrar(etapa='lote'):
+            precos = self._buscar_lote(tickers)
+        telemetria.COTACOES.inc(sum(1 for t in tickers if precos.get(t)), resultado='lote')
+
+        # O download em lote às vezes deixa buracos; completa só o que faltou
+        faltando = [t for t in tickers if not precos.get(t)]
+        if faltando:
+            with ThreadPoolExecutor(max_workers=min(self.max_concorrencia, len(faltando))) as pool:
+                for ticker, preco in zip(faltando, pool.map(self._buscar_um, faltando)):
+                    precos[ticker] = preco
+
+        return {t: precos.get(t) for t in tickers}
+
+    def _buscar_lote(self, tickers):
+        # yfinance (e o pandas que vem junto) só é importado na primeira busca,
+        # não na inicialização do bot
+        import yfinance as yf
+
+        simbolos = [_simbolo(t) for t in tickers]
+        try:
+            dados = yf.download(simbolos, period="5d", interval="1d", group_by="ticker",
+                                auto_adjust=False, progress=False, threads=self.max_concorrencia)
+        except Exception:
+            logger.warning("Falha no download em lote de %d tickers", len(simbolos), exc_info=True)
+            return {}
+
+        precos = {}
+        if dados is None or dados.empty:
+            return precos
+
+        for simbolo in simbolos:
+            try:
+                fechamentos = dados[simbolo]['Close'].dropna()
+            except KeyError:
+                continue
+            if not fechamentos.empty:
+                precos[_ticker(simbolo)] = float(fechamentos.iloc[-1])
+        return precos
+
+    def dividendos(self, tickers, desde):
+        import yfinance as yf
+
+        tickers = sorted({t.upper().strip() for t in tickers})
+        if not tickers:
+            return {}
+        simbolos = [_simbolo(t) for t in tickers]
+        # Uma única chamada em lote para todos os fundos, só com a coluna de proventos
+        with telemetria.COTACOES_SEGUNDOS.cronometrar(etapa='dividendos'):
+            try:
+                dados = yf.download(simbolos, start=desde.isoformat(), interval="1d", group_by="ticker",
+                                    actions=True, auto_adjust=False, progress=False,
+                                    threads=self.max_concorrencia)
+            except Exception:
+                logger.warning("Falha ao baixar proventos de %d tickers", len(simbolos), exc_info=True)
+                return {}
+
+        eventos = {}
+        if dados is None or dados.empty:
+            return eventos
+        for simbolo in simbolos:
+            try:
+                proventos = dados[simbolo]['Dividends']
+            except KeyError:
+                continue
+            proventos = proventos[proventos > 0]
+            eventos[_ticker(simbolo)] = [(instante.date(), float(valor)) for instante, valor in proventos.items()]
+        return eventos
+
+    def nomes(self, tickers):
+        tickers = sorted({t.upper().strip() for t in tickers})
+        if not tickers:
+            return {}
+        # O download em lote não traz metadados; só o .info de cada ativo tem o nome
+        with ThreadPoolExecutor(max_workers=min(self.max_concorrencia, len(tickers))) as pool:
+            return dict(zip(tickers, pool.map(self._nome, tickers)))
+
+    def _nome(self, ticker):
+        import yfinance as yf
+
+        try:
+            with telemetria.COTACOES_SEGUNDOS.cronometrar(etapa='nome'):
+                info = yf.Ticker(_simbolo(ticker)).info
+        except Exception:
+            logger.warning("Falha ao buscar o nome de %s", ticker, exc_info=True)
+            return None
+        return info.get('longName') or info.get('shortName')
+
+    def _buscar_um(self, ticker):
+        import yfinance as yf
+
+        usou_historico = False
+        try:
+            with telemetria.COTACOES_SEGUNDOS.cronometrar(etapa='individual'):
+                fii = yf.Ticker(_simbolo(ticker))
+                preco = fii.fast_info.get('last_price')
+            if not preco:
+                usou_historico = True
+                with telemetria.COTACOES_SEGUNDOS.cronometrar(etapa='historico'):
+                    hist = fii.history(period="1d")
+                preco = hist['Close'].iloc[-1] if not hist.empty else None
+            if preco:
+                telemetria.COTACOES.inc(resultado='historico' if usou_historico else 'individual')
+                return float(preco)
+        except Exception:
+            logger.warning("Falha ao buscar cotação de %s", ticker, exc_info=True)
+        telemetria.COTACOES.inc(resultado='falha')
+        return None
+
+
+class ProvedorFake(ProvedorCotacoes):
+    """Provedor local e determinístico para testes (não acessa a rede)."""
+
+    def __init__(self, precos=None, dividendos=None, nomes=None):
+        self.precos = {t.upper(): p for t, p in (precos or {}).items()}
+        self.proventos = {t.upper(): eventos for t, eventos in (dividendos or {}).items()}
+        self.nomes_fundos = {t.upper(): nome for t, nome in (nomes or {}).items()}
+        self.chamadas = 0
+        self.chamadas_nomes = 0
+
+    def buscar(self, tickers):
+        self.chamadas += 1
+        return {t.upper(): self.precos.get(t.upper()) for t in tickers}
+
+    def dividendos(self, tickers, desde):
+        return {t.upper(): [(d, v) for d, v in self.proventos.get(t.upper(), []) if d >= desde] for t in tickers}
+
+    def nomes(self, tickers):
+        self.chamadas_nomes += 1
+        return {t.upper(): self.nomes_fundos.get(t.upper()) for t in tickers}
+
+
+_provedor = ProvedorYahoo()
+cache_cotacoes = CacheTTL(ttl=TTL_COTACOES, max_itens=512)
+cache_nomes = CacheTTL(ttl=TTL_NOMES, max_itens=1024)
+
+
+def definir_provedor(provedor):
+    """Troca o provedor global (ex.: ProvedorFake nos testes). Devolve o anterior."""
+    global _provedor
+    anterior, _provedor = _provedor, provedor
+    cache_cotacoes.invalidar()
+    cache_nomes.invalidar()
+    return anterior
+
+
+def obter_provedor():
+    return _provedor
+
+
+def buscar_dividendos(tickers, desde):
+    # Sem cache: roda uma vez por dia, num job
+    return _provedor.dividendos(tickers, desde)
+
+
+def buscar_cotacoes(tickers):
+    tickers = [t.upper().strip() for t in tickers]
+    return cache_cotacoes.obter_muitos(tickers, _provedor.buscar)
+
+
+def buscar_nomes(tickers):
+    """Nome completo dos fundos ({TICKER: nome ou None}), em cache por um dia."""
+    tickers = [t.upper().strip() for t in tickers]
+    return cache_nomes.obter_muitos(tickers, _provedor.nomes)
@@ -0,0 +1,109 @@
+import math
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from bot.models import CotacaoHistorica, FundoImobiliario
+
+# Política de retenção: (resolução de origem, resolução de destino, idade mínima)
+# Ticks com mais de 2 dias viram barras de 5 min, que após 30 dias viram barras
+# de 1 h, que após 1 ano viram barras diárias. As barras diárias são mantidas.
+RETENCAO = [
+    (CotacaoHistorica.TICK, CotacaoHistorica.CINCO_MINUTOS, timedelta(days=2)),
+    (CotacaoHistorica.CINCO_MINUTOS, CotacaoHistorica.HORA, timedelta(days=30)),
+    (CotacaoHistorica.HORA, CotacaoHistorica.DIA, timedelta(days=365)),
+]
+TAMANHO_LOTE = 2000
+
+
+def registrar_ticks(fundos_precos, instante=None):
+    """Grava um tick bruto por fundo. `fundos_precos` é uma lista de (fundo, preço)."""
+    instante = instante or timezone.now()
+    CotacaoHistorica.objects.bulk_create(
+        [CotacaoHistorica(fundo=fundo, instante=instante, abertura=preco, maxima=preco,
+                          minima=preco, fechamento=preco)
+         for fundo, preco in fundos_precos],
+        ignore_conflicts=True, batch_size=TAMANHO_LOTE,
+    )
+
+
+def _inicio_balde(instante, resolucao):
+    segundos = int(instante.timestamp())
+    return instante.fromtimestamp(segundos - segundos % resolucao, tz=instante.tzinfo)
+
+
+def _agrupar(linhas, resolucao):
+    """Consolida linhas (já ordenadas por fundo e instante) em barras OHLC."""
+    barra = None
+    for linha in linhas:
+        chave = (linha.fundo_id, _inicio_balde(linha.instante, resolucao))
+        if barra is not None and barra[0] == chave:
+            _, o, h, l, _, n = barra
+            barra = (chave, o, max(h, linha.maxima), min(l, linha.minima), linha.fechamento,
+                     n + linha.amostras)
+            continue
+        if barra is not None:
+            yield barra
+        barra = (chave, linha.abertura, linha.maxima, linha.minima, linha.fechamento, linha.amostras)
+    if barra is not None:
+        yield barra
+
+
+def compactar(agora=None):
+    """Aplica a política de retenção. Devolve {resolução de origem: linhas removidas}."""
+    agora = agora or timezone.now()
+    removidas = {}
+
+    for origem, destino, idade in RETENCAO:
+        # O corte é alinhado à resolução de destino para nunca partir um balde ao meio
+        corte = _inicio_balde(agora - idade, destino)
+        fonte = CotacaoHistorica.objects.filter(resolucao=origem, instante__lt=corte)
+
+        with transaction.atomic():
+            # As barras são bem menores que as linhas de origem; junta tudo antes de
+            # gravar para não escrever na tabela enquanto o cursor ainda a percorre
+            linhas = fonte.order_by('fundo_id', 'instante').iterator(chunk_size=TAMANHO_LOTE)
+            barras = [
+                CotacaoHistorica(fundo_id=fundo_id, resolucao=destino, instante=inicio, abertura=o,
+                                 maxima=h, minima=l, fechamento=c, amostras=n)
+                for (fundo_id, inicio), o, h, l, c, n in _agrupar(linhas, destino)
+            ]
+            CotacaoHistorica.objects.bulk_create(barras, ignore_conflicts=True, batch_size=TAMANHO_LOTE)
+            removidas[origem] = fonte.delete()[0]
+
+    return removidas
+
+
+def ultimos_dias(ticker, dias, resolucao=None, agora=None):
+    """Série (instante, abertura, máxima, mínima, fechamento) dos últimos `dias` de um fundo.
+
+    A consulta usa o índice (fundo, resolução, instante). Sem `resolucao`, junta
+    todas as resoluções; como as linhas de origem são apagadas na compactação,
+    elas não se sobrepõem e a série sai contínua.
+    """
+    agora = agora or timezone.now()
+    fundo_id = FundoImobiliario.objects.filter(ticker=ticker.upper()).values_list('id', flat=True).first()
+    if fundo_id is None:
+        return []
+
+    resolucoes = [resolucao] if resolucao is not None else [r for r, _ in CotacaoHistorica.RESOLUCOES]
+    return list(
+        CotacaoHistorica.objects
+        .filter(fundo_id=fundo_id, resolucao__in=resolucoes, instante__gte=agora - timedelta(days=dias))
+        .order_by('instante')
+        .values_list('instante', 'abertura', 'maxima', 'minima', 'fechamento')
+    )
+
+
+def tendencia_e_volatilidade(ticker, dias, agora=None):
+    """Retorno acumulado (%) e desvio-padrão dos retornos logarítmicos (%) no período."""
+    fechamentos = [linha[4] for linha in ultimos_dias(ticker, dias, agora=agora) if linha[4] > 0]
+    if len(fechamentos) < 2:
+        return 0.0, 0.0
+
+    retornos = [math.log(b / a) for a, b in zip(fechamentos, fechamentos[1:])]
+    media = sum(retornos) / len(retornos)
+    variancia = sum((r - media) ** 2 for r in retornos) / len(retornos)
+    tendencia = ((fechamentos[-1] / fechamentos[0]) - 1) * 100
+    return tendencia, math.sqrt(variancia) * 100
@@ -0,0 +1,356 @@
+"""Importação em lote de extratos de negociação (B3 / corretoras) em CSV ou XLSX.
+
+O arquivo é lido linha a linha (CSV com o módulo csv, XLSX com o openpyxl em
+modo read_only), e as operações vão para o livro em lotes, cada lote numa
+transação. Só o lote corrente e os negócios do dia corrente (para diferenciar
+negócios idênticos no mesmo dia) ficam em memória, qualquer que seja o
+tamanho do arquivo. Cada negócio tem uma `chave` estável: reimportar o mesmo extrato
+(ou um extrato que se sobrepõe ao anterior) não duplica nada.
+
+Os negócios importados ficam com a hora 00:00 do dia, e o livro é aplicado em
+ordem (data, id). Por isso as compras de cada dia são gravadas antes das vendas,
+qualquer que seja a ordem do arquivo (o extrato da B3 vem do mais novo para o
+mais antigo). No final, o livro dos fundos afetados é conferido e só as posições
+em que ele fecha são recalculadas, uma única vez; os demais fundos são listados
+no resumo.
+
+O cabeçalho é reconhecido pelos nomes das colunas, com ou sem acento: o
+extrato de negociação da Área do Investidor da B3 ("Data do Negócio", "Tipo
+de Movimentação", "Código de Negociação", "Quantidade", "Preço", "Valor") e
+planilhas simples com data, ticker, tipo (C/V), quantidade e preço.
+"""
+import csv
+import datetime
+import hashlib
+import re
+import unicodedata
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+from django.db import transaction
+from django.utils import timezone
+
+from bot.carteira import OperacaoInvalida, conferir_livro, reconstruir_posicoes
+from bot.models import FundoImobiliario, Operacao
+
+TAMANHO_LOTE = 1000
+# Linhas iniciais em que o cabeçalho é procurado (algumas corretoras põem um preâmbulo)
+LINHAS_CABECALHO = 20
+# Quantos erros de linha são guardados para mostrar; os demais só são contados
+MAXIMO_ERROS = 20
+
+COLUNAS = {
+    'data': ('data do negocio', 'data', 'data do pregao', 'data pregao', 'data da operacao', 'pregao'),
+    'tipo': ('tipo de movimentacao', 'tipo', 'c/v', 'compra/venda', 'operacao', 'natureza'),
+    'ticker': ('codigo de negociacao', 'ticker', 'ativo', 'codigo', 'papel', 'produto'),
+    'quantidade': ('quantidade', 'qtd', 'qtde', 'quantidade negociada'),
+    'preco': ('preco', 'preco unitario', 'preco (r$)', 'preco medio', 'preco de negociacao'),
+    'valor': ('valor', 'valor total', 'valor (r$)', 'valor da operacao', 'total'),
+    'negocio': ('numero do negocio', 'no do negocio', 'n do negocio', 'negocio', 'id'),
+}
+OBRIGATORIAS = ('data', 'tipo', 'ticker', 'quantidade')
+# Ticker do mercado fracionário (MXRF11F) vira o do lote padrão
+FRACIONARIO = re.compile(r'^([A-Z]{4}\d{1,2})F$')
+MILHAR = re.compile(r'^\d{1,3}(\.\d{3})+$')
+
+
+class ImportacaoInvalida(ValueError):
+    pass
+
+
+def _normalizar(texto):
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode()
+    return ' '.join(texto.lower().split())
+
+
+def _colunas(cabecalho):
+    """{campo: índice} se a linha for um cabeçalho reconhecível, senão None."""
+    nomes = [_normalizar(celula) for celula in cabecalho]
+    indices = {}
+    for campo, apelidos in COLUNAS.items():
+        for apelido in apelidos:
+            if apelido in nomes:
+                indices[campo] = nomes.index(apelido)
+                break
+    if all(campo in indices for campo in OBRIGATORIAS) and ('preco' in indices or 'valor' in indices):
+        return indices
+    return None
+
+
+def _linhas_csv(caminho):
+    with open(caminho, 'rb') as bruto:
+        amostra = bruto.read(64 * 1024)
+    try:
+        amostra.decode('utf-8')
+        codificacao = 'utf-8-sig'
+    except UnicodeDecodeError:
+        # Exportações do Excel em português costumam vir em Latin-1
+        codificacao = 'latin-1'
+    # Só linhas completas na amostra, para o Sniffer não tropeçar na última
+    texto = amostra.decode(codificacao, errors='ignore').rsplit('\n', 1)[0]
+    try:
+        delimitador = csv.Sniffer().sniff(texto, delimiters=';,\t').delimiter
+    except csv.Error:
+        delimitador = max(';,\t', key=texto.count)
+    with open(caminho, newline='', encoding=codificacao, errors='replace') as arquivo:
+        yield from csv.reader(arquivo, delimiter=delimitador)
+
+
+def _linhas_xlsx(caminho):
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ImportacaoInvalida("Para importar XLSX instale o openpyxl (pip install openpyxl) "
+                                 "ou exporte o extrato em CSV.") from e
+    # read_only lê a planilha em streaming, sem montar o arquivo inteiro na memória
+    livro = load_workbook(caminho, read_only=True, data_only=True)
+    try:
+        for linha in livro.worksheets[0].iter_rows(values_only=True):
+            yield linha
+    finally:
+        livro.close()
+
+
+def ler_linhas(caminho):
+    extensao = Path(caminho).suffix.lower()
+    if extensao == '.csv':
+        return _linhas_csv(caminho)
+    if extensao == '.xlsx':
+        return _linhas_xlsx(caminho)
+    raise ImportacaoInvalida(f"Formato não suportado: {extensao or 'sem extensão'} (use CSV ou XLSX).")
+
+
+def _decimal(valor):
+    if isinstance(valor, (int, float, Decimal)):
+        return Decimal(str(valor))
+    texto = str(valor or '').replace('R$', '').replace(' ', '').replace('\xa0', '')
+    if ',' in texto:
+        # Formato brasileiro: 1.234,56
+        texto = texto.replace('.', '').replace(',', '.')
+    elif MILHAR.match(texto):
+        texto = texto.replace('.', '')
+    try:
+        return Decimal(texto)
+    except InvalidOperation:
+        raise ValueError(f"número inválido: {valor!r}") from None
+
+
+def _data(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor.date()
+    if isinstance(valor, datetime.date):
+        return valor
+    texto = str(valor or '').strip().split(' ')[0]
+    for formato in ('%d/%m/%Y', '%Y-%m-%d', '%d/%m/%y', '%d-%m-%Y'):
+        try:
+            return datetime.datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"data inválida: {valor!r}")
+
+
+def _tipo(valor):
+    texto = _normalizar(valor)
+    if texto == 'c' or texto.startswith('compra'):
+        return Operacao.COMPRA
+    if texto == 'v' or texto.startswith('venda'):
+        return Operacao.VENDA
+    return None
+
+
+def _ticker(valor):
+    ticker = str(valor or '').strip().upper()
+    fracionario = FRACIONARIO.match(ticker)
+    return fracionario.group(1) if fracionario else ticker
+
+
+def _compras_primeiro(do_dia):
+    # sorted é estável: entre compras (e entre vendas) vale a ordem do arquivo
+    return sorted(do_dia, key=lambda item: item[4] != Operacao.COMPRA)
+
+
+def operacoes(linhas, erros=None):
+    """Converte as linhas cruas em (linha, chave, data, ticker, tipo, quantidade, preço).
+
+    Os negócios saem agrupados por dia, com as compras antes das vendas.
+    Linhas que não são compra nem venda (ex.: rendimentos em extratos de
+    movimentação) só são contadas em `erros['ignoradas']`; as com dados
+    inválidos, em `erros['invalidas']`, com alguns `exemplos` (linha, motivo).
+    """
+    erros = erros if erros is not None else {'ignoradas': 0, 'invalidas': 0, 'exemplos': []}
+    indices = None
+    # Os extratos vêm ordenados por data: o contador de repetidos só guarda o dia corrente.
+    # Um dia que reaparece mais adiante (arquivo fora de ordem) ganha outro número de trecho.
+    repetidos, trechos, dia = Counter(), Counter(), None
+    do_dia, dia_pendente = [], None
+    for numero, linha in enumerate(linhas, start=1):
+        if not linha or all(celula in (None, '') for celula in linha):
+            continue
+        if indices is None:
+            indices = _colunas(linha)
+            if indices is None and numero >= LINHAS_CABECALHO:
+                raise ImportacaoInvalida("Cabeçalho não reconhecido: o extrato precisa das colunas de data, "
+                                         "tipo (compra/venda), ticker, quantidade e preço.")
+            continue
+
+        def campo(nome):
+            indice = indices.get(nome)
+            return linha[indice] if indice is not None and indice < len(linha) else None
+
+        tipo = _tipo(campo('tipo'))
+        if tipo is None:
+            erros['ignoradas'] += 1
+            continue
+        try:
+            data = _data(campo('data'))
+            ticker = _ticker(campo('ticker'))
+            quantidade = _decimal(campo('quantidade'))
+            if quantidade != quantidade.to_integral_value() or quantidade <= 0:
+                raise ValueError(f"quantidade inválida: {campo('quantidade')!r}")
+            quantidade = int(quantidade)
+            if campo('preco') not in (None, ''):
+                preco = _decimal(campo('preco'))
+            else:
+                preco = _decimal(campo('valor')) / quantidade
+            preco = preco.quantize(Decimal('0.01'))
+            if not ticker or len(ticker) > 10:
+                raise ValueError(f"ticker inválido: {campo('ticker')!r}")
+            if preco <= 0:
+                raise ValueError(f"preço inválido: {campo('preco')!r}")
+        except ValueError as e:
+            erros['invalidas'] += 1
+            if len(erros['exemplos']) < MAXIMO_ERROS:
+                erros['exemplos'].append((numero, str(e)))
+            continue
+
+        negocio = campo('negocio')
+        if negocio not in (None, ''):
+            base = f"negocio|{ticker}|{data.isoformat()}|{negocio}"
+        else:
+            # Sem número do negócio: negócios idênticos no mesmo dia se diferenciam pela ordem no arquivo
+            if data != dia:
+                repetidos.clear()
+                dia = data
+                trechos[dia] += 1
+            base = f"{data.isoformat()}|{ticker}|{tipo}|{quantidade}|{preco}"
+            repetidos[base] += 1
+            ordem = repetidos[base] if trechos[dia] == 1 else f"{trechos[dia]}.{repetidos[base]}"
+            base = f"{base}|{ordem}"
+        chave = hashlib.sha1(base.encode()).hexdigest()
+        if data != dia_pendente:
+            yield from _compras_primeiro(do_dia)
+            do_dia, dia_pendente = [], data
+        do_dia.append((numero, chave, data, ticker, tipo, quantidade, preco))
+    yield from _compras_primeiro(do_dia)
+
+    if indices is None:
+        raise ImportacaoInvalida("Arquivo vazio ou sem cabeçalho reconhecível.")
+
+
+def gravar_lote(lote, fundos):
+    """Insere um lote de operações; as já importadas (mesma chave) ficam de fora.
+
+    `fundos` é o cache ticker → id, compartilhado entre os lotes. Devolve
+    (inseridas, ids dos fundos afetados).
+    """
+    existentes = set(Operacao.objects.filter(chave__in=[item[1] for item in lote])
+                     .values_list('chave', flat=True))
+    novos = {item[3] for item in lote if item[3] not in fundos}
+    if novos:
+        FundoImobiliario.objects.bulk_create([FundoImobiliario(ticker=t) for t in novos], ignore_conflicts=True)
+        fundos.update(FundoImobiliario.objects.filter(ticker__in=novos).values_list('ticker', 'id'))
+
+    fuso = timezone.get_current_timezone()
+    registros, vistos = [], set()
+    for _, chave, data, ticker, tipo, quantidade, preco in lote:
+        if chave in existentes or chave in vistos:
+            continue
+        vistos.add(chave)
+        registros.append(Operacao(fundo_id=fundos[ticker], tipo=tipo, quantidade=quantidade, preco=preco,
+                                  data=datetime.datetime.combine(data, datetime.time(), tzinfo=fuso),
+                                  chave=chave))
+    # ignore_conflicts cobre outra importação concorrente do mesmo extrato
+    Operacao.objects.bulk_create(registros, ignore_conflicts=True)
+    return len(registros), {registro.fundo_id for registro in registros}
+
+
+def _fundos():
+    return dict(FundoImobiliario.objects.values_list('ticker', 'id'))
+
+
+def _em_transacao(funcao, *args):
+    with transaction.atomic():
+        return funcao(*args)
+
+
+def importar(caminho, tamanho_lote=TAMANHO_LOTE, executar=_em_transacao):
+    """Importa o extrato e recalcula as posições dos fundos afetados.
+
+    `executar(funcao, *args)` roda cada escrita numa transação: no comando é
+    direto, no bot é a thread escritora (bot.banco). Devolve um resumo.
+    """
+    erros = {'ignoradas': 0, 'invalidas': 0, 'exemplos': []}
+    fundos = executar(_fundos)
+    lidas = inseridas = 0
+    afetados = set()
+    lote = []
+
+    def descarregar():
+        nonlocal inseridas
+        novas, ids = executar(gravar_lote, lote, fundos)
+        inseridas += novas
+        afetados.update(ids)
+        lote.clear()
+
+    for item in operacoes(ler_linhas(caminho), erros):
+        lote.append(item)
+        lidas += 1
+        if len(lote) >= tamanho_lote:
+            descarregar()
+    if lote:
+        descarregar()
+
+    inconsistentes = []
+    if inseridas:
+        # Ex.: venda sem a compra correspondente no livro (extrato de um período só). Esses fundos
+        # ficam com a posição anterior até o livro fechar (ex.: importando o período que falta).
+        problemas = executar(conferir_livro, sorted(afetados))
+        tickers = {id_: ticker for ticker, id_ in fundos.items()}
+        inconsistentes = sorted(f"{tickers[fundo_id]}: {motivo}" for fundo_id, motivo in problemas.items())
+        try:
+            # Uma única passada pelo livro, só dos fundos tocados, em vez de uma por linha
+            executar(reconstruir_posicoes, False, sorted(afetados - set(problemas)))
+        except OperacaoInvalida as e:
+            # O livro mudou entre a conferência e a reconstrução (ex.: um /vender no meio)
+            inconsistentes.append(str(e))
+    return {
+        'lidas': lidas,
+        'inseridas': inseridas,
+        'duplicadas': lidas - inseridas,
+        'ignoradas': erros['ignoradas'],
+        'invalidas': erros['invalidas'],
+        'exemplos': erros['exemplos'],
+        'fundos': len(afetados),
+        'inconsistentes': inconsistentes,
+    }
+
+
+def resumo(resultado):
+    """Texto curto do resultado, para o comando e para o bot."""
+    partes = [f"{resultado['inseridas']} operação(ões) importada(s) de {resultado['lidas']} lida(s) "
+              f"em {resultado['fundos']} fundo(s)"]
+    if resultado['duplicadas']:
+        partes.append(f"{resultado['duplicadas']} já estavam no livro")
+    if resultado['ignoradas']:
+        partes.append(f"{resultado['ignoradas']} linha(s) que não são compra/venda ignorada(s)")
+    if resultado['invalidas']:
+        exemplos = '; '.join(f"linha {n}: {msg}" for n, msg in resultado['exemplos'][:5])
+        partes.append(f"{resultado['invalidas']} linha(s) inválida(s) ({exemplos})")
+    if resultado['inconsistentes']:
+        fundos = '; '.join(resultado['inconsistentes'][:10])
+        if len(resultado['inconsistentes']) > 10:
+            fundos += f"; e mais {len(resultado['inconsistentes']) - 10}"
+        partes.append(f"posições NÃO recalculadas em {len(resultado['inconsistentes'])} fundo(s), "
+                      f"o livro não fecha: {fundos}")
+    return '\n'.join(partes)
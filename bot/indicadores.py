@@ -0,0 +1,73 @@
+import numpy as np
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from bot.models import FundoImobiliario
+
+# Colunas decimais lidas já convertidas para float pelo próprio banco
+COLUNAS = ('preco_atual', 'preco_teto', 'ultimo_dividendo', 'valor_patrimonial', 'preco_medio', 'variacao',
+           'media_mensal_dividendos')
+
+
+def _dividir(a, b):
+    # a / b onde b > 0, e 0 no resto (sem avisos de divisão por zero)
+    return np.divide(a, b, out=np.zeros_like(a), where=b > 0)
+
+
+class TabelaIndicadores:
+    """Carteira em formato colunar, com os indicadores calculados de uma vez.
+
+    Equivale às properties de FundoImobiliario (dividend_yield, dy_12m, p_vp,
+    magic_number, faltam_para_magic, progresso_magic, lucro_total,
+    falta_quanto), mas cada uma é uma expressão NumPy sobre todos os fundos.
+    """
+
+    def __init__(self, fundos=None):
+        fundos = FundoImobiliario.objects.all() if fundos is None else fundos
+        linhas = list(
+            fundos.annotate(**{f'{c}_f': Cast(c, FloatField()) for c in COLUNAS})
+            .values_list('ticker', 'tipo', 'quantidade', *(f'{c}_f' for c in COLUNAS))
+        )
+        colunas = list(zip(*linhas)) or [()] * (3 + len(COLUNAS))
+
+        self.ticker = list(colunas[0])
+        self.tipo = list(colunas[1])
+        self.quantidade = np.array(colunas[2], dtype=np.int64)
+        for nome, valores in zip(COLUNAS, colunas[3:]):
+            setattr(self, nome, np.array(valores, dtype=np.float64))
+
+        self._calcular()
+
+    def __len__(self):
+        return len(self.ticker)
+
+    def _calcular(self):
+        preco, div, qtd = self.preco_atual, self.ultimo_dividendo, self.quantidade
+
+        self.dividend_yield = _dividir(div, preco) * 100
+        self.dy_12m = _dividir(self.media_mensal_dividendos * 12, preco) * 100
+        # Sem histórico de proventos ainda, a renda estimada cai para o último dividendo
+        self.renda_mensal = np.where(self.media_mensal_dividendos > 0, self.media_mensal_dividendos, div) * qtd
+        self.p_vp = _dividir(preco, self.valor_patrimonial)
+
+        com_magic = (div > 0) & (preco > 0)
+        # Em centavos inteiros, para o ceil não errar por arredondamento de float (9.80 / 0.07)
+        centavos_preco = np.rint(preco * 100).astype(np.int64)
+        centavos_div = np.where(com_magic, np.rint(div * 100), 1).astype(np.int64)
+        self.magic_number = np.where(com_magic, -(-centavos_preco // centavos_div), 0)
+        self.faltam_para_magic = np.maximum(self.magic_number - qtd, 0)
+        self.progresso_magic = np.minimum(_dividir(qtd.astype(np.float64), self.magic_number.astype(np.float64)) * 100, 100)
+
+        self.lucro_total = np.where(qtd > 0, (preco - self.preco_medio) * qtd, 0)
+        self.falta_quanto = np.maximum(preco - self.preco_teto, 0)
+
+    def linhas(self):
+        """Uma linha (dict) por fundo, com os mesmos nomes usados no template."""
+        nomes = ('ticker', 'tipo', 'quantidade') + COLUNAS + (
+            'dividend_yield', 'dy_12m', 'renda_mensal', 'p_vp', 'magic_number', 'faltam_para_magic', 'progresso_magic',
+            'lucro_total', 'falta_quanto')
+        colunas = [c if isinstance(c, list) else c.tolist() for c in (getattr(self, n) for n in nomes)]
+        return [dict(zip(nomes, valores)) for valores in zip(*colunas)]
+
+    def por_ticker(self):
+        return {linha['ticker']: linha for linha in self.linhas()}
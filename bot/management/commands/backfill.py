@@ -0,0 +1,63 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.acervo import ANOS_PADRAO, baixar, inicio_incremental, pasta_padrao
+from bot.models import FundoImobiliario
+
+
+class Command(BaseCommand):
+    help = ('Baixa preços diários e dividendos de todos os FIIs para o acervo em colunas (.npy). '
+            'Rodar de novo só completa o que falta desde o último dia gravado.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('tickers', nargs='*', help='Só estes tickers (padrão: todos os cadastrados)')
+        parser.add_argument('--desde', type=date.fromisoformat,
+                            help=f'Data inicial AAAA-MM-DD (padrão: {ANOS_PADRAO} anos atrás)')
+        parser.add_argument('--processos', type=int, default=min(4, os.cpu_count() or 1),
+                            help='Downloads simultâneos (processos do pool)')
+        parser.add_argument('--pasta', help='Diretório do acervo (padrão: FII_ACERVO ou ./acervo)')
+        parser.add_argument('--refazer', action='store_true',
+                            help='Ignora o que já está no acervo e baixa tudo de novo desde --desde')
+
+    def handle(self, *args, **options):
+        pasta = options['pasta'] or pasta_padrao()
+        hoje = date.today()
+        desde = options['desde'] or hoje - timedelta(days=365 * ANOS_PADRAO)
+        tickers = [t.upper() for t in options['tickers']] or list(
+            FundoImobiliario.objects.order_by('ticker').values_list('ticker', flat=True))
+        if not tickers:
+            raise CommandError("Nenhum fundo cadastrado.")
+
+        if options['refazer']:
+            for ticker in tickers:
+                meta = os.path.join(pasta, ticker, 'meta.json')
+                if os.path.exists(meta):
+                    os.remove(meta)
+
+        # Retomada: cada ticker começa do dia seguinte ao último gravado
+        pendentes = {t: inicio_incremental(pasta, t, desde) for t in tickers}
+        pendentes = {t: inicio for t, inicio in pendentes.items() if inicio <= hoje}
+        self.stdout.write(f"{len(pendentes)} de {len(tickers)} ticker(s) a atualizar, "
+                          f"{options['processos']} processo(s), acervo em {pasta}")
+
+        falhas = 0
+        # Os processos não tocam no banco: recebem o ticker e escrevem direto no acervo
+        with ProcessPoolExecutor(max_workers=max(1, options['processos'])) as pool:
+            futuros = {pool.submit(baixar, t, pasta, inicio): t for t, inicio in pendentes.items()}
+            for futuro in as_completed(futuros):
+                ticker = futuros[futuro]
+                try:
+                    dias, dividendos = futuro.result()
+                except Exception as e:
+                    falhas += 1
+                    self.stderr.write(self.style.ERROR(f"  {ticker}: {e}"))
+                    continue
+                self.stdout.write(f"  {ticker}: +{dias} dia(s), +{dividendos} dividendo(s)")
+
+        if falhas:
+            self.stdout.write(self.style.WARNING(f"{falhas} ticker(s) falharam; rode de novo para retomar."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Acervo atualizado."))
@@ -0,0 +1,250 @@
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+
+from bot import alertas, banco
+from bot.concessoes import Trabalhador
+from bot.agenda import AgendadorAdaptativo, CalendarioB3
+from bot.cotacoes import ProvedorFake, cache_cotacoes, definir_provedor
+from bot.management.commands import runbot
+from bot.models import Assinatura, FundoImobiliario, RegraAlerta
+
+TAMANHOS = [10, 1000, 10000]
+TIPOS = ['Tijolo', 'Papel', 'Fof', 'Híbrido', 'Desenvolvimento']
+PASTA_RESULTADOS = Path(settings.BASE_DIR) / 'benchmarks'
+# Piora (em %) da mediana, em relação ao arquivo comparado, que conta como regressão
+# (folgada: poucas repetições numa máquina compartilhada oscilam uns 10%)
+TOLERANCIA = 20.0
+
+
+# --- Dublês do Telegram: só o que os handlers usam ---
+class _Mensagem:
+    async def reply_text(self, texto, **kwargs):
+        pass
+
+
+class _Chat:
+    id = 1
+
+
+class _Update:
+    def __init__(self):
+        self.message = _Mensagem()
+        self.effective_chat = _Chat()
+
+
+class _Bot:
+    async def send_chat_action(self, **kwargs):
+        pass
+
+    async def send_message(self, **kwargs):
+        pass
+
+
+class _Fila:
+    def __init__(self):
+        self.enfileiradas = 0
+
+    def enfileirar(self, chat_id, texto, parse_mode='Markdown'):
+        self.enfileiradas += 1
+
+
+class _Contexto:
+    def __init__(self, bot_data=None):
+        self.args = []
+        self.bot = _Bot()
+        self.job = None
+        self.bot_data = bot_data or {}
+
+
+def gerar_carteira(tamanho, semente=42):
+    """Recria o banco com `tamanho` fundos sintéticos e uma regra de alerta por fundo.
+
+    Devolve os preços iniciais, usados pelo provedor falso.
+    """
+    aleatorio = random.Random(semente)
+    RegraAlerta.objects.all().delete()
+    Assinatura.objects.all().delete()
+    FundoImobiliario.objects.all().delete()
+
+    fundos, precos = [], {}
+    for i in range(tamanho):
+        ticker = f"SINT{i:05d}"
+        preco = round(aleatorio.uniform(8, 180), 2)
+        precos[ticker] = preco
+        fundos.append(FundoImobiliario(
+            ticker=ticker,
+            tipo=aleatorio.choice(TIPOS),
+            preco_atual=Decimal(f"{preco:.2f}"),
+            preco_teto=Decimal(f"{preco * 0.97:.2f}"),
+            ultimo_dividendo=Decimal(f"{preco * aleatorio.uniform(0.006, 0.012):.2f}"),
+            valor_patrimonial=Decimal(f"{preco * aleatorio.uniform(0.8, 1.2):.2f}"),
+            quantidade=aleatorio.randint(1, 500),
+            preco_medio=Decimal(f"{preco * aleatorio.uniform(0.85, 1.15):.2f}"),
+        ))
+    FundoImobiliario.objects.bulk_create(fundos, batch_size=1000)
+
+    assinatura = Assinatura.objects.create(chat_id=1)
+    RegraAlerta.objects.bulk_create([
+        RegraAlerta(assinatura=assinatura, ticker=ticker, tipo=RegraAlerta.PRECO_ABAIXO,
+                    limite=round(preco * 0.99, 2))
+        for ticker, preco in precos.items()
+    ], batch_size=1000)
+    # bulk_create não dispara sinais
+    alertas.invalidar_indice()
+    cache.clear()
+    return precos
+
+
+def _resumo(amostras):
+    ordenadas = sorted(amostras)
+    return {
+        'amostras': len(ordenadas),
+        'min_ms': round(ordenadas[0] * 1000, 3),
+        'mediana_ms': round(statistics.median(ordenadas) * 1000, 3),
+        'p95_ms': round(ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.95))] * 1000, 3),
+    }
+
+
+async def _cronometrar(func, repeticoes, antes=None):
+    amostras = []
+    for _ in range(repeticoes):
+        if antes:
+            antes()
+        inicio = time.perf_counter()
+        await func()
+        amostras.append(time.perf_counter() - inicio)
+    return amostras
+
+
+class Command(BaseCommand):
+    help = ('Mede a latência de /status, /hoje e do dashboard e a vazão do vigia '
+            'com carteiras sintéticas, num banco descartável e sem acessar a rede')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanhos', type=int, nargs='+', default=TAMANHOS,
+                            help='Quantidades de fundos das carteiras sintéticas')
+        parser.add_argument('--repeticoes', type=int, default=5,
+                            help='Medições por cenário (a mediana é o número comparado)')
+        parser.add_argument('--saida', help='Arquivo JSON de resultados (padrão: benchmarks/<data>.json)')
+        parser.add_argument('--comparar', help='Resultado anterior para apontar regressões')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as pasta:
+            # Banco SQLite em arquivo (não em memória) para as threads de leitura e escrita do bot
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = str(Path(pasta) / 'benchmark.sqlite3')
+            nome_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            provedor_anterior = definir_provedor(ProvedorFake())
+            try:
+                cenarios = {}
+                for tamanho in options['tamanhos']:
+                    self.stdout.write(f"Carteira com {tamanho} fundos...")
+                    cenarios[str(tamanho)] = asyncio.run(self._medir(tamanho, options['repeticoes']))
+            finally:
+                definir_provedor(provedor_anterior)
+                connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+        resultado = {'ambiente': self._ambiente(), 'cenarios': cenarios}
+        saida = Path(options['saida'] or PASTA_RESULTADOS / f"{datetime.now():%Y%m%d-%H%M%S}.json")
+        saida.parent.mkdir(parents=True, exist_ok=True)
+        saida.write_text(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+        self._imprimir(cenarios)
+        self.stdout.write(self.style.SUCCESS(f"Resultados gravados em {saida}"))
+        if options['comparar']:
+            self._comparar(cenarios, json.loads(Path(options['comparar']).read_text())['cenarios'])
+
+    async def _medir(self, tamanho, repeticoes):
+        precos = await banco.escrever(gerar_carteira, tamanho)
+        provedor = ProvedorFake(precos)
+        definir_provedor(provedor)
+        medidas = {}
+
+        medidas['status_handler'] = _resumo(await _cronometrar(
+            lambda: runbot.status_handler(_Update(), _Contexto()), repeticoes))
+        medidas['relatorio_fechamento'] = _resumo(await _cronometrar(
+            lambda: runbot.relatorio_fechamento(_Update(), _Contexto()), repeticoes))
+
+        cliente = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+
+        async def abrir_dashboard():
+            resposta = await banco.ler(cliente.get, '/')
+            assert resposta.status_code == 200, resposta.status_code
+
+        medidas['home_frio'] = _resumo(await _cronometrar(abrir_dashboard, repeticoes, antes=cache.clear))
+        medidas['home_cache'] = _resumo(await _cronometrar(abrir_dashboard, repeticoes))
+
+        # Vigia: relógio simulado num pregão aberto, avançado além do intervalo
+        # máximo a cada ciclo para que todos os tickers estejam vencidos
+        instante = [datetime(2026, 11, 19, 11, 0, tzinfo=ZoneInfo('America/Sao_Paulo'))]
+        agenda = AgendadorAdaptativo(CalendarioB3(), relogio=lambda: instante[0])
+        fila = _Fila()
+        contexto = _Contexto({'agenda': agenda, 'fila_envio': fila, 'trabalhador': Trabalhador.sozinho()})
+        aleatorio = random.Random(tamanho)
+
+        def proximo_ciclo():
+            instante[0] += timedelta(seconds=agenda.config['intervalo_maximo'] + 1)
+            provedor.precos = {t: round(p * (1 + aleatorio.gauss(0, 0.01)), 2) for t, p in precos.items()}
+            cache_cotacoes.invalidar()
+
+        amostras = await _cronometrar(lambda: runbot.vigia_precos(contexto), repeticoes, antes=proximo_ciclo)
+        medidas['vigia_precos'] = _resumo(amostras)
+        medidas['vigia_precos']['tickers_por_s'] = round(tamanho / statistics.median(amostras), 1)
+        medidas['vigia_precos']['alertas'] = fila.enfileiradas
+        return medidas
+
+    def _ambiente(self):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'maquina': platform.platform(),
+        }
+
+    def _imprimir(self, cenarios):
+        for tamanho, medidas in cenarios.items():
+            self.stdout.write(f"\n{tamanho} fundos")
+            for nome, m in medidas.items():
+                extra = f"  {m['tickers_por_s']} tickers/s" if 'tickers_por_s' in m else ""
+                self.stdout.write(f"  {nome:<22} mediana {m['mediana_ms']:>10.2f} ms  "
+                                  f"p95 {m['p95_ms']:>10.2f} ms{extra}")
+
+    def _comparar(self, cenarios, anteriores):
+        regressoes = 0
+        self.stdout.write("\nComparação (mediana):")
+        for tamanho, medidas in cenarios.items():
+            for nome, m in medidas.items():
+                antes = anteriores.get(tamanho, {}).get(nome)
+                if not antes or not antes['mediana_ms']:
+                    continue
+                delta = (m['mediana_ms'] / antes['mediana_ms'] - 1) * 100
+                estilo = self.style.SUCCESS
+                if delta > TOLERANCIA:
+                    estilo = self.style.ERROR
+                    regressoes += 1
+                self.stdout.write(estilo(f"  {tamanho:>6} {nome:<22} {antes['mediana_ms']:>10.2f} -> "
+                                         f"{m['mediana_ms']:>10.2f} ms ({delta:+.1f}%)"))
+        if regressoes:
+            self.stdout.write(self.style.WARNING(f"{regressoes} medida(s) piorou(aram) mais de {TOLERANCIA:g}%."))
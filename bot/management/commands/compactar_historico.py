@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from bot.historico import compactar
+
+
+class Command(BaseCommand):
+    help = 'Consolida o histórico de preços em barras de 5 min, 1 h e 1 dia e apaga os ticks antigos'
+
+    def handle(self, *args, **options):
+        removidas = compactar()
+        for resolucao, total in removidas.items():
+            self.stdout.write(f"Resolução {resolucao}s: {total} linhas consolidadas")
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.importacao import TAMANHO_LOTE, ImportacaoInvalida, importar, resumo
+
+
+class Command(BaseCommand):
+    help = ('Importa um extrato de negociação (CSV ou XLSX da B3/corretora) para o livro de operações, '
+            'sem duplicar negócios já importados, e recalcula as posições dos fundos afetados')
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivos', nargs='+', help='Um ou mais extratos .csv/.xlsx')
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE,
+                            help='Operações por transação')
+
+    def handle(self, *args, **options):
+        for caminho in options['arquivos']:
+            inicio = time.perf_counter()
+            try:
+                resultado = importar(caminho, tamanho_lote=options['lote'])
+            except (ImportacaoInvalida, OSError) as e:
+                raise CommandError(f"{caminho}: {e}")
+
+            self.stdout.write(f"{caminho} ({time.perf_counter() - inicio:.1f} s)")
+            estilo = self.style.WARNING if resultado['inconsistentes'] or resultado['invalidas'] else self.style.SUCCESS
+            self.stdout.write(estilo(resumo(resultado)))
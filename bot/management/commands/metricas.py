@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.telemetria import IDADE_MAXIMA_RETRATO, arquivo_retrato, ler_retratos, mesclar_retratos
+
+
+class Command(BaseCommand):
+    help = 'Mostra as métricas do bot (formato Prometheus), a partir dos retratos gravados por cada runbot'
+
+    def handle(self, *args, **options):
+        retratos = ler_retratos()
+        if not retratos:
+            raise CommandError(f"Nenhum retrato ao lado de {arquivo_retrato()}. "
+                               "O bot (manage.py runbot) está rodando?")
+
+        self.stdout.write(mesclar_retratos(retratos), ending='')
+
+        # Os retratos são regravados a cada INTERVALO_RETRATO segundos; muito mais velho que isso, o processo parou
+        for trabalhador, _, idade in retratos:
+            if idade > IDADE_MAXIMA_RETRATO:
+                self.stderr.write(self.style.WARNING(
+                    f"Retrato de {trabalhador} de {idade:.0f}s atrás: esse processo pode estar parado."))
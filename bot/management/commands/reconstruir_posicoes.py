@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from bot.carteira import reconstruir_posicoes
+
+
+class Command(BaseCommand):
+    help = 'Recalcula (ou só confere, com --verificar) todas as posições a partir do livro de operações'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verificar', action='store_true',
+                            help='Apenas compara as posições gravadas com o livro, sem alterar nada')
+
+    def handle(self, *args, **options):
+        verificar = options['verificar']
+        divergencias = reconstruir_posicoes(verificar=verificar)
+
+        for fundo_id, gravada, calculada in divergencias:
+            qtd_gravada = gravada.quantidade if gravada else '-'
+            self.stdout.write(
+                f"Fundo {fundo_id}: gravado {qtd_gravada} cotas, livro {calculada.quantidade} cotas "
+                f"(custo {calculada.custo_total:.2f}, lucro realizado {calculada.lucro_realizado:.2f})"
+            )
+
+        if not divergencias:
+            self.stdout.write(self.style.SUCCESS("Todas as posições batem com o livro."))
+        elif verificar:
+            self.stdout.write(self.style.WARNING(f"{len(divergencias)} posição(ões) divergente(s)."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{len(divergencias)} posição(ões) recalculada(s)."))
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.request import BaseRequest
+
+from bot import banco, webhook
+from bot.cotacoes import ProvedorFake, definir_provedor
+from bot.management.commands.benchmark import gerar_carteira
+from bot.management.commands.runbot import criar_perfilador, montar_aplicacao
+
+SEGREDO_LOCAL = 'segredo-reproducao'
+COMANDOS_SINTETICOS = ['/status', '/alvo', '/alerta', '/hoje']
+# Quanto esperar, depois do último POST, pelos updates ainda na fila do bot
+TEMPO_MAXIMO = 120
+
+
+class RequisicaoFalsa(BaseRequest):
+    """Faz o papel da API do Telegram: responde na hora, sem rede, e conta as chamadas."""
+
+    def __init__(self):
+        self.chamadas = Counter()
+        self._mensagens = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        metodo = url.rsplit('/', 1)[-1]
+        self.chamadas[metodo] += 1
+        parametros = request_data.parameters if request_data else {}
+        if metodo == 'getMe':
+            resultado = {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'bot_reproducao'}
+        elif metodo == 'sendMessage':
+            self._mensagens += 1
+            resultado = {'message_id': self._mensagens, 'date': int(time.time()),
+                         'chat': {'id': parametros.get('chat_id', 0), 'type': 'private'},
+                         'text': parametros.get('text', '')}
+        else:
+            resultado = True
+        return 200, json.dumps({'ok': True, 'result': resultado}).encode()
+
+
+def update_sintetico(numero, texto, chat_id=1):
+    comando = texto.split()[0]
+    return {
+        'update_id': numero,
+        'message': {
+            'message_id': numero,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Reproducao'},
+            'text': texto,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(comando)}],
+        },
+    }
+
+
+def _resumo(amostras):
+    if not amostras:
+        return "-"
+    ordenadas = sorted(amostras)
+
+    def percentil(p):
+        return ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * p))] * 1000
+
+    return (f"mediana {statistics.median(ordenadas) * 1000:.2f} ms  p95 {percentil(0.95):.2f} ms  "
+            f"p99 {percentil(0.99):.2f} ms  máx {ordenadas[-1] * 1000:.2f} ms")
+
+
+class Command(BaseCommand):
+    help = ('Reenvia updates gravados (JSONL, ver FII_WEBHOOK_GRAVAR) ou sintéticos ao webhook e mede '
+            'latência e vazão. Sem --url roda tudo neste processo, com banco descartável e Telegram falso.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', nargs='?', help='Um update JSON por linha (padrão: updates sintéticos)')
+        parser.add_argument('--sinteticos', type=int, default=1000,
+                            help='Quantos updates sintéticos gerar quando não há arquivo')
+        parser.add_argument('--concorrencia', type=int, default=20, help='POSTs simultâneos')
+        parser.add_argument('--url', help='Webhook de um servidor rodando (ex.: http://127.0.0.1:8000/telegram/)')
+        parser.add_argument('--segredo', help='Segredo do cabeçalho (padrão: FII_WEBHOOK_SEGREDO)')
+        parser.add_argument('--carteira', type=int, default=10,
+                            help='Fundos sintéticos no banco descartável (modo local)')
+
+    def handle(self, *args, **options):
+        if options['arquivo']:
+            linhas = Path(options['arquivo']).read_text().splitlines()
+            payloads = [json.loads(linha) for linha in linhas if linha.strip()]
+        else:
+            payloads = [update_sintetico(i, COMANDOS_SINTETICOS[i % len(COMANDOS_SINTETICOS)])
+                        for i in range(1, options['sinteticos'] + 1)]
+        if not payloads:
+            raise CommandError("Nenhum update para reproduzir.")
+        corpos = [json.dumps(p).encode() for p in payloads]
+        self.stdout.write(f"{len(corpos)} update(s), concorrência {options['concorrencia']}")
+
+        if options['url']:
+            segredo = options['segredo'] or settings.FII_WEBHOOK_SEGREDO
+            asyncio.run(self._remoto(corpos, options['url'], segredo, options['concorrencia']))
+            return
+
+        with tempfile.TemporaryDirectory() as pasta:
+            pasta = Path(pasta)
+            # Nenhuma conexão (desta thread, do escritor ou dos leitores) pode seguir no banco real
+            banco.fechar_conexoes()
+            connections.close_all()
+            connection.settings_dict.setdefault('TEST', {})['NAME'] = str(pasta / 'reproducao.sqlite3')
+            nome_original = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            provedor_anterior = definir_provedor(ProvedorFake())
+            try:
+                precos = gerar_carteira(options['carteira'])
+                definir_provedor(ProvedorFake(precos))
+                segredo = options['segredo'] or SEGREDO_LOCAL
+                # O AsyncClient sempre se apresenta como 'testserver'; métricas e acervo ficam na pasta temporária
+                with override_settings(FII_WEBHOOK_SEGREDO=segredo, FII_WEBHOOK_GRAVAR='',
+                                       FII_METRICAS_ARQUIVO=pasta / 'metricas_bot.prom', FII_ACERVO=pasta / 'acervo',
+                                       ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                    asyncio.run(self._local(corpos, payloads, segredo, options['concorrencia']))
+            finally:
+                definir_provedor(provedor_anterior)
+                # As threads do banco abriram conexões com o banco descartável
+                banco.fechar_conexoes()
+                connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+    async def _enviar_todos(self, corpos, enviar, concorrencia):
+        fila = asyncio.Queue()
+        for indice, corpo in enumerate(corpos):
+            fila.put_nowait((indice, corpo))
+        latencias, status = [], Counter()
+
+        async def trabalhador():
+            while not fila.empty():
+                indice, corpo = fila.get_nowait()
+                inicio = time.perf_counter()
+                codigo = await enviar(indice, corpo)
+                latencias.append(time.perf_counter() - inicio)
+                status[codigo] += 1
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabalhador() for _ in range(max(1, concorrencia))))
+        return latencias, status, time.perf_counter() - inicio
+
+    async def _remoto(self, corpos, url, segredo, concorrencia):
+        import httpx
+
+        async with httpx.AsyncClient(timeout=30) as cliente:
+            async def enviar(indice, corpo):
+                resposta = await cliente.post(url, content=corpo, headers={
+                    'Content-Type': 'application/json', webhook.CABECALHO_SEGREDO: segredo})
+                return resposta.status_code
+
+            latencias, status, duracao = await self._enviar_todos(corpos, enviar, concorrencia)
+        self._relatorio(latencias, status, duracao)
+
+    async def _local(self, corpos, payloads, segredo, concorrencia):
+        requisicao = RequisicaoFalsa()
+        # Os jobs não fazem parte da medição
+        app = montar_aplicacao(criar_perfilador(), webhook=True, requisicao=requisicao, com_tarefas=False)
+        for job in app.job_queue.jobs():
+            job.schedule_removal()
+
+        # Último grupo de handlers: marca o fim do processamento de cada update
+        chegada, processamento, aceitos = {}, [], set()
+
+        async def marcar_fim(update, context):
+            if update.update_id in chegada:
+                processamento.append(time.perf_counter() - chegada.pop(update.update_id))
+
+        app.add_handler(TypeHandler(Update, marcar_fim), group=99)
+        await webhook.iniciar(app, registrar=False)
+        try:
+            cliente = AsyncClient()
+            cabecalhos = {webhook.CABECALHO_SEGREDO: segredo}
+            caminho = reverse('telegram_webhook')
+
+            async def enviar(indice, corpo):
+                update_id = payloads[indice].get('update_id')
+                chegada[update_id] = time.perf_counter()
+                resposta = await cliente.post(caminho, corpo, content_type='application/json', headers=cabecalhos)
+                if resposta.status_code == 200:
+                    aceitos.add(update_id)
+                else:
+                    chegada.pop(update_id, None)
+                return resposta.status_code
+
+            inicio = time.perf_counter()
+            latencias, status, duracao = await self._enviar_todos(corpos, enviar, concorrencia)
+            # Espera a fila do bot esvaziar (os aceitos ainda em `chegada` estão em processamento)
+            limite = time.perf_counter() + TEMPO_MAXIMO
+            while aceitos & chegada.keys() and time.perf_counter() < limite:
+                await asyncio.sleep(0.01)
+            pendentes = len(aceitos & chegada.keys())
+            if pendentes:
+                self.stderr.write(self.style.WARNING(f"{pendentes} update(s) não terminaram em {TEMPO_MAXIMO} s"))
+            total = time.perf_counter() - inicio
+        finally:
+            await webhook.parar()
+
+        self._relatorio(latencias, status, duracao)
+        self.stdout.write(f"  fim a fim (POST → handler concluído): {_resumo(processamento)}")
+        self.stdout.write(f"  processados: {len(processamento)} em {total:.2f} s "
+                          f"({len(processamento) / total:.1f} updates/s)")
+        self.stdout.write(f"  chamadas à API falsa: {dict(requisicao.chamadas)}")
+
+    def _relatorio(self, latencias, status, duracao):
+        self.stdout.write(f"  respostas HTTP: {dict(status)}")
+        self.stdout.write(f"  latência do webhook: {_resumo(latencias)}")
+        self.stdout.write(self.style.SUCCESS(f"  vazão de entrada: {len(latencias) / duracao:.1f} updates/s "
+                                             f"({duracao:.2f} s)"))
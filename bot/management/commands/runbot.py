@@ -1,91 +1,227 @@
-import yfinance as yf
 import asyncio
+import contextlib
 import datetime
+import functools
+import logging
+import math
+import signal
+import tempfile
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
 import pytz
-from django.core.management.base import BaseCommand
-from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 from telegram import Update
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
-from bot.models import FundoImobiliario
-from django.db import transaction, connection, close_old_connections
+from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
+from bot import (alertas, aporte, assinaturas, banco, concessoes, importacao, perfil, projecao, proventos,
+                 tarefas, telemetria)
+from bot.agenda import AgendadorAdaptativo, CalendarioB3, configuracao
+from bot.agregacao import normalizar_tipo, resumo_carteira
+from bot.carteira import OperacaoInvalida, registrar_operacao
+from bot.cotacoes import buscar_cotacoes, buscar_dividendos
+from bot.historico import compactar
+from bot.indicadores import TabelaIndicadores
+from bot.mensageria import FilaEnvio
+from bot.models import Assinatura, FundoImobiliario, Operacao, RegraAlerta, Tarefa
+from bot.persistencia import aquecer_cotacoes, salvar_cotacoes
 
 # --- 1. CONFIGURAÇÕES ---
+# Alvos iniciais de cada chat novo; depois cada chat ajusta os seus com /alvo
 ALVOS_COMPRA = {
     'KNCR11': 106.00, 'KNRI11': 166.00, 'GARE11': 8.50,
     'MXRF11': 9.70, 'HGLG11': 157.30, 'XPML11': 110.90,
     'XPLG11': 102.20, 'KNIP11': 91.00, 'KNHY11': 99.90,
     'HGBS11': 19.97,
 }
-INTERVALO_SINAIS = 300  # Aumentado para 5 min para evitar travar o banco
+# O vigia acorda a cada intervalo mínimo da agenda; cada ticker tem seu próprio ritmo
+INTERVALO_SINAIS = configuracao()['intervalo_minimo']
+FUSO_B3 = pytz.timezone('America/Sao_Paulo')
+# Tarefas globais gravadas no banco a cada boot (bot.tarefas); as de cada chat nascem no /start
+TAREFAS_GLOBAIS = [
+    {'nome': 'vigia', 'funcao': 'vigia', 'tipo': Tarefa.REPETIDA, 'intervalo': INTERVALO_SINAIS},
+    {'nome': 'compactar_historico', 'funcao': 'compactar_historico', 'tipo': Tarefa.DIARIA,
+     'horario': datetime.time(3, 0)},
+    {'nome': 'atualizar_proventos', 'funcao': 'atualizar_proventos', 'tipo': Tarefa.DIARIA,
+     'horario': datetime.time(20, 0)},
+]
+# A Bot API só baixa arquivos de até 20 MB
+LIMITE_DOCUMENTO = 20 * 1024 * 1024
+# Por quanto tempo o processo que pegou um job diário o segura (os outros pulam aquela execução)
+JANELA_JOB_DIARIO = 3600
+
+logger = logging.getLogger(__name__)
 
 
 # --- 2. FUNÇÕES DE BUSCA ---
 def buscar_preco_na_b3(ticker):
-    try:
-        simbolo = f"{ticker.upper()}.SA"
-        fii = yf.Ticker(simbolo)
-        # Tenta pegar o preço de forma rápida
-        preco = fii.fast_info.get('last_price')
-        if not preco:
-            hist = fii.history(period="1d")
-            preco = hist['Close'].iloc[-1] if not hist.empty else None
-        return float(preco) if preco else None
-    except:
-        return None
+    return buscar_cotacoes([ticker]).get(ticker.upper())
 
 
 # --- 3. TAREFAS AUTOMÁTICAS (JOBS) ---
 
-# Criamos um dicionário simples fora da função para lembrar o último preço avisado
-# Isso evita que o bot repita o alerta se o preço não mudar significativamente
-ULTIMO_AVISO_PRECO = {}
+TOKENS_REGRA = {
+    'preco<': RegraAlerta.PRECO_ABAIXO,
+    'preco>': RegraAlerta.PRECO_ACIMA,
+    'var': RegraAlerta.VARIACAO,
+    'pvp<': RegraAlerta.PVP_ABAIXO,
+    'dy>': RegraAlerta.DY_ACIMA,
+}
+
+
+def mensagem_alerta(regra, valor, preco_atual, var):
+    tendencia = "📉" if var < 0 else "📈" if var > 0 else "↔️"
+
+    if regra.tipo == RegraAlerta.PRECO_ABAIXO:
+        margem = ((regra.limite - preco_atual) / regra.limite) * 100
+        msg = (
+            f"🚨 **OPORTUNIDADE!**\n\n"
+            f"🏢 **{regra.ticker}**\n"
+            f"💰 Preço: R$ {preco_atual:.2f} {tendencia}\n"
+            f"📉 Alvo: R$ {regra.limite:.2f}\n"
+            f"🎯 **Margem: {margem:.2f}% abaixo do alvo**"
+        )
+        if regra.reaviso > 0:
+            msg += f"\n⚠️ _Aviso: Próximo alerta apenas se cair +{regra.reaviso:g}%_"
+        return msg
+
+    descricao = dict(RegraAlerta.TIPOS)[regra.tipo]
+    return (
+        f"🔔 **ALERTA {regra.ticker}**\n\n"
+        f"📌 {descricao} {regra.limite:g}\n"
+        f"📊 Valor atual: {valor:.2f}\n"
+        f"💰 Preço: R$ {preco_atual:.2f} {tendencia} ({var:+.2f}%)"
+    )
 
 
 async def vigia_precos(context: ContextTypes.DEFAULT_TYPE):
-    chat_id = context.job.chat_id
-    for ticker, preco_alvo in ALVOS_COMPRA.items():
-        preco_atual = await asyncio.to_thread(buscar_preco_na_b3, ticker)
-
-        if preco_atual:
-            def update_db():
-                connection.close()
-                fundo, _ = FundoImobiliario.objects.get_or_create(ticker=ticker.upper())
-                preco_anterior = float(fundo.preco_atual) if fundo.preco_atual > 0 else preco_atual
-                variacao = ((preco_atual / preco_anterior) - 1) * 100
-                fundo.preco_atual = preco_atual
-                fundo.preco_teto = preco_alvo
-                fundo.variacao = variacao
-                fundo.save()
-                return variacao
-
-            var = await sync_to_async(update_db)()
-
-            # Verificação de Oportunidade
-            if preco_atual <= preco_alvo:
-                margem = ((preco_alvo - preco_atual) / preco_alvo) * 100
-
-                # --- Lógica da Trava de Silêncio ---
-                # Só envia se:
-                # 1. For a primeira vez que atinge o alvo
-                # 2. OU se o preço caiu mais de 1% desde o último alerta enviado
-                ultimo_p = ULTIMO_AVISO_PRECO.get(ticker, 999999)
-                mudanca_desde_alerta = ((preco_atual / ultimo_p) - 1) * 100
-
-                if mudanca_desde_alerta <= -1.0 or ticker not in ULTIMO_AVISO_PRECO:
-                    ULTIMO_AVISO_PRECO[ticker] = preco_atual  # Atualiza o último preço avisado
-
-                    tendencia = "📉" if var < 0 else "📈" if var > 0 else "↔️"
-
-                    msg = (
-                        f"🚨 **OPORTUNIDADE!**\n\n"
-                        f"🏢 **{ticker}**\n"
-                        f"💰 Preço: R$ {preco_atual:.2f} {tendencia}\n"
-                        f"📉 Alvo: R$ {preco_alvo:.2f}\n"
-                        f"🎯 **Margem: {margem:.2f}% abaixo do alvo**\n"
-                        f"⚠️ _Aviso: Próximo alerta apenas se cair +1%_"
-                    )
-
-                    await context.bot.send_message(chat_id=chat_id, text=msg, parse_mode='Markdown')
+    # Job global: cada ticker é buscado e gravado uma vez por ciclo,
+    # e as regras de alerta de todos os chats são avaliadas pelo índice
+    indice = await banco.ler(alertas.obter_indice)
+    # Fora do pregão nada vence; dentro dele só os tickers cujo intervalo já passou
+    agenda = context.bot_data['agenda']
+    # Com vários processos, cada um só cuida dos tickers das fatias que possui
+    trabalhador = context.bot_data['trabalhador']
+    tickers = agenda.devidos(trabalhador.filtrar_tickers(indice.tickers()))
+    if not tickers:
+        return
+
+    # Uma única ida ao provedor para todos os ativos do ciclo
+    cotacoes = await asyncio.to_thread(buscar_cotacoes, tickers)
+    for ticker in tickers:
+        if cotacoes.get(ticker):
+            agenda.registrar(ticker, cotacoes[ticker], indice.tetos.get(ticker))
+
+    # Todo o ciclo é gravado de uma vez, numa única transação
+    variacoes = await banco.escrever(salvar_cotacoes, cotacoes, indice.tetos)
+
+    def carregar_indicadores():
+        return TabelaIndicadores(FundoImobiliario.objects.filter(ticker__in=tickers)).por_ticker()
+
+    indicadores = await banco.ler(carregar_indicadores)
+
+    avisos = []
+    for ticker in tickers:
+        preco_atual = cotacoes.get(ticker)
+        if not preco_atual:
+            continue
+
+        var = variacoes.get(ticker, 0)
+        ind = indicadores.get(ticker, {})
+        metricas = {
+            'preco': preco_atual,
+            'variacao_abs': abs(var),
+            'pvp': ind['p_vp'] if ind.get('valor_patrimonial', 0) > 0 else None,
+            'dy': ind['dividend_yield'] if ind.get('ultimo_dividendo', 0) > 0 else None,
+        }
+        for regra, valor in indice.avaliar(ticker, metricas):
+            telemetria.ALERTAS.inc(tipo=regra.tipo)
+            avisos.append((regra.assinatura.chat_id, mensagem_alerta(regra, valor, preco_atual, var)))
+
+    # O estado das regras (armada/último aviso) vai para o banco antes do envio,
+    # assim um reinício não repete alertas já enviados
+    await banco.escrever(alertas.salvar_estado, indice.retirar_alteradas())
+
+    # A entrega fica com a fila de saída; o vigia não espera o Telegram
+    fila = context.bot_data['fila_envio']
+    for chat_id, msg in avisos:
+        fila.enfileirar(chat_id, msg)
+
+
+async def compactar_historico(context: ContextTypes.DEFAULT_TYPE):
+    # Consolida os ticks antigos em barras (5 min / 1 h / 1 dia) fora do pregão
+    await banco.escrever(compactar)
+
+
+async def atualizar_proventos(context: ContextTypes.DEFAULT_TYPE):
+    # Uma busca em lote por dia com os proventos recentes de todos os fundos vigiados ou em carteira;
+    # só o que é novo (ou corrigido) mexe nas somas de 12 meses
+    def tickers_vigiados():
+        em_carteira = set(FundoImobiliario.objects.filter(quantidade__gt=0).values_list('ticker', flat=True))
+        return sorted(em_carteira | set(alertas.obter_indice().tickers()))
+
+    tickers = await banco.ler(tickers_vigiados)
+    desde = datetime.date.today() - proventos.JANELA - datetime.timedelta(days=35)
+    eventos = await asyncio.to_thread(buscar_dividendos, tickers, desde)
+    lista = [(ticker, data, valor) for ticker, pagos in eventos.items() for data, valor in pagos]
+    await banco.escrever(proventos.registrar_eventos, lista)
+    # Fundos sem provento novo também precisam que a janela ande
+    await banco.escrever(proventos.expirar_janelas)
+
+
+def unico(job, nome=None):
+    """Job diário que só um dos processos do bot executa: quem pegar o lease primeiro."""
+    recurso = f"job:{nome or job.__name__}"
+
+    @functools.wraps(job)
+    async def envolvido(context):
+        trabalhador = context.bot_data['trabalhador']
+        if not await banco.escrever(trabalhador.exclusivo, recurso, JANELA_JOB_DIARIO):
+            logger.info("%s já está com outro processo", recurso)
+            return
+        await job(context)
+
+    return envolvido
+
+
+async def sincronizar_tarefas(app):
+    # Agenda o que é novo no banco (inclusive criado por outro processo) e tira o que saiu
+    funcoes = app.bot_data['tarefas']
+    if not funcoes:
+        return
+    agendadas, removidas = tarefas.sincronizar(app.job_queue, await banco.ler(tarefas.ativas), funcoes, FUSO_B3)
+    if agendadas or removidas:
+        logger.info("Tarefas: %d agendada(s), %d removida(s)", agendadas, removidas)
+
+
+async def fechamento_diario(context: ContextTypes.DEFAULT_TYPE):
+    # Todo processo agenda o relatório de todos os chats; só o dono da fatia do chat envia
+    if not context.bot_data['trabalhador'].possui_chat(context.job.chat_id):
+        return
+    if not context.bot_data['agenda'].calendario.dia_util(datetime.datetime.now(FUSO_B3).date()):
+        return
+    await relatorio_fechamento(context=context)
+
+
+async def renovar_concessoes(context: ContextTypes.DEFAULT_TYPE):
+    app = context.application
+    trabalhador = app.bot_data['trabalhador']
+    ganhas, _ = await banco.escrever(trabalhador.ciclo)
+    if ganhas:
+        # O estado das regras (armada/último aviso) dos tickers assumidos estava com outro processo
+        alertas.descartar_indice()
+    await sincronizar_tarefas(app)
+
+    # Polling: o Telegram só aceita um getUpdates por vez, então só o dono do lease faz polling
+    updater = app.updater
+    if updater is None or app.bot_data.get('encerrando'):
+        return
+    if await banco.escrever(trabalhador.manter, concessoes.UPDATES):
+        if not updater.running:
+            logger.info("%s assumiu o polling", trabalhador.identificador)
+            # Sem descartar pendentes: podem ser de um processo que acabou de cair
+            await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    elif updater.running:
+        await updater.stop()
 
 
 async def relatorio_fechamento(update: Update = None, context: ContextTypes.DEFAULT_TYPE = None):
@@ -100,34 +236,17 @@ async def relatorio_fechamento(update: Update = None, context: ContextTypes.DEFA
         await context.bot.send_chat_action(chat_id=chat_id, action="typing")
 
     def get_data():
-        connection.close()
-        fundos = FundoImobiliario.objects.filter(quantidade__gt=0)
-
-        # Criamos o dicionário de dados aqui para evitar o NameError
-        resumo = {
-            'total_inv': 0,
-            'total_atu': 0,
-            'total_div': 0,
-            'detalhes': []
-        }
-
-        for f in fundos:
-            v_inv = float(f.quantidade) * float(f.preco_medio)
-            v_atu = float(f.quantidade) * float(f.preco_atual)
-            div = float(f.quantidade) * float(f.ultimo_dividendo or 0)
-
-            resumo['total_inv'] += v_inv
-            resumo['total_atu'] += v_atu
-            resumo['total_div'] += div
-
+        resumo = resumo_carteira()
+        return {
+            'total_inv': resumo['totais']['investido'],
+            'total_atu': resumo['totais']['atual'],
+            'total_div': resumo['totais']['renda'],
             # Adiciona uma linha simples para cada fundo
-            tipo = (f.tipo or "Tijolo").capitalize()
-            resumo['detalhes'].append(f"🔹 {f.ticker} ({tipo})")
-
-        return resumo
+            'detalhes': [f"🔹 {f['ticker']} ({normalizar_tipo(f['tipo'])})" for f in resumo['fundos']],
+        }
 
     # Aqui definimos a variável 'dados' que estava faltando!
-    dados = await sync_to_async(get_data)()
+    dados = await banco.ler(get_data)
 
     if dados['total_atu'] == 0 and dados['total_inv'] == 0:
         if update:
@@ -152,110 +271,177 @@ async def relatorio_fechamento(update: Update = None, context: ContextTypes.DEFA
 # --- 4. HANDLERS ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    # Remove jobs antigos para não duplicar
-    current_jobs = context.job_queue.get_jobs_by_name(f"vigia_{chat_id}")
-    for job in current_jobs: job.schedule_removal()
-
-    context.job_queue.run_repeating(vigia_precos, interval=INTERVALO_SINAIS, first=10, chat_id=chat_id,
-                                    name=f"vigia_{chat_id}")
+    # O vigia é um job global; aqui só registramos o chat como assinante
+    await banco.escrever(assinaturas.ativar, chat_id, ALVOS_COMPRA)
+    # Relatório de fechamento do chat (gravado junto com a assinatura)
+    await sincronizar_tarefas(context.application)
 
     await update.message.reply_text("🚀 **Sistemas Ativados!**\nVigiando ativos e pronto para ordens.")
 
 
+async def parar_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await banco.escrever(assinaturas.desativar, update.effective_chat.id)
+    await sincronizar_tarefas(context.application)
+    await update.message.reply_text("🔕 Alertas desativados. Use /start para voltar.")
+
+
+async def alvo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    try:
+        if not context.args:
+            alvos = await banco.ler(assinaturas.listar_alvos, chat_id)
+            if not alvos:
+                await update.message.reply_text("📭 Nenhum alvo cadastrado.")
+                return
+            linhas = [f"🎯 {ticker}: R$ {preco:.2f}" for ticker, preco in alvos]
+            await update.message.reply_text("\n".join(linhas))
+            return
+
+        ticker = context.args[0].upper()
+        preco = Decimal(context.args[1].replace(',', '.'))
+        await banco.escrever(assinaturas.definir_alvo, chat_id, ticker, preco)
+        if preco > 0:
+            await update.message.reply_text(f"🎯 Alvo de {ticker} definido em R$ {preco:.2f}")
+        else:
+            await update.message.reply_text(f"🗑️ Alvo de {ticker} removido.")
+    except (IndexError, ValueError, InvalidOperation):
+        await update.message.reply_text("⚠️ Use: /alvo TICKER PRECO (0 remove) ou /alvo para listar")
+
+
+async def alerta_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat_id = update.effective_chat.id
+    uso = ("⚠️ Use: /alerta TICKER TIPO VALOR [COOLDOWN_MIN]\n"
+           "Tipos: preco< preco> var pvp< dy>\n"
+           "Ex: /alerta HGLG11 pvp< 0.95\n"
+           "/alerta lista as regras, /alerta rm ID remove")
+    try:
+        if not context.args:
+            regras = await banco.ler(assinaturas.listar_regras, chat_id)
+            if not regras:
+                await update.message.reply_text("📭 Nenhuma regra cadastrada.")
+                return
+            tokens = {tipo: token for token, tipo in TOKENS_REGRA.items()}
+            linhas = [
+                f"#{r.id} {r.ticker} {tokens[r.tipo]} {r.limite:g}" + ("" if r.armada else " (disparada)")
+                for r in regras
+            ]
+            await update.message.reply_text("\n".join(linhas))
+            return
+
+        if context.args[0].lower() == 'rm':
+            removida = await banco.escrever(assinaturas.remover_regra, chat_id, int(context.args[1]))
+            await update.message.reply_text("🗑️ Regra removida." if removida else "❌ Regra não encontrada.")
+            return
+
+        ticker = context.args[0].upper()
+        tipo = TOKENS_REGRA[context.args[1].lower()]
+        limite = float(context.args[2].replace(',', '.'))
+        cooldown = int(context.args[3]) * 60 if len(context.args) > 3 else 0
+        regra = await banco.escrever(assinaturas.criar_regra, chat_id, ticker, tipo, limite, cooldown)
+        await update.message.reply_text(f"🔔 Regra #{regra.id} criada para {ticker}.")
+    except (IndexError, KeyError, ValueError):
+        await update.message.reply_text(uso)
+
+
 async def comprar_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
     try:
         ticker = context.args[0].upper().strip()
         qtd = int(context.args[1])
-        preco = float(context.args[2].replace(',', '.'))
+        preco = Decimal(context.args[2].replace(',', '.'))
         # Pega o tipo se o usuário digitar, senão fica "Tijolo" por padrão
         tipo = context.args[3].capitalize() if len(context.args) > 3 else "Tijolo"
 
         def db_work():
-            connection.close()
-            with transaction.atomic():
-                fundo, _ = FundoImobiliario.objects.get_or_create(ticker=ticker)
-
-                # Atualiza o tipo (mesmo que o fundo já exista)
-                fundo.tipo = tipo
-
-                qtd_ant = fundo.quantidade or 0
-                pm_ant = float(fundo.preco_medio or 0)
-                nova_qtd = qtd_ant + qtd
-                novo_pm = ((qtd_ant * pm_ant) + (qtd * preco)) / nova_qtd
-
-                fundo.quantidade = nova_qtd
-                fundo.preco_medio = novo_pm
-                fundo.save()
-                return nova_qtd, tipo
+            posicao, _ = registrar_operacao(ticker, Operacao.COMPRA, qtd, preco, tipo_fundo=tipo)
+            return posicao.quantidade, tipo
 
-        res_qtd, res_tipo = await sync_to_async(db_work)()
+        res_qtd, res_tipo = await banco.escrever(db_work)
         await update.message.reply_text(f"✅ {ticker} ({res_tipo}) atualizado para {res_qtd} cotas.")
     except Exception as e:
         await update.message.reply_text(
             f"❌ Erro! Use: /comprar TICKER QTD PRECO TIPO\nEx: /comprar MXRF11 10 9.74 Papel")
 
 
-from asgiref.sync import sync_to_async
-from django.db import connection
-
-
 async def vender_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         ticker = context.args[0].upper()
         qtd_venda = int(context.args[1])
-        print(f"DEBUG: Tentando vender {qtd_venda} de {ticker}...")  # Veja isso no terminal!
+        logger.debug("Vendendo %s cotas de %s", qtd_venda, ticker)
+        # Preço opcional; sem ele, usa a última cotação conhecida para apurar o lucro
+        preco_venda = Decimal(context.args[2].replace(',', '.')) if len(context.args) > 2 else None
 
         def db_venda():
-            from django.db import connection
-            connection.close()  # Libera o banco para evitar 'Database is locked'
-
             fundo = FundoImobiliario.objects.filter(ticker=ticker).first()
             if not fundo:
                 return f"❌ {ticker} não encontrado."
 
-            if fundo.quantidade < qtd_venda:
-                return f"❌ Você só tem {fundo.quantidade} cotas."
-
-            fundo.quantidade -= qtd_venda
-            fundo.save()
-            return f"✅ Vendido! {ticker} agora tem {fundo.quantidade} cotas."
-
-        msg = await sync_to_async(db_venda)()
+            preco = preco_venda if preco_venda is not None else fundo.preco_atual
+            if not preco:
+                # Sem cotação ainda: lucro e livro ficariam com preço zero
+                return (f"❌ Ainda não há cotação de {ticker}. Informe o preço: "
+                        f"/vender {ticker} {qtd_venda} PRECO")
+            try:
+                posicao, lucro = registrar_operacao(ticker, Operacao.VENDA, qtd_venda, preco)
+            except OperacaoInvalida as e:
+                return f"❌ {e}"
+            origem = "" if preco_venda is not None else " (última cotação)"
+            return (f"✅ Vendido a R$ {preco:.2f}{origem}! {ticker} agora tem {posicao.quantidade} cotas.\n"
+                    f"💵 Lucro realizado: R$ {lucro:+.2f}")
+
+        msg = await banco.escrever(db_venda)
         await update.message.reply_text(msg)
 
-    except (IndexError, ValueError):
-        await update.message.reply_text("⚠️ Use: /vender TICKER QTD")
+    except (IndexError, ValueError, InvalidOperation):
+        await update.message.reply_text("⚠️ Use: /vender TICKER QTD [PRECO]")
     except Exception as e:
-        print(f"ERRO NO VENDER: {e}")
+        logger.exception("Erro ao vender %s", context.args)
         await update.message.reply_text(f"💥 Erro: {e}")
 
 
+async def amortizacao_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        ticker = context.args[0].upper()
+        valor = Decimal(context.args[1].replace(',', '.'))
+
+        def db_amortizacao():
+            try:
+                posicao, _ = registrar_operacao(ticker, Operacao.AMORTIZACAO, 1, valor)
+            except OperacaoInvalida as e:
+                return f"❌ {e}"
+            return (f"✅ Amortização de R$ {valor:.2f}/cota em {ticker} registrada.\n"
+                    f"📉 Novo preço médio: R$ {posicao.preco_medio:.2f}")
+
+        msg = await banco.escrever(db_amortizacao)
+        await update.message.reply_text(msg)
+    except (IndexError, ValueError, InvalidOperation):
+        await update.message.reply_text("⚠️ Use: /amortizacao TICKER VALOR_POR_COTA")
+
+
 async def dividendo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         ticker = context.args[0].upper()
         valor = float(context.args[1].replace(',', '.'))
+        # float() aceita 'nan' e 'inf', que contaminariam a soma de 12 meses
+        if not (math.isfinite(valor) and valor > 0):
+            raise ValueError
 
-        def save_div():
-            connection.close()
-            fundo = FundoImobiliario.objects.get(ticker=ticker)
-            fundo.ultimo_dividendo = valor
-            fundo.save()
-
-        await sync_to_async(save_div)()
+        # Vira um evento no histórico de proventos e atualiza a média de 12 meses
+        await banco.escrever(proventos.registrar_dividendo, ticker, valor)
         await update.message.reply_text(f"✅ Provento de {ticker} atualizado: R$ {valor:.2f}")
-    except:
+    except (IndexError, ValueError):
         await update.message.reply_text("❌ Use: /div TICKER VALOR")
+    except FundoImobiliario.DoesNotExist:
+        await update.message.reply_text(f"❌ {ticker} não encontrado.")
 
 
 async def status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
 
     def buscar_dados():
-        connection.close()
-        fundos = FundoImobiliario.objects.filter(quantidade__gt=0).order_by('-quantidade')
+        resumo = resumo_carteira()
 
-        if not fundos.exists():
+        if not resumo['fundos']:
             return None
 
         EMOJI_TIPOS = {
@@ -266,47 +452,40 @@ async def status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'Desenvolvimento': '🏗️'
         }
 
-        total_investido = 0
-        total_atual = 0
-        renda_mensal = 0
-        linhas = []
-
-        for f in fundos:
-            qtd = f.quantidade
-            v_inv = float(qtd) * float(f.preco_medio)
-            v_atu = float(qtd) * float(f.preco_atual)
-            lucro = v_atu - v_inv
-            perc_lucro = (lucro / v_inv * 100) if v_inv > 0 else 0
-            renda = float(qtd) * float(f.ultimo_dividendo or 0)
+        indicadores = TabelaIndicadores(FundoImobiliario.objects.filter(quantidade__gt=0)).por_ticker()
 
-            total_investido += v_inv
-            total_atual += v_atu
-            renda_mensal += renda
+        linhas = []
+        for f in resumo['fundos']:
+            ind = indicadores[f['ticker']]
+            perc_lucro = (f['lucro'] / f['investido'] * 100) if f['investido'] > 0 else 0
 
             # Pega o tipo do banco. Se estiver vazio no banco, usa "Tijolo"
-            tipo_fii = (f.tipo or "Tijolo").capitalize()
+            tipo_fii = normalizar_tipo(f['tipo'])
             emoji_tipo = EMOJI_TIPOS.get(tipo_fii, '💰')
 
-            emoji_rent = "🟢" if lucro >= 0 else "🔴"
+            emoji_rent = "🟢" if f['lucro'] >= 0 else "🔴"
 
             linhas.append(
-                f"{emoji_rent} *{f.ticker}* ({emoji_tipo} {tipo_fii})\n"
-                f"      {qtd} cotas | Lucro: R$ {lucro:.2f} ({perc_lucro:.1f}%)"
+                f"{emoji_rent} *{f['ticker']}* ({emoji_tipo} {tipo_fii})\n"
+                f"      {f['quantidade']} cotas | Lucro: R$ {f['lucro']:.2f} ({perc_lucro:.1f}%)\n"
+                f"      DY {ind['dividend_yield']:.2f}% (12m {ind['dy_12m']:.2f}%) | P/VP {ind['p_vp']:.2f}"
+                + (f" | 🎯 Magic: {ind['quantidade']}/{ind['magic_number']}" if ind['magic_number'] else "")
             )
 
+        totais = resumo['totais']
         return {
             'linhas': linhas,
-            'investido': total_investido,
-            'atual': total_atual,
-            'renda': renda_mensal,
-            'lucro_total': total_atual - total_investido
+            'investido': totais['investido'],
+            'atual': totais['atual'],
+            'renda': totais['renda'],
+            'lucro_total': totais['lucro']
         }
 
     # A variável 'dados' DEVE ser definida aqui, fora da subfunção
     try:
-        dados = await sync_to_async(buscar_dados)()
-    except Exception as e:
-        print(f"Erro ao buscar dados: {e}")
+        dados = await banco.ler(buscar_dados)
+    except Exception:
+        logger.exception("Erro ao buscar dados do /status")
         await update.message.reply_text("❌ Erro ao acessar o banco de dados.")
         return
 
@@ -327,40 +506,270 @@ async def status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(msg, parse_mode='Markdown')
 
 
-# --- 5. CLASSE PRINCIPAL ---
-class Command(BaseCommand):
-    def handle(self, *args, **options):
-        TOKEN = '7982038153:AAF9iP9-XVgVN3wFSSRyhkwj943_K3-NeJY'
+async def projecao_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        anos = int(context.args[0]) if context.args else projecao.configuracao()['anos']
+        aporte = float(context.args[1].replace(',', '.')) if len(context.args) > 1 else 0.0
+        if not 1 <= anos <= 50 or aporte < 0:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("⚠️ Use: /projecao [ANOS] [APORTE_MENSAL]\nEx: /projecao 20 500")
+        return
 
-        app = (ApplicationBuilder().token(TOKEN)
-               .connect_timeout(30).read_timeout(30).write_timeout(30).build())
+    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+    carteira = await banco.ler(projecao.carregar_carteira)
+    if not carteira['tickers']:
+        await update.message.reply_text("📭 Sua carteira está vazia no momento.")
+        return
 
-        # REGISTRO DE TODOS OS COMANDOS
-        app.add_handler(CommandHandler("start", start))
-        app.add_handler(CommandHandler("comprar", comprar_handler))
-        app.add_handler(CommandHandler("vender", vender_handler))
-        app.add_handler(CommandHandler("div", dividendo_handler))
-        app.add_handler(CommandHandler("hoje", relatorio_fechamento))
-        app.add_handler(CommandHandler("status", status_handler))
-        app.add_handler(CommandHandler("carteira", status_handler))  # Dois nomes para o mesmo comando
+    # A simulação é só NumPy: roda fora do event loop (e nos processos do pool)
+    res = await asyncio.to_thread(projecao.simular, carteira, anos, None, aporte)
+    baixo, meio, alto = sorted(res['patrimonio'])
+    marcos = sorted({a for a in (1, 5, 10, 20, 30, anos) if a <= anos})
+
+    msg = f"❄️ **PROJEÇÃO BOLA DE NEVE** ({anos} anos"
+    msg += f", aporte R$ {aporte:.2f}/mês)\n\n" if aporte else ")\n\n"
+    for ano in marcos:
+        msg += (f"📅 *{ano} ano(s):* R$ {res['patrimonio'][meio][ano]:,.0f} "
+                f"(R$ {res['patrimonio'][baixo][ano]:,.0f} a R$ {res['patrimonio'][alto][ano]:,.0f})\n"
+                f"      💸 Renda: R$ {res['renda'][meio][ano]:,.2f}/mês\n")
+    fonte = (f"{res['meses_historico']} meses do acervo" if res['fonte'] == 'acervo'
+             else "modelo lognormal (rode o backfill para usar a história real)")
+    msg += (f"\n_Mediana e faixa p{baixo}–p{alto} de {res['caminhos']:,} cenários, "
+            f"proventos reinvestidos em cotas inteiras. Base: {fonte}. {res['segundos']:.2f}s_")
+    await update.message.reply_text(msg, parse_mode='Markdown')
 
-        # print("--- BOT RODANDO (WAL MODE) ---")
-        # if __name__ == '__main__':
-        #     # drop_pending_updates=True limpa o "cache" de mensagens ao iniciar
-        #     app.run_polling(drop_pending_updates=True)
 
-        # ... (todo o seu código anterior de funções e comandos) ...
+async def aporte_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        valor = float(context.args[0].replace(',', '.'))
+        objetivo = context.args[1].lower() if len(context.args) > 1 else aporte.RENDA
+        if not aporte.orcamento_valido(valor) or objetivo not in aporte.OBJETIVOS:
+            raise ValueError
+    except (IndexError, ValueError):
+        maximo = aporte.configuracao()['maximo_orcamento']
+        await update.message.reply_text(f"⚠️ Use: /aporte VALOR [{'|'.join(aporte.OBJETIVOS)}]\n"
+                                        f"Ex: /aporte 1500 magic (VALOR até {maximo:,.0f})")
+        return
 
-        print("🚀 Bot iniciado com sucesso! Pressione Ctrl+C para parar.")
+    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+    universo = await banco.ler(aporte.carregar_universo)
+    res = await asyncio.to_thread(aporte.resolver, universo, valor, objetivo)
+    if not res['compras']:
+        await update.message.reply_text("🤷 Nenhum fundo no preço teto cabe nesse valor.")
+        return
+
+    msg = f"🛒 **SUGESTÃO DE APORTE** (R$ {valor:.2f}, foco em {objetivo})\n\n"
+    for c in res['compras']:
+        msg += f"🔹 *{c['ticker']}* ({c['tipo']}): {c['cotas']} × R$ {c['preco']:.2f} = R$ {c['custo']:.2f}\n"
+        if objetivo == aporte.MAGIC and c['magic_number']:
+            msg += f"      🎯 Magic: {c['quantidade']} → {c['quantidade'] + c['cotas']}/{c['magic_number']}\n"
+    msg += "\n" + "─" * 15 + "\n"
+    msg += f"💰 **Total:** R$ {res['gasto']:.2f} (sobra R$ {res['sobra']:.2f})\n"
+    msg += f"💸 **Renda Adicional:** R$ {res['renda']:.2f}/mês"
+    await update.message.reply_text(msg, parse_mode='Markdown')
 
-        # Inicia o monitoramento e mantém o script rodando infinitamente
-        app.run_polling(drop_pending_updates=True)
 
-    # Esta parte garante que o Django execute o loop corretamente
-    if __name__ == "__main__":
+async def importar_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Extrato de negociação (CSV/XLSX) enviado como documento vai direto para o livro de operações
+    documento = update.message.document
+    if documento.file_size and documento.file_size > LIMITE_DOCUMENTO:
+        await update.message.reply_text("❌ Arquivo maior que 20 MB. Use: python manage.py importar_operacoes")
+        return
+    await update.message.reply_text(f"📥 Importando {documento.file_name}...")
+
+    def executar(funcao, *args):
+        # Cada lote é uma escrita na thread escritora, intercalada com as do vigia e dos comandos
+        return banco.escritor.enviar(funcao, *args).result()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = Path(pasta) / Path(documento.file_name).name
+        arquivo = await documento.get_file()
+        await arquivo.download_to_drive(caminho)
         try:
-            # Chame aqui a sua função principal que configura o 'app'
-            # ou certifique-se que o código acima não está dentro de uma função solta
-            pass
-        except KeyboardInterrupt:
-            pass
+            # A leitura do arquivo fica fora do event loop; só os lotes passam pelo escritor
+            resultado = await asyncio.to_thread(importacao.importar, caminho, executar=executar)
+        except importacao.ImportacaoInvalida as e:
+            await update.message.reply_text(f"❌ {e}")
+            return
+
+    icone = "⚠️" if resultado['inconsistentes'] or resultado['invalidas'] else "✅"
+    await update.message.reply_text(f"{icone} {importacao.resumo(resultado)}")
+
+
+async def perfil_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Só quem está em FII_ADMINS liga o perfil: os arquivos ficam no disco do servidor
+    if update.effective_user.id not in getattr(settings, 'FII_ADMINS', []):
+        await update.message.reply_text("⛔ Comando restrito aos administradores.")
+        return
+
+    perfilador = context.bot_data['perfil']
+    acao = context.args[0].lower() if context.args else 'status'
+    if acao == 'on':
+        try:
+            perfilador.ligar(context.args[1].lower() if len(context.args) > 1 else None)
+        except ValueError as e:
+            await update.message.reply_text(f"⚠️ {e}. Modos: {', '.join(perfil.MODOS)}")
+            return
+    elif acao == 'off':
+        perfilador.desligar()
+    elif acao != 'status':
+        await update.message.reply_text(f"⚠️ Use: /perfil on [{'|'.join(perfil.MODOS)}] | off | status")
+        return
+    await update.message.reply_text(f"🔬 {perfilador.situacao()}")
+
+
+def restaurar_estado():
+    # Assinaturas e regras já vivem no banco: nenhum chat precisa mandar /start de novo.
+    # Carregar tudo agora abre as conexões e deixa /status e o vigia prontos desde o boot.
+    indice = alertas.obter_indice()
+    cotacoes = aquecer_cotacoes()
+    return Assinatura.objects.filter(ativa=True).count(), len(indice.regras), cotacoes
+
+
+async def iniciar_servicos(app):
+    # Primeiro ciclo antes do vigia: o processo já começa sabendo quais fatias são suas
+    await banco.escrever(app.bot_data['trabalhador'].ciclo)
+    app.bot_data['fila_envio'] = FilaEnvio(app.bot)
+    app.bot_data['fila_envio'].iniciar()
+    calendario = await banco.ler(CalendarioB3.carregar)
+    app.bot_data['agenda'] = AgendadorAdaptativo(calendario)
+    chats, regras, cotacoes = await banco.ler(restaurar_estado)
+    logger.info("Estado restaurado: %d chat(s) ativo(s), %d regra(s), %d cotação(ões) recente(s)", chats, regras, cotacoes)
+    # Jobs restaurados do banco, com atrasos espalhados em vez de todos no mesmo segundo
+    if app.bot_data['tarefas']:
+        await banco.escrever(tarefas.garantir_globais, TAREFAS_GLOBAIS)
+    await sincronizar_tarefas(app)
+
+
+async def parar_fila(app):
+    # post_stop: os jobs e handlers já pararam, mas o cliente HTTP ainda está aberto.
+    # Depois do shutdown() o HTTPXRequest fecha e o que sobrasse na fila se perderia.
+    await app.bot_data['fila_envio'].parar()
+
+
+async def encerrar_servicos(app):
+    # Devolve as fatias na hora, sem os outros processos esperarem a validade
+    await banco.escrever(app.bot_data['trabalhador'].encerrar)
+    await asyncio.to_thread(telemetria.gravar_retrato, app.bot_data['trabalhador'].identificador)
+
+
+async def gravar_metricas(context: ContextTypes.DEFAULT_TYPE):
+    # O site (/metricas/) e o comando `manage.py metricas` leem este retrato
+    await asyncio.to_thread(telemetria.gravar_retrato, context.bot_data['trabalhador'].identificador)
+
+
+def montar_aplicacao(perfilador, webhook=False, requisicao=None, com_tarefas=True):
+    """Aplicação do bot com todos os comandos e jobs; usada pelo polling e pelo modo webhook."""
+    construtor = (ApplicationBuilder().token(settings.FII_TELEGRAM_TOKEN)
+                  .post_init(iniciar_servicos).post_stop(parar_fila)
+                  .post_shutdown(encerrar_servicos))
+    if requisicao is not None:
+        construtor = construtor.request(requisicao).get_updates_request(requisicao)
+    else:
+        construtor = construtor.connect_timeout(30).read_timeout(30).write_timeout(30)
+    if webhook:
+        # Os updates chegam pela view do Django (bot.webhook); não há Updater fazendo polling
+        construtor = construtor.updater(None)
+    app = construtor.build()
+    app.bot_data['perfil'] = perfilador
+    app.bot_data['trabalhador'] = concessoes.Trabalhador()
+
+    # REGISTRO DE TODOS OS COMANDOS
+    comandos = [
+        ("start", start), ("parar", parar_handler), ("alvo", alvo_handler), ("alerta", alerta_handler),
+        ("comprar", comprar_handler), ("vender", vender_handler), ("amortizacao", amortizacao_handler),
+        ("div", dividendo_handler), ("hoje", relatorio_fechamento), ("status", status_handler),
+        ("carteira", status_handler),  # Dois nomes para o mesmo comando
+        ("projecao", projecao_handler), ("aporte", aporte_handler),
+    ]
+    for comando, handler in comandos:
+        # Cada comando mede a própria duração, erros e operações de banco
+        handler = perfilador.envolver(telemetria.instrumentar(handler, comando), comando)
+        app.add_handler(CommandHandler(comando, handler))
+    app.add_handler(CommandHandler(["perfil", "profile"], perfil_handler))
+    extratos = filters.Document.FileExtension('csv') | filters.Document.FileExtension('xlsx')
+    app.add_handler(MessageHandler(extratos, perfilador.envolver(
+        telemetria.instrumentar(importar_handler, "importar"), "importar")))
+
+    # Callbacks das tarefas guardadas no banco (bot.tarefas); os jobs são agendados no post_init
+    app.bot_data['tarefas'] = {}
+    if com_tarefas:
+        app.bot_data['tarefas'] = {
+            # Um único vigia para todos os chats assinantes
+            'vigia': perfilador.envolver(telemetria.instrumentar_job(vigia_precos, "vigia"), "vigia"),
+            'compactar_historico': perfilador.envolver(telemetria.instrumentar_job(unico(compactar_historico))),
+            'atualizar_proventos': perfilador.envolver(telemetria.instrumentar_job(unico(atualizar_proventos))),
+            tarefas.FECHAMENTO: perfilador.envolver(telemetria.instrumentar_job(fechamento_diario, "fechamento"),
+                                                    "fechamento"),
+        }
+    renovacao = app.bot_data['trabalhador'].config['renovacao']
+    app.job_queue.run_repeating(renovar_concessoes, interval=renovacao, first=0, name="concessoes")
+    app.job_queue.run_repeating(gravar_metricas, interval=telemetria.INTERVALO_RETRATO, first=5,
+                                name="metricas")
+    return app
+
+
+def criar_perfilador(pasta=None, modo=None, alvos=(), limite_lento=perfil.LIMITE_LENTO):
+    # Sempre instalado; desligado só cronometra. Liga aqui ou em tempo de execução com /perfil on
+    perfilador = perfil.Perfilador(pasta or settings.BASE_DIR / 'perfis', modo=modo or perfil.CPROFILE,
+                                   alvos=alvos, limite_lento=limite_lento)
+    if modo:
+        perfilador.ligar()
+    return perfilador
+
+
+async def rodar(app):
+    """Como o run_polling, mas o polling só liga quando este processo tem o lease de updates."""
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+
+    parar = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sinal in (signal.SIGINT, signal.SIGTERM):
+        # No Windows não há add_signal_handler: o Ctrl+C chega como KeyboardInterrupt
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(sinal, parar.set)
+    try:
+        await parar.wait()
+    finally:
+        # O job de concessões não liga mais o polling daqui em diante
+        app.bot_data['encerrando'] = True
+        if app.updater.running:
+            await app.updater.stop()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+# --- 5. CLASSE PRINCIPAL ---
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--perfil', choices=perfil.MODOS,
+                            help='Já inicia perfilando (cprofile só vê o event loop; amostragem vê todas as threads)')
+        parser.add_argument('--perfil-alvos', nargs='+', default=[], metavar='NOME',
+                            help='Comandos/jobs perfilados (ex.: status vigia); padrão: todos')
+        parser.add_argument('--perfil-pasta', default=str(settings.BASE_DIR / 'perfis'),
+                            help='Onde gravar um arquivo por chamada perfilada')
+        parser.add_argument('--perfil-lento', type=float, default=perfil.LIMITE_LENTO, metavar='SEGUNDOS',
+                            help='Chamadas mais lentas que isto registram o resumo da pilha no log')
+
+    def handle(self, *args, **options):
+        if settings.FII_WEBHOOK_URL:
+            # O polling apagaria o webhook registrado no Telegram
+            raise CommandError("FII_WEBHOOK_URL está definido: o bot roda no servidor ASGI "
+                               "(uvicorn core.asgi:application), não pelo runbot.")
+
+        perfilador = criar_perfilador(options['perfil_pasta'], options['perfil'], options['perfil_alvos'],
+                                      options['perfil_lento'])
+        app = montar_aplicacao(perfilador)
+
+        print("🚀 Bot iniciado com sucesso! Pressione Ctrl+C para parar.")
+
+        # Mantém o script rodando até Ctrl+C / SIGTERM
+        asyncio.run(rodar(app))
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError, TimedOut
+
+from bot import telemetria
+
+logger = logging.getLogger(__name__)
+
+# Limites do Telegram: ~1 msg/s por chat e ~30 msg/s no total do bot
+TAXA_POR_CHAT = 1.0
+TAXA_GLOBAL = 25.0
+# Alertas do mesmo chat que chegam dentro desta janela viram um único resumo
+JANELA_AGRUPAMENTO = 2.0
+TAMANHO_MAXIMO = 4096
+MAX_TENTATIVAS = 5
+# Prazo para entregar o que ainda está na fila quando o bot para (segundos)
+TEMPO_DRENAGEM = 10.0
+SEPARADOR = "\n\n➖➖➖\n\n"
+
+
+class BaldeTokens:
+    def __init__(self, taxa, capacidade=None, relogio=time.monotonic):
+        self.taxa = taxa
+        self.capacidade = capacidade if capacidade is not None else max(taxa, 1.0)
+        self.relogio = relogio
+        self.tokens = self.capacidade
+        self.ultimo = relogio()
+
+    def _repor(self):
+        agora = self.relogio()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.ultimo) * self.taxa)
+        self.ultimo = agora
+
+    def espera(self):
+        """Segundos até haver um token disponível (0 se já houver)."""
+        self._repor()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.taxa
+
+    def consumir(self):
+        self._repor()
+        self.tokens -= 1
+
+
+def _segundos(retry_after):
+    # Conforme a versão do python-telegram-bot, retry_after é int ou timedelta
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+def _fatiar(texto):
+    """Quebra um texto longo em pedaços de até 4096 caracteres, sempre em fim de linha.
+
+    Só uma linha sozinha maior que o limite é cortada no meio.
+    """
+    pedacos, atual = [], ''
+    for linha in texto.split('\n'):
+        while len(linha) > TAMANHO_MAXIMO:
+            if atual:
+                pedacos.append(atual)
+                atual = ''
+            pedacos.append(linha[:TAMANHO_MAXIMO])
+            linha = linha[TAMANHO_MAXIMO:]
+        candidato = f"{atual}\n{linha}" if atual else linha
+        if len(candidato) > TAMANHO_MAXIMO:
+            pedacos.append(atual)
+            candidato = linha
+        atual = candidato
+    if atual or not pedacos:
+        pedacos.append(atual)
+    return pedacos
+
+
+def montar_resumo(textos):
+    """Junta os alertas pendentes de um chat em mensagens de até 4096 caracteres.
+
+    As quebras caem entre alertas ou em fim de linha, nunca no meio de uma
+    linha (o que também deixaria a marcação Markdown aberta).
+    """
+    if len(textos) == 1:
+        return _fatiar(textos[0])
+
+    partes, atual = [], f"📬 *{len(textos)} alertas*"
+    for texto in textos:
+        candidato = atual + SEPARADOR + texto
+        if len(candidato) <= TAMANHO_MAXIMO:
+            atual = candidato
+            continue
+        partes.append(atual)
+        *inteiros, atual = _fatiar(texto)
+        partes.extend(inteiros)
+    partes.append(atual)
+    return partes
+
+
+class FilaEnvio:
+    """Fila assíncrona de mensagens de saída.
+
+    `enfileirar` nunca espera: quem produz alertas (o vigia) segue em frente e
+    esta fila entrega em segundo plano, respeitando um balde de tokens por chat
+    e outro global, agrupando os alertas de um mesmo chat num resumo e
+    obedecendo o RetryAfter do Telegram.
+    """
+
+    def __init__(self, bot, taxa_por_chat=TAXA_POR_CHAT, taxa_global=TAXA_GLOBAL,
+                 janela=JANELA_AGRUPAMENTO, tempo_drenagem=TEMPO_DRENAGEM, relogio=time.monotonic):
+        self.bot = bot
+        self.taxa_por_chat = taxa_por_chat
+        self.janela = janela
+        self.tempo_drenagem = tempo_drenagem
+        self.relogio = relogio
+        self.balde_global = BaldeTokens(taxa_global, relogio=relogio)
+        self.baldes = {}
+        self.pendentes = OrderedDict()  # chat_id -> (primeiro enfileiramento, [textos], parse_mode)
+        self.em_envio = set()
+        self.pausa_ate = 0.0
+        self.enviadas = 0
+        self.descartadas = 0
+        self._acordar = asyncio.Event()
+        self._tarefa = None
+        self._envios = set()
+
+    def enfileirar(self, chat_id, texto, parse_mode='Markdown'):
+        if chat_id in self.pendentes:
+            self.pendentes[chat_id][1].append(texto)
+        else:
+            self.pendentes[chat_id] = (self.relogio(), [texto], parse_mode)
+        self._acordar.set()
+
+    def iniciar(self):
+        if self._tarefa is None:
+            self._tarefa = asyncio.create_task(self._rodar())
+
+    async def parar(self, drenar=True):
+        """Para a fila; com `drenar`, antes espera a entrega do que falta por até `tempo_drenagem`."""
+        if drenar:
+            try:
+                await asyncio.wait_for(self._drenar(), timeout=self.tempo_drenagem)
+            except asyncio.TimeoutError:
+                # Um RetryAfter longo ou a rede fora não podem segurar o desligamento do bot
+                logger.warning("Fila de envio não esvaziou em %.0f s: %d chats pendentes, %d envios cancelados",
+                               self.tempo_drenagem, len(self.pendentes), len(self._envios))
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            self._tarefa = None
+        envios = list(self._envios)
+        for envio in envios:
+            envio.cancel()
+        await asyncio.gather(*envios, return_exceptions=True)
+
+    async def _drenar(self):
+        while self.pendentes or self._envios:
+            await asyncio.sleep(0.1)
+
+    def _balde(self, chat_id):
+        if chat_id not in self.baldes:
+            self.baldes[chat_id] = BaldeTokens(self.taxa_por_chat, capacidade=1, relogio=self.relogio)
+        return self.baldes[chat_id]
+
+    async def _rodar(self):
+        while True:
+            espera = self._despachar()
+            self._acordar.clear()
+            try:
+                await asyncio.wait_for(self._acordar.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+
+    def _despachar(self):
+        """Dispara os envios possíveis agora. Devolve quanto esperar até a próxima chance."""
+        agora = self.relogio()
+        if agora < self.pausa_ate:
+            return self.pausa_ate - agora
+
+        proxima = 60.0
+        for chat_id in list(self.pendentes):
+            if chat_id in self.em_envio:
+                continue
+            desde, _, _ = self.pendentes[chat_id]
+            falta_janela = desde + self.janela - agora
+            espera = max(falta_janela, self._balde(chat_id).espera(), self.balde_global.espera())
+            if espera > 0:
+                proxima = min(proxima, espera)
+                continue
+
+            _, textos, parse_mode = self.pendentes.pop(chat_id)
+            self._balde(chat_id).consumir()
+            self.balde_global.consumir()
+            self.em_envio.add(chat_id)
+            envio = asyncio.create_task(self._enviar(chat_id, textos, parse_mode))
+            self._envios.add(envio)
+            envio.add_done_callback(self._envios.discard)
+        return proxima
+
+    async def _reservar(self, chat_id):
+        # O primeiro pedaço já gastou os tokens em _despachar; os seguintes esperam a vez
+        while True:
+            espera = max(self.pausa_ate - self.relogio(), self._balde(chat_id).espera(),
+                         self.balde_global.espera())
+            if espera <= 0:
+                break
+            await asyncio.sleep(espera)
+        self._balde(chat_id).consumir()
+        self.balde_global.consumir()
+
+    async def _enviar(self, chat_id, textos, parse_mode):
+        try:
+            for numero, parte in enumerate(montar_resumo(textos)):
+                if numero:
+                    await self._reservar(chat_id)
+                try:
+                    await self._enviar_parte(chat_id, parte, parse_mode)
+                except TelegramError as e:
+                    self.descartadas += 1
+                    telemetria.TELEGRAM_MENSAGENS.inc(resultado='descartada')
+                    logger.warning("Falha ao enviar mensagem para %s: %s", chat_id, e)
+        finally:
+            self.em_envio.discard(chat_id)
+            self._acordar.set()
+
+    async def _enviar_parte(self, chat_id, parte, parse_mode):
+        for tentativa in range(1, MAX_TENTATIVAS + 1):
+            try:
+                with telemetria.TELEGRAM_SEGUNDOS.cronometrar():
+                    await self.bot.send_message(chat_id=chat_id, text=parte, parse_mode=parse_mode)
+                self.enviadas += 1
+                telemetria.TELEGRAM_MENSAGENS.inc(resultado='ok')
+                return
+            except RetryAfter as e:
+                telemetria.TELEGRAM_MENSAGENS.inc(resultado='retry_after')
+                if tentativa == MAX_TENTATIVAS:
+                    raise
+                # Flood control: pausa a fila inteira pelo tempo pedido
+                pausa = _segundos(e.retry_after)
+                self.pausa_ate = max(self.pausa_ate, self.relogio() + pausa)
+                await asyncio.sleep(pausa)
+            except BadRequest as e:
+                # Repetir não adianta. Se foi a marcação (ex.: "_" num nome solto), vai como texto puro.
+                if parse_mode is None:
+                    raise
+                telemetria.TELEGRAM_MENSAGENS.inc(resultado='texto_puro')
+                logger.info("Mensagem para %s recusada com %s (%s); reenviando sem formatação",
+                            chat_id, parse_mode, e)
+                parse_mode = None
+            except (TimedOut, NetworkError) as e:
+                # BadRequest também é NetworkError, por isso vem antes
+                telemetria.TELEGRAM_MENSAGENS.inc(resultado='erro_rede')
+                if tentativa == MAX_TENTATIVAS:
+                    raise
+                await asyncio.sleep(min(2 ** tentativa, 30))
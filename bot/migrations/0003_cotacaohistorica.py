@@ -0,0 +1,31 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0002_fundoimobiliario_tipo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CotacaoHistorica',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolucao', models.PositiveIntegerField(choices=[(0, 'Tick'), (300, '5 minutos'), (3600, '1 hora'), (86400, '1 dia')], default=0)),
+                ('instante', models.DateTimeField()),
+                ('abertura', models.FloatField()),
+                ('maxima', models.FloatField()),
+                ('minima', models.FloatField()),
+                ('fechamento', models.FloatField()),
+                ('amostras', models.PositiveIntegerField(default=1)),
+                ('fundo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='historico', to='bot.fundoimobiliario')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('fundo', 'resolucao', 'instante'), name='historico_unico')],
+            },
+        ),
+    ]
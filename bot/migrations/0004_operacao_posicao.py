@@ -0,0 +1,54 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def abrir_saldos(apps, schema_editor):
+    # Posições que já existiam viram uma compra de abertura no livro de operações
+    FundoImobiliario = apps.get_model('bot', 'FundoImobiliario')
+    Operacao = apps.get_model('bot', 'Operacao')
+    Posicao = apps.get_model('bot', 'Posicao')
+
+    for fundo in FundoImobiliario.objects.filter(quantidade__gt=0):
+        Operacao.objects.create(fundo=fundo, tipo='C', quantidade=fundo.quantidade, preco=fundo.preco_medio)
+        Posicao.objects.create(fundo=fundo, quantidade=fundo.quantidade,
+                               custo_total=fundo.preco_medio * fundo.quantidade)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0003_cotacaohistorica'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Posicao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.IntegerField(default=0)),
+                ('custo_total', models.DecimalField(decimal_places=6, default=0, max_digits=16)),
+                ('lucro_realizado', models.DecimalField(decimal_places=6, default=0, max_digits=16)),
+                ('amortizado', models.DecimalField(decimal_places=6, default=0, max_digits=16)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('fundo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='posicao', to='bot.fundoimobiliario')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Operacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('C', 'Compra'), ('V', 'Venda'), ('A', 'Amortização')], max_length=1)),
+                ('quantidade', models.IntegerField()),
+                ('preco', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('data', models.DateTimeField(default=django.utils.timezone.now)),
+                ('fundo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='operacoes', to='bot.fundoimobiliario')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fundo', 'data'], name='bot_operaca_fundo_i_b2572f_idx')],
+            },
+        ),
+        migrations.RunPython(abrir_saldos, migrations.RunPython.noop),
+    ]
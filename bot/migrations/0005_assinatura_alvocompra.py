@@ -0,0 +1,35 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0004_operacao_posicao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Assinatura',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.BigIntegerField(unique=True)),
+                ('ativa', models.BooleanField(default=True)),
+                ('criada_em', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AlvoCompra',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=10)),
+                ('preco_alvo', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('assinatura', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alvos', to='bot.assinatura')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('assinatura', 'ticker'), name='alvo_unico_por_chat')],
+            },
+        ),
+    ]
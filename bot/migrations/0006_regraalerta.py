@@ -0,0 +1,45 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def migrar_alvos(apps, schema_editor):
+    # Cada alvo de compra vira uma regra "preço abaixo de"
+    AlvoCompra = apps.get_model('bot', 'AlvoCompra')
+    RegraAlerta = apps.get_model('bot', 'RegraAlerta')
+    RegraAlerta.objects.bulk_create([
+        RegraAlerta(assinatura_id=alvo.assinatura_id, ticker=alvo.ticker, tipo='preco_abaixo',
+                    limite=float(alvo.preco_alvo))
+        for alvo in AlvoCompra.objects.all()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0005_assinatura_alvocompra'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegraAlerta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(db_index=True, max_length=10)),
+                ('tipo', models.CharField(choices=[('preco_abaixo', 'Preço abaixo de'), ('preco_acima', 'Preço acima de'), ('variacao', 'Variação (%) maior que'), ('pvp_abaixo', 'P/VP abaixo de'), ('dy_acima', 'DY (%) acima de')], default='preco_abaixo', max_length=20)),
+                ('limite', models.FloatField()),
+                ('histerese', models.FloatField(default=1.0)),
+                ('reaviso', models.FloatField(default=1.0)),
+                ('cooldown', models.PositiveIntegerField(default=0, help_text='segundos')),
+                ('armada', models.BooleanField(default=True)),
+                ('ultimo_valor', models.FloatField(blank=True, null=True)),
+                ('ultimo_disparo', models.DateTimeField(blank=True, null=True)),
+                ('assinatura', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='regras', to='bot.assinatura')),
+            ],
+        ),
+        migrations.RunPython(migrar_alvos, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='AlvoCompra',
+        ),
+    ]
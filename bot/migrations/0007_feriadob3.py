@@ -0,0 +1,60 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+FERIADOS = [
+    ('2026-01-01', 'Confraternização Universal'),
+    ('2026-02-16', 'Carnaval'),
+    ('2026-02-17', 'Carnaval'),
+    ('2026-04-03', 'Paixão de Cristo'),
+    ('2026-04-21', 'Tiradentes'),
+    ('2026-05-01', 'Dia do Trabalho'),
+    ('2026-06-04', 'Corpus Christi'),
+    ('2026-09-07', 'Independência do Brasil'),
+    ('2026-10-12', 'Nossa Senhora Aparecida'),
+    ('2026-11-02', 'Finados'),
+    ('2026-11-20', 'Dia Nacional de Zumbi e da Consciência Negra'),
+    ('2026-12-24', 'Véspera de Natal'),
+    ('2026-12-25', 'Natal'),
+    ('2026-12-31', 'Último dia útil do ano'),
+    ('2027-01-01', 'Confraternização Universal'),
+    ('2027-02-08', 'Carnaval'),
+    ('2027-02-09', 'Carnaval'),
+    ('2027-03-26', 'Paixão de Cristo'),
+    ('2027-04-21', 'Tiradentes'),
+    ('2027-05-27', 'Corpus Christi'),
+    ('2027-09-07', 'Independência do Brasil'),
+    ('2027-10-12', 'Nossa Senhora Aparecida'),
+    ('2027-11-02', 'Finados'),
+    ('2027-11-15', 'Proclamação da República'),
+    ('2027-12-24', 'Véspera de Natal'),
+    ('2027-12-31', 'Último dia útil do ano'),
+]
+
+
+def carregar_feriados(apps, schema_editor):
+    FeriadoB3 = apps.get_model('bot', 'FeriadoB3')
+    FeriadoB3.objects.bulk_create(
+        [FeriadoB3(data=data, descricao=descricao) for data, descricao in FERIADOS],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0006_regraalerta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeriadoB3',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField(unique=True)),
+                ('descricao', models.CharField(blank=True, max_length=60)),
+            ],
+        ),
+        migrations.RunPython(carregar_feriados, migrations.RunPython.noop),
+    ]
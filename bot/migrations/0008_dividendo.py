@@ -0,0 +1,69 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:26
+
+from datetime import date, timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def abrir_historico(apps, schema_editor):
+    # O único provento conhecido até aqui é o ultimo_dividendo digitado no /div;
+    # vira o primeiro evento, e a média mensal começa igual a ele
+    FundoImobiliario = apps.get_model('bot', 'FundoImobiliario')
+    Dividendo = apps.get_model('bot', 'Dividendo')
+    hoje = date.today()
+    fundos = list(FundoImobiliario.objects.filter(ultimo_dividendo__gt=0))
+    Dividendo.objects.bulk_create([
+        Dividendo(fundo=fundo, data=hoje, valor=fundo.ultimo_dividendo, fonte='manual') for fundo in fundos
+    ])
+    for fundo in fundos:
+        fundo.dividendos_12m = fundo.media_mensal_dividendos = fundo.ultimo_dividendo
+        fundo.dividendos_12m_eventos = 1
+        fundo.janela_dividendos = hoje - timedelta(days=365)
+    FundoImobiliario.objects.bulk_update(
+        fundos, ['dividendos_12m', 'media_mensal_dividendos', 'dividendos_12m_eventos', 'janela_dividendos'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0007_feriadob3'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fundoimobiliario',
+            name='dividendos_12m',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='fundoimobiliario',
+            name='dividendos_12m_eventos',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='fundoimobiliario',
+            name='janela_dividendos',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fundoimobiliario',
+            name='media_mensal_dividendos',
+            field=models.DecimalField(decimal_places=4, default=0, max_digits=12),
+        ),
+        migrations.CreateModel(
+            name='Dividendo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('valor', models.DecimalField(decimal_places=4, max_digits=10)),
+                ('fonte', models.CharField(choices=[('manual', 'Manual (/div)'), ('provedor', 'Provedor de cotações')], default='manual', max_length=10)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('fundo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dividendos', to='bot.fundoimobiliario')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('fundo', 'data'), name='dividendo_unico')],
+            },
+        ),
+        migrations.RunPython(abrir_historico, migrations.RunPython.noop),
+    ]
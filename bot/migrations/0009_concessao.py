@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_dividendo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Concessao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recurso', models.CharField(max_length=80, unique=True)),
+                ('dono', models.CharField(blank=True, default='', max_length=80)),
+                ('expira_em', models.DateTimeField(db_index=True)),
+                ('renovada_em', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
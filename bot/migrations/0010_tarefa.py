@@ -0,0 +1,42 @@
+# Generated by Django 6.0.2 on 2026-10-18 22:25
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def agendar_fechamentos(apps, schema_editor):
+    # Os chats que já assinavam passam a receber o relatório de fechamento das 18:10
+    Assinatura = apps.get_model('bot', 'Assinatura')
+    Tarefa = apps.get_model('bot', 'Tarefa')
+    Tarefa.objects.bulk_create([
+        Tarefa(nome=f'fechamento:{assinatura.chat_id}', funcao='fechamento', tipo='diaria',
+               horario=datetime.time(18, 10), dias_semana='1,2,3,4,5', assinatura=assinatura)
+        for assinatura in Assinatura.objects.all()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_concessao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tarefa',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=80, unique=True)),
+                ('funcao', models.CharField(max_length=40)),
+                ('tipo', models.CharField(choices=[('repetida', 'A cada intervalo'), ('diaria', 'Diária')], max_length=10)),
+                ('intervalo', models.FloatField(blank=True, help_text='segundos (tarefas repetidas)', null=True)),
+                ('horario', models.TimeField(blank=True, help_text='horário de Brasília (tarefas diárias)', null=True)),
+                ('dias_semana', models.CharField(default='0,1,2,3,4,5,6', help_text='0 = domingo, como no job_queue do PTB', max_length=13)),
+                ('ativa', models.BooleanField(default=True)),
+                ('assinatura', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tarefas', to='bot.assinatura')),
+            ],
+        ),
+        migrations.RunPython(agendar_fechamentos, migrations.RunPython.noop),
+    ]
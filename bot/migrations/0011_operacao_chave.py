@@ -0,0 +1,18 @@
+# Generated by Django 6.0.2 on 2026-10-18 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_tarefa'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operacao',
+            name='chave',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0011_operacao_chave'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Versao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=40, unique=True)),
+                ('valor', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
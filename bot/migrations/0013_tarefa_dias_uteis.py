@@ -0,0 +1,20 @@
+# Generated by Django 6.0.2 on 2026-10-18 22:05
+
+from django.db import migrations
+
+
+def corrigir_dias_uteis(apps, schema_editor):
+    # O job_queue do PTB conta 0 = domingo: '0,1,2,3,4' rodava de domingo a quinta
+    Tarefa = apps.get_model('bot', 'Tarefa')
+    Tarefa.objects.filter(dias_semana='0,1,2,3,4').update(dias_semana='1,2,3,4,5')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0012_versao'),
+    ]
+
+    operations = [
+        migrations.RunPython(corrigir_dias_uteis, migrations.RunPython.noop),
+    ]
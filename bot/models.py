@@ -1,4 +1,8 @@
+import math
+from decimal import Decimal
+
 from django.db import models
+from django.utils import timezone
 
 
 class FundoImobiliario(models.Model):
@@ -16,12 +20,26 @@ class FundoImobiliario(models.Model):
 
     atualizado_em = models.DateTimeField(auto_now=True)
 
+    # Proventos dos últimos 12 meses, mantidos incrementalmente por bot.proventos
+    dividendos_12m = models.DecimalField(max_digits=12, decimal_places=4, default=0)
+    dividendos_12m_eventos = models.PositiveIntegerField(default=0)
+    media_mensal_dividendos = models.DecimalField(max_digits=12, decimal_places=4, default=0)
+    # Início da janela já aplicado à soma; eventos anteriores a esta data já saíram dela
+    janela_dividendos = models.DateField(null=True, blank=True)
+
     @property
     def dividend_yield(self):
         if self.preco_atual > 0:
             return (float(self.ultimo_dividendo) / float(self.preco_atual)) * 100
         return 0
 
+    @property
+    def dy_12m(self):
+        # Média por pagamento dos últimos 12 meses, anualizada (FIIs pagam todo mês)
+        if self.preco_atual > 0 and self.media_mensal_dividendos > 0:
+            return float(self.media_mensal_dividendos) * 12 / float(self.preco_atual) * 100
+        return 0
+
     @property
     def falta_quanto(self):
         if self.preco_atual > self.preco_teto:
@@ -44,9 +62,9 @@ class FundoImobiliario(models.Model):
     @property
     def magic_number(self):
         if self.ultimo_dividendo > 0 and self.preco_atual > 0:
-            # Quantas cotas para o dividendo comprar uma nova cota
-            import math
-            return math.ceil(float(self.preco_atual) / float(self.ultimo_dividendo))
+            # Quantas cotas para o dividendo comprar uma nova cota. Em Decimal: em float,
+            # 9.80 / 0.07 dá 140.00000000000003 e o ceil viraria 141
+            return math.ceil(Decimal(str(self.preco_atual)) / Decimal(str(self.ultimo_dividendo)))
         return 0
 
     @property
@@ -63,4 +81,174 @@ class FundoImobiliario(models.Model):
         if target > 0:
             percent = (self.quantidade / target) * 100
             return min(percent, 100)
-        return 0
\ No newline at end of file
+        return 0
+
+class CotacaoHistorica(models.Model):
+    # Resolução em segundos; 0 = tick bruto gravado a cada polling
+    TICK = 0
+    CINCO_MINUTOS = 300
+    HORA = 3600
+    DIA = 86400
+    RESOLUCOES = [
+        (TICK, 'Tick'),
+        (CINCO_MINUTOS, '5 minutos'),
+        (HORA, '1 hora'),
+        (DIA, '1 dia'),
+    ]
+
+    fundo = models.ForeignKey(FundoImobiliario, on_delete=models.CASCADE, related_name='historico')
+    resolucao = models.PositiveIntegerField(choices=RESOLUCOES, default=TICK)
+    instante = models.DateTimeField()
+    abertura = models.FloatField()
+    maxima = models.FloatField()
+    minima = models.FloatField()
+    fechamento = models.FloatField()
+    amostras = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            # Também serve de índice para as consultas por (fundo, período)
+            models.UniqueConstraint(fields=['fundo', 'resolucao', 'instante'], name='historico_unico'),
+        ]
+
+
+class Dividendo(models.Model):
+    # Provento por cota, um por fundo e data (data com)
+    MANUAL = 'manual'
+    PROVEDOR = 'provedor'
+    FONTES = [
+        (MANUAL, 'Manual (/div)'),
+        (PROVEDOR, 'Provedor de cotações'),
+    ]
+
+    fundo = models.ForeignKey(FundoImobiliario, on_delete=models.CASCADE, related_name='dividendos')
+    data = models.DateField()
+    valor = models.DecimalField(max_digits=10, decimal_places=4)
+    fonte = models.CharField(max_length=10, choices=FONTES, default=MANUAL)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fundo', 'data'], name='dividendo_unico'),
+        ]
+
+
+class Operacao(models.Model):
+    # Livro de operações: só recebe inserções; a posição é derivada dele
+    COMPRA = 'C'
+    VENDA = 'V'
+    AMORTIZACAO = 'A'
+    TIPOS = [
+        (COMPRA, 'Compra'),
+        (VENDA, 'Venda'),
+        (AMORTIZACAO, 'Amortização'),
+    ]
+
+    fundo = models.ForeignKey(FundoImobiliario, on_delete=models.CASCADE, related_name='operacoes')
+    tipo = models.CharField(max_length=1, choices=TIPOS)
+    quantidade = models.IntegerField()
+    # Preço por cota (na amortização, o valor devolvido por cota)
+    preco = models.DecimalField(max_digits=10, decimal_places=2)
+    data = models.DateTimeField(default=timezone.now)
+    # Chave do negócio nas notas importadas (bot.importacao); reimportar o mesmo extrato não duplica
+    chave = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['fundo', 'data'])]
+
+
+class Posicao(models.Model):
+    # Posição materializada, atualizada a cada nova operação
+    fundo = models.OneToOneField(FundoImobiliario, on_delete=models.CASCADE, related_name='posicao')
+    quantidade = models.IntegerField(default=0)
+    custo_total = models.DecimalField(max_digits=16, decimal_places=6, default=0)
+    lucro_realizado = models.DecimalField(max_digits=16, decimal_places=6, default=0)
+    amortizado = models.DecimalField(max_digits=16, decimal_places=6, default=0)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    @property
+    def preco_medio(self):
+        if self.quantidade > 0:
+            return self.custo_total / self.quantidade
+        return Decimal(0)
+
+
+class Assinatura(models.Model):
+    # Chat que recebe os alertas do vigia global
+    chat_id = models.BigIntegerField(unique=True)
+    ativa = models.BooleanField(default=True)
+    criada_em = models.DateTimeField(auto_now_add=True)
+
+
+class RegraAlerta(models.Model):
+    PRECO_ABAIXO = 'preco_abaixo'
+    PRECO_ACIMA = 'preco_acima'
+    VARIACAO = 'variacao'
+    PVP_ABAIXO = 'pvp_abaixo'
+    DY_ACIMA = 'dy_acima'
+    TIPOS = [
+        (PRECO_ABAIXO, 'Preço abaixo de'),
+        (PRECO_ACIMA, 'Preço acima de'),
+        (VARIACAO, 'Variação (%) maior que'),
+        (PVP_ABAIXO, 'P/VP abaixo de'),
+        (DY_ACIMA, 'DY (%) acima de'),
+    ]
+
+    assinatura = models.ForeignKey(Assinatura, on_delete=models.CASCADE, related_name='regras')
+    ticker = models.CharField(max_length=10, db_index=True)
+    tipo = models.CharField(max_length=20, choices=TIPOS, default=PRECO_ABAIXO)
+    limite = models.FloatField()
+    # Depois de disparar, só rearma quando o indicador se afasta do limite esse % (histerese)
+    histerese = models.FloatField(default=1.0)
+    # Enquanto desarmada, avisa de novo se o indicador andar mais esse % (0 = não avisa)
+    reaviso = models.FloatField(default=1.0)
+    # Intervalo mínimo entre dois avisos da mesma regra
+    cooldown = models.PositiveIntegerField(default=0, help_text='segundos')
+
+    # Estado persistido: sobrevive a reinícios do bot
+    armada = models.BooleanField(default=True)
+    ultimo_valor = models.FloatField(null=True, blank=True)
+    ultimo_disparo = models.DateTimeField(null=True, blank=True)
+
+
+class FeriadoB3(models.Model):
+    # Dias sem pregão na B3 (além dos fins de semana)
+    data = models.DateField(unique=True)
+    descricao = models.CharField(max_length=60, blank=True)
+
+
+class Concessao(models.Model):
+    # Lease de um recurso compartilhado entre processos do bot (fatia de tickers, polling, job diário).
+    # Quem não renova até `expira_em` perde o recurso, que outro processo assume.
+    recurso = models.CharField(max_length=80, unique=True)
+    dono = models.CharField(max_length=80, blank=True, default='')
+    expira_em = models.DateTimeField(db_index=True)
+    renovada_em = models.DateTimeField(null=True, blank=True)
+
+
+class Tarefa(models.Model):
+    # Job do job_queue guardado no banco; no boot todos são reagendados com atrasos espalhados (bot.tarefas)
+    REPETIDA = 'repetida'
+    DIARIA = 'diaria'
+    TIPOS = [
+        (REPETIDA, 'A cada intervalo'),
+        (DIARIA, 'Diária'),
+    ]
+
+    nome = models.CharField(max_length=80, unique=True)
+    funcao = models.CharField(max_length=40)
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    intervalo = models.FloatField(null=True, blank=True, help_text='segundos (tarefas repetidas)')
+    horario = models.TimeField(null=True, blank=True, help_text='horário de Brasília (tarefas diárias)')
+    dias_semana = models.CharField(max_length=13, default='0,1,2,3,4,5,6', help_text='0 = domingo, como no job_queue do PTB')
+    # Tarefas de um chat só rodam enquanto a assinatura estiver ativa
+    assinatura = models.ForeignKey(Assinatura, on_delete=models.CASCADE, null=True, blank=True,
+                                   related_name='tarefas')
+    ativa = models.BooleanField(default=True)
+
+
+class Versao(models.Model):
+    # Contador que muda a cada alteração de um conjunto de dados, visto por todos os processos
+    # (ex.: regras e assinaturas, que cada processo do bot guarda num índice em memória)
+    nome = models.CharField(max_length=40, unique=True)
+    valor = models.PositiveBigIntegerField(default=0)
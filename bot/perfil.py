@@ -0,0 +1,199 @@
+import cProfile
+import functools
+import io
+import itertools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CPROFILE = 'cprofile'
+AMOSTRAGEM = 'amostragem'
+MODOS = (CPROFILE, AMOSTRAGEM)
+# Chamadas perfiladas acima disto (segundos) têm o resumo da pilha registrado no log
+LIMITE_LENTO = 2.0
+INTERVALO_AMOSTRA = 0.005
+LINHAS_RESUMO = 15
+# Folhas de pilha de threads paradas esperando trabalho; não dizem nada sobre lentidão
+OCIOSOS = {('threading', 'wait'), ('selectors', 'select'), ('queue', 'get'), ('thread', '_worker')}
+
+
+class _Deterministico:
+    """cProfile: exato, mas só enxerga a thread do event loop."""
+
+    extensao = 'prof'
+
+    def __init__(self):
+        self.perfil = cProfile.Profile()
+
+    def iniciar(self):
+        self.perfil.enable()
+
+    def parar(self):
+        self.perfil.disable()
+
+    def gravar(self, caminho):
+        self.perfil.dump_stats(caminho)
+
+    def resumo(self):
+        saida = io.StringIO()
+        pstats.Stats(self.perfil, stream=saida).sort_stats('cumulative').print_stats(LINHAS_RESUMO)
+        return saida.getvalue()
+
+
+def _quadro(frame):
+    return f"{Path(frame.f_code.co_filename).stem}:{frame.f_code.co_name}"
+
+
+class _Amostrador:
+    """Amostra as pilhas de todas as threads (event loop, escritor e leitores do banco).
+
+    Grava no formato "folded" (uma pilha por linha com a contagem), que o
+    flamegraph.pl e o speedscope abrem direto.
+    """
+
+    extensao = 'folded'
+
+    def __init__(self, intervalo=INTERVALO_AMOSTRA):
+        self.intervalo = intervalo
+        self.pilhas = Counter()
+        self.amostras = 0
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._rodar, name='amostrador-perfil', daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._thread.join()
+
+    def _rodar(self):
+        nomes = {}
+        proprio = threading.get_ident()
+        while not self._parar.wait(self.intervalo):
+            self.amostras += 1
+            if len(nomes) != threading.active_count():
+                nomes = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == proprio:
+                    continue
+                codigo = frame.f_code
+                if (Path(codigo.co_filename).stem, codigo.co_name) in OCIOSOS:
+                    continue
+                pilha = []
+                while frame is not None:
+                    pilha.append(_quadro(frame))
+                    frame = frame.f_back
+                pilha.append(nomes.get(ident, str(ident)))
+                self.pilhas[';'.join(reversed(pilha))] += 1
+
+    def gravar(self, caminho):
+        with open(caminho, 'w') as arquivo:
+            for pilha, contagem in self.pilhas.most_common():
+                arquivo.write(f"{pilha} {contagem}\n")
+
+    def resumo(self):
+        if not self.amostras:
+            return "(nenhuma amostra)"
+        linhas = [f"{self.amostras} amostras a cada {self.intervalo * 1000:g} ms"]
+        for pilha, contagem in self.pilhas.most_common(LINHAS_RESUMO):
+            quadros = pilha.split(';')
+            # A thread e as últimas chamadas costumam bastar para achar o gargalo
+            trecho = ' > '.join([quadros[0], '...'] + quadros[-5:] if len(quadros) > 6 else quadros)
+            linhas.append(f"{contagem / self.amostras:6.1%}  {trecho}")
+        return '\n'.join(linhas)
+
+
+class Perfilador:
+    """Perfila handlers e jobs sob demanda, sem reiniciar o bot.
+
+    `envolver` é aplicado a todos os handlers na inicialização; enquanto o
+    perfilador estiver desligado o custo é só cronometrar a chamada. Ligado,
+    cada chamada dos alvos vira um arquivo em `pasta`. Só uma chamada é
+    perfilada por vez; as concorrentes passam direto.
+    """
+
+    def __init__(self, pasta, modo=CPROFILE, alvos=None, limite_lento=LIMITE_LENTO,
+                 intervalo_amostra=INTERVALO_AMOSTRA):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de perfil desconhecido: {modo}")
+        self.pasta = Path(pasta)
+        self.modo = modo
+        self.alvos = set(alvos or ())
+        self.limite_lento = limite_lento
+        self.intervalo_amostra = intervalo_amostra
+        self.ativo = False
+        self.gravados = 0
+        self._ocupado = threading.Lock()
+        self._sequencia = itertools.count(1)
+
+    def ligar(self, modo=None):
+        if modo is not None:
+            if modo not in MODOS:
+                raise ValueError(f"Modo de perfil desconhecido: {modo}")
+            self.modo = modo
+        os.makedirs(self.pasta, exist_ok=True)
+        self.ativo = True
+
+    def desligar(self):
+        self.ativo = False
+
+    def _deve_perfilar(self, nome):
+        return self.ativo and (not self.alvos or nome in self.alvos)
+
+    def envolver(self, func, nome=None):
+        nome = nome or func.__name__
+
+        @functools.wraps(func)
+        async def envolvido(*args, **kwargs):
+            if not self._deve_perfilar(nome) or not self._ocupado.acquire(blocking=False):
+                inicio = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    duracao = time.perf_counter() - inicio
+                    if duracao >= self.limite_lento:
+                        logger.warning("%s levou %.2fs (perfil desligado; use /perfil on para detalhar)",
+                                       nome, duracao)
+
+            try:
+                if self.modo == CPROFILE:
+                    coletor = _Deterministico()
+                else:
+                    coletor = _Amostrador(self.intervalo_amostra)
+                inicio = time.perf_counter()
+                coletor.iniciar()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    coletor.parar()
+                    self._concluir(nome, coletor, time.perf_counter() - inicio)
+            finally:
+                self._ocupado.release()
+
+        return envolvido
+
+    def _concluir(self, nome, coletor, duracao):
+        caminho = self.pasta / (f"{nome}-{datetime.now():%Y%m%d-%H%M%S}-{next(self._sequencia)}"
+                                f".{coletor.extensao}")
+        try:
+            coletor.gravar(caminho)
+            self.gravados += 1
+        except OSError:
+            logger.exception("Não foi possível gravar o perfil em %s", caminho)
+        if duracao >= self.limite_lento:
+            logger.warning("%s levou %.2fs (perfil em %s)\n%s", nome, duracao, caminho, coletor.resumo())
+
+    def situacao(self):
+        alvos = ', '.join(sorted(self.alvos)) or 'todos'
+        estado = 'ligado' if self.ativo else 'desligado'
+        return (f"Perfil {estado} ({self.modo}), alvos: {alvos}, limite lento: {self.limite_lento:g}s, "
+                f"{self.gravados} arquivo(s) em {self.pasta}")
@@ -0,0 +1,93 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from bot.cotacoes import cache_cotacoes
+from bot.historico import registrar_ticks
+from bot.models import CotacaoHistorica, FundoImobiliario
+
+CENTAVOS = Decimal('0.01')
+
+
+def _decimal(valor):
+    return Decimal(str(valor)).quantize(CENTAVOS)
+
+
+def salvar_cotacoes(cotacoes, alvos=None):
+    """Grava as cotações de um ciclo de polling numa única transação.
+
+    Cria em lote os fundos que ainda não existem e atualiza, também em lote,
+    apenas os campos que mudaram nas linhas cujo preço (ou preço teto) mudou.
+    Cada cotação também vira um tick no histórico de preços.
+    Devolve {TICKER: variação %} em relação ao preço gravado anteriormente.
+    """
+    cotacoes = {t.upper(): float(p) for t, p in cotacoes.items() if p}
+    alvos = {t.upper(): v for t, v in (alvos or {}).items()}
+    if not cotacoes:
+        return {}
+
+    agora = timezone.now()
+    variacoes = {}
+    por_campos = defaultdict(list)
+
+    with transaction.atomic():
+        fundos = FundoImobiliario.objects.in_bulk(list(cotacoes), field_name='ticker')
+        novos = [t for t in cotacoes if t not in fundos]
+        if novos:
+            FundoImobiliario.objects.bulk_create(
+                [FundoImobiliario(ticker=t) for t in novos], ignore_conflicts=True)
+            fundos.update(FundoImobiliario.objects.in_bulk(novos, field_name='ticker'))
+
+        for ticker, preco in cotacoes.items():
+            fundo = fundos[ticker]
+            campos = []
+
+            preco_novo = _decimal(preco)
+            if preco_novo != fundo.preco_atual:
+                preco_anterior = float(fundo.preco_atual) if fundo.preco_atual > 0 else preco
+                fundo.variacao = ((preco / preco_anterior) - 1) * 100
+                fundo.preco_atual = preco_novo
+                campos += ['preco_atual', 'variacao']
+                variacoes[ticker] = fundo.variacao
+            else:
+                variacoes[ticker] = 0.0
+
+            if ticker in alvos:
+                teto = _decimal(alvos[ticker])
+                if teto != fundo.preco_teto:
+                    fundo.preco_teto = teto
+                    campos.append('preco_teto')
+
+            if campos:
+                # bulk_update não aplica auto_now, então o carimbo é manual
+                fundo.atualizado_em = agora
+                campos.append('atualizado_em')
+                por_campos[tuple(campos)].append(fundo)
+
+        for campos, lote in por_campos.items():
+            FundoImobiliario.objects.bulk_update(lote, campos)
+
+        registrar_ticks([(fundos[t], p) for t, p in cotacoes.items()], agora)
+
+    return variacoes
+
+
+def aquecer_cotacoes(agora=None):
+    """Recarrega no cache as cotações gravadas há menos que o TTL (ex.: após um reinício rápido).
+
+    Cada ciclo do vigia grava um tick por ativo, então o último tick dentro
+    da janela é o preço mais recente conhecido, com a idade certa para expirar
+    no mesmo momento em que expiraria se o processo não tivesse reiniciado.
+    """
+    agora = agora or timezone.now()
+    ticks = (CotacaoHistorica.objects
+             .filter(resolucao=CotacaoHistorica.TICK, instante__gt=agora - timedelta(seconds=cache_cotacoes.ttl))
+             .order_by('instante')
+             .values_list('fundo__ticker', 'fechamento', 'instante'))
+    ultimos = {ticker: (preco, instante) for ticker, preco, instante in ticks}
+    for ticker, (preco, instante) in ultimos.items():
+        cache_cotacoes.definir(ticker, preco, idade=(agora - instante).total_seconds())
+    return len(ultimos)
@@ -0,0 +1,226 @@
+"""Projeção patrimonial "Bola de Neve" por Monte Carlo.
+
+Cada caminho sorteia meses inteiros da história do acervo (retorno do preço e
+rendimento em proventos de todos os fundos no mesmo mês, o que preserva a
+correlação entre eles) e, mês a mês, reinveste os proventos de cada fundo em
+cotas inteiras do próprio fundo, como na estratégia do Magic Number. As contas
+são NumPy sobre todos os caminhos de uma vez; os caminhos são divididos em
+lotes que rodam num pool de processos.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.conf import settings
+
+from bot import acervo
+
+# Valores padrão; podem ser sobrescritos por FII_PROJECAO no settings.py
+PADRAO = {
+    'caminhos': 10000,
+    'anos': 20,
+    # O painel do dashboard usa menos caminhos: a curva mediana já fica estável
+    'caminhos_painel': 2000,
+    'processos': min(4, os.cpu_count() or 1),
+    # Teto de caminhos × fundos por lote, para a memória de cada processo ficar limitada
+    'elementos_por_lote': 250_000,
+    'percentis': (10, 50, 90),
+    # Com menos meses que isto no acervo, a história vem do modelo lognormal abaixo
+    'minimo_meses': 24,
+    'retorno_mensal': 0.004,
+    'volatilidade_mensal': 0.045,
+}
+MESES_MODELO = 600
+
+_pool = None
+_processos_pool = 0
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'FII_PROJECAO', {})}
+
+
+def _mensal(serie):
+    """(meses, retorno do preço no mês, proventos do mês / fechamento do mês) de uma Série do acervo."""
+    if len(serie) < 2:
+        return np.array([], dtype='datetime64[M]'), np.array([]), np.array([])
+    meses = serie.data.astype('datetime64[M]')
+    # Último pregão de cada mês
+    ultimos = np.flatnonzero(np.append(meses[1:] != meses[:-1], True))
+    fechamentos = np.asarray(serie.fechamento)[ultimos]
+    meses = meses[ultimos]
+
+    meses_div = serie.div_data.astype('datetime64[M]')
+    posicao = np.minimum(np.searchsorted(meses, meses_div), len(meses) - 1)
+    # Provento num mês sem pregão no acervo fica de fora
+    validos = meses[posicao] == meses_div
+    proventos = np.bincount(posicao[validos], weights=np.asarray(serie.div_valor)[validos], minlength=len(meses))
+    return meses[1:], fechamentos[1:] / fechamentos[:-1] - 1, proventos[1:] / fechamentos[1:]
+
+
+def historico_mensal(tickers, rendimento_atual, pasta=None):
+    """Matrizes (meses × fundos) de retorno e rendimento mensais, alinhadas pelo calendário.
+
+    Mês sem história de um fundo: o retorno segue a média dos outros fundos
+    naquele mês e o rendimento é o atual do fundo (média de 12 meses / preço).
+    """
+    series = {}
+    for ticker in tickers:
+        try:
+            series[ticker] = _mensal(acervo.abrir(ticker, pasta))
+        except FileNotFoundError:
+            continue
+    if not series:
+        return np.empty((0, len(tickers))), np.empty((0, len(tickers)))
+
+    grade = np.unique(np.concatenate([meses for meses, _, _ in series.values()]))
+    retornos = np.full((len(grade), len(tickers)), np.nan)
+    rendimentos = np.tile(rendimento_atual, (len(grade), 1))
+    for j, ticker in enumerate(tickers):
+        if ticker in series:
+            meses, retorno, rendimento = series[ticker]
+            linhas = np.searchsorted(grade, meses)
+            retornos[linhas, j] = retorno
+            rendimentos[linhas, j] = rendimento
+
+    media = np.nanmean(retornos, axis=1, keepdims=True)
+    retornos = np.where(np.isnan(retornos), media, retornos)
+    return retornos, rendimentos
+
+
+def historico_modelo(n_fundos, rendimento_atual, config, semente=0):
+    """História sintética lognormal, para quando o acervo ainda não tem meses suficientes."""
+    rng = np.random.default_rng(semente)
+    mu, sigma = config['retorno_mensal'], config['volatilidade_mensal']
+    retornos = np.expm1(rng.normal(np.log1p(mu) - sigma ** 2 / 2, sigma, (MESES_MODELO, n_fundos)))
+    return retornos, np.tile(rendimento_atual, (MESES_MODELO, 1))
+
+
+def carregar_carteira(pasta=None, config=None):
+    """Fundos em carteira e a história mensal que alimenta a simulação (lê o banco e o acervo)."""
+    # Import local: os processos do pool importam este módulo sem as apps do Django carregadas
+    from bot.indicadores import TabelaIndicadores
+    from bot.models import FundoImobiliario
+
+    config = config or configuracao()
+    tabela = TabelaIndicadores(FundoImobiliario.objects.filter(quantidade__gt=0, preco_atual__gt=0))
+    precos = tabela.preco_atual
+    renda = tabela.renda_mensal
+    rendimento_atual = np.divide(renda, precos * tabela.quantidade, out=np.zeros_like(precos),
+                                 where=tabela.quantidade > 0)
+
+    retornos, rendimentos = historico_mensal(tabela.ticker, rendimento_atual, pasta)
+    fonte = 'acervo'
+    if len(retornos) < config['minimo_meses']:
+        retornos, rendimentos = historico_modelo(len(tabela), rendimento_atual, config)
+        fonte = 'modelo'
+    return {
+        'tickers': tabela.ticker,
+        'cotas': tabela.quantidade.astype(np.float64),
+        'precos': precos,
+        'renda_mensal': float(renda.sum()),
+        'retornos': retornos,
+        'rendimentos': rendimentos,
+        'fonte': fonte,
+        'meses_historico': len(retornos) if fonte == 'acervo' else 0,
+    }
+
+
+def _simular_lote(semente, caminhos, meses, cotas, precos, retornos, rendimentos, aporte, renda_inicial):
+    """Um lote de caminhos. Devolve patrimônio e renda mensal média de cada ano (caminhos × anos + 1)."""
+    rng = np.random.default_rng(semente)
+    n_fundos = len(precos)
+    anos = meses // 12
+
+    cotas = np.tile(cotas, (caminhos, 1))
+    precos = np.tile(precos, (caminhos, 1))
+    caixa = np.zeros_like(precos)
+    # O aporte mensal é dividido pelo peso atual de cada fundo na carteira
+    valor = cotas[0] * precos[0]
+    pesos = valor / valor.sum() if valor.sum() > 0 else np.full(n_fundos, 1 / max(n_fundos, 1))
+    aporte_fundos = aporte * pesos
+
+    patrimonio = np.empty((caminhos, anos + 1))
+    renda = np.empty((caminhos, anos + 1))
+    patrimonio[:, 0] = valor.sum()
+    renda[:, 0] = renda_inicial
+    # Um único sorteio por mês traz o fator de preço e o rendimento de todos os fundos
+    tabela = np.hstack([1 + retornos, rendimentos])
+    proventos_ano = np.zeros_like(precos)
+    proventos = np.empty_like(precos)
+    novas = np.empty_like(precos)
+
+    for mes in range(1, meses + 1):
+        sorteado = tabela[rng.integers(0, len(tabela), caminhos)]
+        precos *= sorteado[:, :n_fundos]
+        np.multiply(cotas, precos, out=proventos)
+        proventos *= sorteado[:, n_fundos:]
+        proventos_ano += proventos
+
+        # Bola de neve: o provento (e o aporte) de cada fundo compra cotas inteiras dele mesmo.
+        # divide + floor em vez de floor_divide, que é várias vezes mais lento
+        caixa += proventos
+        caixa += aporte_fundos
+        np.divide(caixa, precos, out=novas)
+        np.floor(novas, out=novas)
+        cotas += novas
+        novas *= precos
+        caixa -= novas
+
+        if mes % 12 == 0:
+            ano = mes // 12
+            patrimonio[:, ano] = np.einsum('ij,ij->i', cotas, precos) + caixa.sum(axis=1)
+            renda[:, ano] = proventos_ano.sum(axis=1) / 12
+            proventos_ano[:] = 0
+    return patrimonio, renda
+
+
+def _executor(processos):
+    global _pool, _processos_pool
+    # Reaproveitado entre chamadas: subir os processos custa mais que a simulação
+    if _pool is None or _processos_pool != processos:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        # forkserver, não fork: o bot tem threads (escritor do banco, to_thread) e um fork com elas
+        # rodando pode herdar um lock preso. Os processos partem de um servidor limpo
+        _pool = ProcessPoolExecutor(max_workers=processos, mp_context=multiprocessing.get_context('forkserver'))
+        _processos_pool = processos
+    return _pool
+
+
+def simular(carteira, anos=None, caminhos=None, aporte=0.0, semente=None, processos=None, config=None):
+    """Roda a projeção e devolve os percentis de patrimônio e renda mensal ano a ano."""
+    config = config or configuracao()
+    anos = anos or config['anos']
+    caminhos = caminhos or config['caminhos']
+    processos = processos or config['processos']
+    inicio = time.perf_counter()
+
+    n_fundos = max(len(carteira['precos']), 1)
+    por_lote = max(1, min(caminhos, config['elementos_por_lote'] // n_fundos))
+    tamanhos = [min(por_lote, caminhos - i) for i in range(0, caminhos, por_lote)]
+    sementes = np.random.SeedSequence(semente).spawn(len(tamanhos))
+    argumentos = (anos * 12, carteira['cotas'], carteira['precos'], carteira['retornos'],
+                  carteira['rendimentos'], float(aporte), carteira['renda_mensal'])
+
+    if processos > 1 and len(tamanhos) > 1:
+        pool = _executor(processos)
+        lotes = list(pool.map(_simular_lote, sementes, tamanhos, *([a] * len(tamanhos) for a in argumentos)))
+    else:
+        lotes = [_simular_lote(s, t, *argumentos) for s, t in zip(sementes, tamanhos)]
+
+    patrimonio = np.concatenate([p for p, _ in lotes])
+    renda = np.concatenate([r for _, r in lotes])
+    percentis = config['percentis']
+    return {
+        'anos': list(range(anos + 1)),
+        'caminhos': caminhos,
+        'aporte': float(aporte),
+        'fonte': carteira['fonte'],
+        'meses_historico': carteira['meses_historico'],
+        'patrimonio': {p: v.tolist() for p, v in zip(percentis, np.percentile(patrimonio, percentis, axis=0))},
+        'renda': {p: v.tolist() for p, v in zip(percentis, np.percentile(renda, percentis, axis=0))},
+        'segundos': time.perf_counter() - inicio,
+    }
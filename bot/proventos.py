@@ -0,0 +1,179 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+
+from bot.models import Dividendo, FundoImobiliario
+
+JANELA = timedelta(days=365)
+QUATRO_CASAS = Decimal('0.0001')
+# atualizado_em vai junto: bulk_update não aplica auto_now e o cache do dashboard depende dele
+CAMPOS_JANELA = ['dividendos_12m', 'dividendos_12m_eventos', 'media_mensal_dividendos', 'janela_dividendos',
+                 'atualizado_em']
+
+
+def _decimal(valor):
+    return Decimal(str(valor)).quantize(QUATRO_CASAS)
+
+
+def _atualizar_media(fundo):
+    fundo.atualizado_em = timezone.now()
+    if fundo.dividendos_12m_eventos > 0:
+        fundo.media_mensal_dividendos = (fundo.dividendos_12m / fundo.dividendos_12m_eventos).quantize(QUATRO_CASAS)
+    else:
+        fundo.dividendos_12m = fundo.media_mensal_dividendos = Decimal(0)
+
+
+def _expirar(fundos, hoje):
+    """Tira da soma de 12 meses os eventos que saíram da janela desde a última vez.
+
+    Só os eventos entre o início antigo e o novo da janela são lidos: o custo
+    é proporcional ao que expirou, não ao histórico inteiro.
+    """
+    inicio = hoje - JANELA
+    atrasados = [f for f in fundos if f.janela_dividendos is None or f.janela_dividendos < inicio]
+    if not atrasados:
+        return []
+
+    saidas = {
+        linha['fundo_id']: linha
+        for linha in Dividendo.objects
+        .filter(fundo__in=atrasados, data__gte=F('fundo__janela_dividendos'), data__lt=inicio)
+        .values('fundo_id').annotate(soma=Sum('valor'), eventos=Count('id'))
+    }
+    for fundo in atrasados:
+        saida = saidas.get(fundo.id)
+        if saida:
+            fundo.dividendos_12m -= saida['soma']
+            fundo.dividendos_12m_eventos -= saida['eventos']
+        fundo.janela_dividendos = inicio
+        _atualizar_media(fundo)
+    return atrasados
+
+
+def expirar_janelas(hoje=None):
+    """Rodado uma vez por dia: avança a janela de 12 meses de todos os fundos."""
+    hoje = hoje or date.today()
+    with transaction.atomic():
+        fundos = list(FundoImobiliario.objects.filter(janela_dividendos__lt=hoje - JANELA)
+                      .only('id', *CAMPOS_JANELA))
+        alterados = _expirar(fundos, hoje)
+        FundoImobiliario.objects.bulk_update(alterados, CAMPOS_JANELA)
+    return len(alterados)
+
+
+def _substituir_manuais(fundos, por_ticker, inicio):
+    # FIIs pagam uma vez por mês: o /div do mês e o evento do provedor são o mesmo provento
+    meses = {(fundos[t].id, data.year, data.month): data
+             for t, datas in por_ticker.items() if t in fundos for data in datas}
+    primeira = min(data for datas in por_ticker.values() for data in datas)
+    por_id = {f.id: f for f in fundos.values()}
+    repetidos = [
+        d for d in Dividendo.objects.filter(fundo_id__in=list(por_id), fonte=Dividendo.MANUAL,
+                                            data__gte=primeira.replace(day=1))
+        if meses.get((d.fundo_id, d.data.year, d.data.month), d.data) != d.data
+    ]
+    for dividendo in repetidos:
+        if dividendo.data >= inicio:
+            fundo = por_id[dividendo.fundo_id]
+            fundo.dividendos_12m -= dividendo.valor
+            fundo.dividendos_12m_eventos -= 1
+    Dividendo.objects.filter(pk__in=[d.pk for d in repetidos]).delete()
+
+
+def registrar_dividendo(ticker, valor, data=None):
+    """Provento informado à mão (/div). Levanta FundoImobiliario.DoesNotExist para ticker desconhecido."""
+    ticker = ticker.upper()
+    if not FundoImobiliario.objects.filter(ticker=ticker).exists():
+        raise FundoImobiliario.DoesNotExist(ticker)
+    registrar_eventos([(ticker, data or date.today(), valor)], fonte=Dividendo.MANUAL)
+
+
+def registrar_eventos(eventos, fonte=Dividendo.PROVEDOR, hoje=None):
+    """Grava proventos [(ticker, data, valor por cota)] e ajusta as somas de 12 meses pela diferença.
+
+    Um evento já gravado (mesmo fundo e data) com outro valor é corrigido;
+    repetido com o mesmo valor, é ignorado. Tickers não cadastrados são
+    ignorados. Um evento do provedor substitui o lançado à mão (/div) no mesmo
+    mês, que costuma ter outra data. Devolve quantos eventos novos entraram.
+    """
+    hoje = hoje or date.today()
+    inicio = hoje - JANELA
+    por_ticker = defaultdict(dict)
+    for ticker, data, valor in eventos:
+        por_ticker[ticker.upper()][data] = _decimal(valor)
+    if not por_ticker:
+        return 0
+
+    with transaction.atomic():
+        fundos = FundoImobiliario.objects.in_bulk(list(por_ticker), field_name='ticker')
+        if not fundos:
+            return 0
+        ids = [f.id for f in fundos.values()]
+        _expirar(list(fundos.values()), hoje)
+        if fonte == Dividendo.PROVEDOR:
+            _substituir_manuais(fundos, por_ticker, inicio)
+
+        existentes = {
+            (d.fundo_id, d.data): d
+            for d in Dividendo.objects.filter(fundo_id__in=ids,
+                                              data__in={data for datas in por_ticker.values() for data in datas})
+        }
+        ultimas = dict(Dividendo.objects.filter(fundo_id__in=ids).values('fundo_id')
+                       .annotate(ultima=Max('data')).values_list('fundo_id', 'ultima'))
+
+        novos, corrigidos = [], []
+        for ticker, datas in por_ticker.items():
+            fundo = fundos.get(ticker)
+            if fundo is None:
+                continue
+            for data, valor in sorted(datas.items()):
+                atual = existentes.get((fundo.id, data))
+                if atual is None:
+                    novos.append(Dividendo(fundo=fundo, data=data, valor=valor, fonte=fonte))
+                    delta, eventos = valor, 1
+                elif atual.valor != valor:
+                    delta, eventos = valor - atual.valor, 0
+                    atual.valor, atual.fonte = valor, fonte
+                    corrigidos.append(atual)
+                else:
+                    continue
+
+                if data >= inicio:
+                    fundo.dividendos_12m += delta
+                    fundo.dividendos_12m_eventos += eventos
+                # O último provento continua alimentando o Magic Number
+                if ultimas.get(fundo.id) is None or data >= ultimas[fundo.id]:
+                    ultimas[fundo.id] = data
+                    fundo.ultimo_dividendo = valor.quantize(Decimal('0.01'))
+
+        Dividendo.objects.bulk_create(novos)
+        Dividendo.objects.bulk_update(corrigidos, ['valor', 'fonte'])
+        for fundo in fundos.values():
+            _atualizar_media(fundo)
+        FundoImobiliario.objects.bulk_update(list(fundos.values()), CAMPOS_JANELA + ['ultimo_dividendo'])
+
+    return len(novos)
+
+
+def recalcular(hoje=None):
+    """Refaz as somas de 12 meses do zero a partir dos eventos (conferência / reparo)."""
+    hoje = hoje or date.today()
+    inicio = hoje - JANELA
+    with transaction.atomic():
+        somas = {
+            linha['fundo_id']: linha
+            for linha in Dividendo.objects.filter(data__gte=inicio).values('fundo_id')
+            .annotate(soma=Sum('valor'), eventos=Count('id'))
+        }
+        fundos = list(FundoImobiliario.objects.only('id', *CAMPOS_JANELA))
+        for fundo in fundos:
+            linha = somas.get(fundo.id, {'soma': Decimal(0), 'eventos': 0})
+            fundo.dividendos_12m, fundo.dividendos_12m_eventos = linha['soma'], linha['eventos']
+            fundo.janela_dividendos = inicio
+            _atualizar_media(fundo)
+        FundoImobiliario.objects.bulk_update(fundos, CAMPOS_JANELA, batch_size=1000)
+    return len(fundos)
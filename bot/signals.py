@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from bot.alertas import invalidar_indice
+from bot.models import Assinatura, FundoImobiliario, Operacao, RegraAlerta
+
+CHAVE_CONTADOR = 'carteira:contador'
+
+
+@receiver(post_save, sender=FundoImobiliario)
+@receiver(post_delete, sender=FundoImobiliario)
+# Uma operação lançada (ou apagada) pelo admin ainda não mexeu no fundo, mas a carteira mudou
+@receiver(post_save, sender=Operacao)
+@receiver(post_delete, sender=Operacao)
+def invalidar_carteira(**kwargs):
+    # Muda a versão da carteira, o que invalida o dashboard em cache
+    try:
+        cache.incr(CHAVE_CONTADOR)
+    except ValueError:
+        cache.set(CHAVE_CONTADOR, 1, None)
+
+
+def versao_carteira():
+    """Versão atual da carteira e a data da última alteração.
+
+    Combina o contador mexido pelos sinais deste processo com o último
+    `atualizado_em` e o total de fundos no banco, que também enxergam o que o
+    bot (outro processo, gravando com bulk_update) alterou.
+    """
+    estado = FundoImobiliario.objects.aggregate(ultima=Max('atualizado_em'), total=Count('id'))
+    ultima = estado['ultima']
+    contador = cache.get(CHAVE_CONTADOR, 0)
+    marca = ultima.timestamp() if ultima else 0
+    return f"{contador}-{estado['total']}-{marca}", ultima
+
+
+# O índice de alertas em memória é reconstruído quando regras ou assinaturas mudam
+post_save.connect(invalidar_indice, sender=RegraAlerta)
+post_delete.connect(invalidar_indice, sender=RegraAlerta)
+post_save.connect(invalidar_indice, sender=Assinatura)
+post_delete.connect(invalidar_indice, sender=Assinatura)
@@ -0,0 +1,121 @@
+"""Jobs do bot guardados no banco (tabela Tarefa) e reagendados no boot.
+
+O job_queue do PTB vive só na memória. Aqui cada job é uma linha: as
+tarefas globais (vigia, compactação, proventos) são gravadas pelo runbot a
+cada boot, e as de cada chat (relatório de fechamento) nascem no /start.
+`sincronizar` deixa o job_queue igual ao banco e roda no boot e a cada
+renovação das concessões, o que também leva ao processo as tarefas criadas
+por outro processo do bot.
+
+Os atrasos iniciais são espalhados: tarefas com o mesmo intervalo (ou o
+mesmo horário) dividem o intervalo (ou a `janela_diarias`) em faixas
+iguais, e cada uma cai num ponto aleatório da sua faixa. Assim um deploy
+não dispara tudo no mesmo segundo contra o provedor e o SQLite.
+"""
+import datetime
+import random
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import Q
+
+from bot.models import Tarefa
+
+# Valores padrão; podem ser sobrescritos por FII_TAREFAS no settings.py
+PADRAO = {
+    # Segundos após o horário em que as tarefas diárias de mesmo horário são espalhadas
+    'janela_diarias': 300,
+}
+FECHAMENTO = 'fechamento'
+HORARIO_FECHAMENTO = datetime.time(18, 10)
+# Numeração do job_queue do PTB (run_daily): 0 = domingo ... 6 = sábado
+DIAS_UTEIS = '1,2,3,4,5'
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'FII_TAREFAS', {})}
+
+
+def nome_fechamento(chat_id):
+    return f"{FECHAMENTO}:{chat_id}"
+
+
+def garantir_globais(definicoes):
+    """Grava as tarefas globais como o código as define (intervalo e horário seguem o deploy)."""
+    for definicao in definicoes:
+        definicao = dict(definicao)
+        Tarefa.objects.update_or_create(nome=definicao.pop('nome'), defaults={**definicao, 'assinatura': None})
+
+
+def garantir_fechamento(assinatura):
+    """Relatório diário de fechamento do chat; criado uma vez, depois segue a assinatura."""
+    tarefa, _ = Tarefa.objects.get_or_create(
+        nome=nome_fechamento(assinatura.chat_id),
+        defaults={'funcao': FECHAMENTO, 'tipo': Tarefa.DIARIA, 'horario': HORARIO_FECHAMENTO,
+                  'dias_semana': DIAS_UTEIS, 'assinatura': assinatura},
+    )
+    return tarefa
+
+
+def ativas():
+    """Tarefas que devem estar no job_queue: ativas e, se forem de um chat, com a assinatura ativa."""
+    return list(
+        Tarefa.objects.filter(ativa=True)
+        .filter(Q(assinatura__isnull=True) | Q(assinatura__ativa=True))
+        .select_related('assinatura').order_by('nome')
+    )
+
+
+def _definicao(tarefa):
+    # O que, se mudar no banco, obriga a reagendar o job
+    return (tarefa.funcao, tarefa.tipo, tarefa.intervalo, tarefa.horario, tarefa.dias_semana)
+
+
+def espalhar(tarefas, config=None, rng=random):
+    """[(tarefa, atraso em segundos)], com o mesmo intervalo/horário dividido em faixas iguais."""
+    config = config or configuracao()
+    grupos = defaultdict(list)
+    for tarefa in tarefas:
+        grupos[(tarefa.tipo, tarefa.intervalo if tarefa.tipo == Tarefa.REPETIDA else tarefa.horario)].append(tarefa)
+
+    atrasos = []
+    for (tipo, _), grupo in grupos.items():
+        largura = grupo[0].intervalo if tipo == Tarefa.REPETIDA else config['janela_diarias']
+        for posicao, tarefa in enumerate(sorted(grupo, key=lambda t: t.nome)):
+            atrasos.append((tarefa, largura * (posicao + rng.random()) / len(grupo)))
+    return atrasos
+
+
+def _agendar(job_queue, tarefa, callback, atraso, fuso):
+    dados = {'tarefa': _definicao(tarefa)}
+    chat_id = tarefa.assinatura.chat_id if tarefa.assinatura_id else None
+    if tarefa.tipo == Tarefa.REPETIDA:
+        return job_queue.run_repeating(callback, interval=tarefa.intervalo, first=atraso, name=tarefa.nome,
+                                       chat_id=chat_id, data=dados)
+    inicio = datetime.datetime.combine(datetime.date(2000, 1, 1), tarefa.horario)
+    horario = (inicio + datetime.timedelta(seconds=atraso)).time().replace(tzinfo=fuso)
+    dias = tuple(int(dia) for dia in tarefa.dias_semana.split(',') if dia.strip())
+    return job_queue.run_daily(callback, time=horario, days=dias, name=tarefa.nome, chat_id=chat_id, data=dados)
+
+
+def sincronizar(job_queue, tarefas, funcoes, fuso, config=None, rng=random):
+    """Deixa o job_queue igual às `tarefas` do banco. Devolve (agendadas, removidas).
+
+    `funcoes` liga o campo `funcao` ao callback; tarefas de funções
+    desconhecidas (ou com `funcoes` vazio) ficam de fora.
+    """
+    desejadas = {tarefa.nome: tarefa for tarefa in tarefas if tarefa.funcao in funcoes}
+    atuais = {job.name: job for job in job_queue.jobs()
+              if isinstance(job.data, dict) and 'tarefa' in job.data}
+
+    removidas = 0
+    for nome, job in atuais.items():
+        if nome not in desejadas or job.data['tarefa'] != _definicao(desejadas[nome]):
+            job.schedule_removal()
+            removidas += 1
+    novas = [tarefa for nome, tarefa in desejadas.items()
+             if nome not in atuais or atuais[nome].data['tarefa'] != _definicao(tarefa)]
+    for tarefa, atraso in espalhar(novas, config, rng):
+        _agendar(job_queue, tarefa, funcoes[tarefa.funcao], atraso, fuso)
+    return len(novas), removidas
+
@@ -0,0 +1,284 @@
+import functools
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+# Limites (segundos) dos baldes dos histogramas de latência
+BALDES_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# De quanto em quanto tempo o bot grava o retrato das métricas para o site/comando ler
+INTERVALO_RETRATO = 15
+# Retrato sem atualização há mais que isto é de um processo parado: o site deixa de somá-lo
+IDADE_MAXIMA_RETRATO = 4 * INTERVALO_RETRATO
+# ...e o próximo gravar_retrato de qualquer processo apaga o arquivo
+DESCARTE_RETRATO = 24 * 3600
+
+# Nome do handler/job em execução; as operações de banco são contadas por ele
+handler_atual = ContextVar('handler_atual', default='-')
+
+_registro = []
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(nomes, valores, extra=()):
+    pares = list(zip(nomes, valores)) + list(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{n}="{_escapar(v)}"' for n, v in pares) + '}'
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registro.append(self)
+
+    def _chave(self, rotulos):
+        return tuple(str(rotulos.get(n, '')) for n in self.rotulos)
+
+    def exportar(self):
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            linhas += self._linhas(series)
+        return linhas
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._series[chave] = self._series.get(chave, 0) + valor
+
+    def valor(self, **rotulos):
+        return self._series.get(self._chave(rotulos), 0)
+
+    def _linhas(self, series):
+        return [f"{self.nome}{_rotulos(self.rotulos, chave)} {_numero(v)}" for chave, v in series]
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), baldes=BALDES_PADRAO):
+        super().__init__(nome, ajuda, rotulos)
+        self.baldes = tuple(baldes)
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                # [contagem por balde (+Inf no fim), soma, total]
+                serie = self._series[chave] = [[0] * (len(self.baldes) + 1), 0.0, 0]
+            serie[0][bisect_left(self.baldes, valor)] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def cronometrar(self, **rotulos):
+        return _Cronometro(self, rotulos)
+
+    def _linhas(self, series):
+        linhas = []
+        for chave, (contagens, soma, total) in series:
+            acumulado = 0
+            for limite, contagem in zip(self.baldes + (float('inf'),), contagens):
+                acumulado += contagem
+                le = _rotulos(self.rotulos, chave, [('le', _numero(float(limite)))])
+                linhas.append(f"{self.nome}_bucket{le} {acumulado}")
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, chave)} {_numero(soma)}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, chave)} {total}")
+        return linhas
+
+
+class _Cronometro:
+    def __init__(self, histograma, rotulos):
+        self.histograma = histograma
+        self.rotulos = rotulos
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histograma.observar(time.perf_counter() - self.inicio, **self.rotulos)
+        return False
+
+
+# --- Métricas do bot ---
+COTACOES = Contador('fii_cotacoes_total', 'Tickers resolvidos pelo provedor, por caminho (lote, individual, historico, falha)',
+                    ['resultado'])
+COTACOES_SEGUNDOS = Histograma('fii_cotacoes_segundos', 'Latência das chamadas ao provedor de cotações', ['etapa'])
+BANCO_OPERACOES = Contador('fii_banco_operacoes_total', 'Operações de banco por handler/job', ['handler', 'tipo'])
+BANCO_SEGUNDOS = Histograma('fii_banco_segundos', 'Latência das operações de banco, incluindo a espera na fila',
+                            ['tipo'])
+HANDLER_SEGUNDOS = Histograma('fii_handler_segundos', 'Duração dos comandos do Telegram', ['handler'])
+HANDLER_ERROS = Contador('fii_handler_erros_total', 'Exceções não tratadas nos comandos e jobs', ['handler'])
+JOB_SEGUNDOS = Histograma('fii_job_segundos', 'Duração dos jobs agendados', ['job'])
+JOB_ATRASO = Histograma('fii_job_atraso_segundos', 'Atraso entre o horário agendado e o início do job', ['job'],
+                        baldes=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300))
+TELEGRAM_SEGUNDOS = Histograma('fii_telegram_envio_segundos', 'Latência de send_message')
+TELEGRAM_MENSAGENS = Contador('fii_telegram_mensagens_total',
+                              'Resultados de envio (ok, retry_after, erro_rede, texto_puro, descartada)', ['resultado'])
+ALERTAS = Contador('fii_alertas_disparados_total', 'Alertas disparados pelas regras', ['tipo'])
+
+
+def exportar(metricas=None):
+    """Texto no formato de exposição do Prometheus (0.0.4)."""
+    linhas = []
+    for metrica in (_registro if metricas is None else metricas):
+        linhas += metrica.exportar()
+    return '\n'.join(linhas) + '\n'
+
+
+def arquivo_retrato():
+    """Caminho base dos retratos; cada processo do bot grava o seu ao lado (ver `arquivo_trabalhador`)."""
+    return Path(getattr(settings, 'FII_METRICAS_ARQUIVO', Path(settings.BASE_DIR) / 'metricas_bot.prom'))
+
+
+def arquivo_trabalhador(identificador):
+    base = arquivo_retrato()
+    nome = re.sub(r'[^\w.-]', '_', identificador)
+    return base.with_name(f"{base.stem}.{nome}{base.suffix}")
+
+
+def gravar_retrato(identificador):
+    """Grava as métricas deste processo no arquivo dele (troca atômica), lido pelo site e pelo comando.
+
+    Um arquivo por processo: com vários runbot, um não sobrescreve as
+    métricas do outro. Aproveita para apagar retratos abandonados.
+    """
+    caminho = arquivo_trabalhador(identificador)
+    temporario = caminho.with_name(f"{caminho.name}.{os.getpid()}.tmp")
+    temporario.write_text(f"# gerado em {timezone.now().isoformat()}\n" + exportar())
+    os.replace(temporario, caminho)
+
+    for _, outro, idade in _retratos():
+        if idade > DESCARTE_RETRATO:
+            outro.unlink(missing_ok=True)
+
+
+def _retratos():
+    # [(trabalhador, caminho, idade em segundos)]
+    base = arquivo_retrato()
+    agora = time.time()
+    for caminho in base.parent.glob(f"{base.stem}.*{base.suffix}"):
+        try:
+            idade = agora - caminho.stat().st_mtime
+        except FileNotFoundError:
+            # Apagado por outro processo depois do glob
+            continue
+        yield caminho.name[len(base.stem) + 1:-len(base.suffix)], caminho, idade
+
+
+def ler_retratos(idade_maxima=None):
+    """[(trabalhador, texto, idade em segundos)] dos retratos gravados, do mais novo ao mais velho."""
+    retratos = []
+    for trabalhador, caminho, idade in _retratos():
+        if idade_maxima is not None and idade > idade_maxima:
+            continue
+        try:
+            retratos.append((trabalhador, caminho.read_text(), idade))
+        except FileNotFoundError:
+            continue
+    return sorted(retratos, key=lambda retrato: retrato[2])
+
+
+def mesclar_retratos(retratos):
+    """Junta retratos de vários processos num texto só, com o rótulo `trabalhador` em cada série.
+
+    O formato do Prometheus não aceita HELP/TYPE repetidos nem séries
+    iguais, então cada família sai uma vez, com as séries de todos.
+    """
+    familias = {}  # nome -> [linhas de HELP/TYPE, amostras]
+    for trabalhador, texto, _ in retratos:
+        rotulo = f'trabalhador="{_escapar(trabalhador)}"'
+        familia = None
+        for linha in texto.splitlines():
+            if linha.startswith(('# HELP ', '# TYPE ')):
+                nome = linha.split(' ', 3)[2]
+                familia = familias.setdefault(nome, [[], []])
+                if linha not in familia[0]:
+                    familia[0].append(linha)
+            elif linha and not linha.startswith('#') and familia is not None:
+                serie, valor = linha.rsplit(' ', 1)
+                if serie.endswith('}'):
+                    serie = serie.replace('{', '{' + rotulo + ',', 1)
+                else:
+                    serie = serie + '{' + rotulo + '}'
+                familia[1].append(f"{serie} {valor}")
+    linhas = [linha for cabecalho, amostras in familias.values() for linha in cabecalho + amostras]
+    return '\n'.join(linhas) + '\n' if linhas else ''
+
+
+def instrumentar(handler, nome=None):
+    """Envolve um handler do Telegram: mede a duração, conta exceções e rotula as operações de banco."""
+    nome = nome or handler.__name__
+
+    @functools.wraps(handler)
+    async def envolvido(update, context):
+        token = handler_atual.set(nome)
+        try:
+            with HANDLER_SEGUNDOS.cronometrar(handler=nome):
+                return await handler(update, context)
+        except Exception:
+            # O registro do erro fica com o python-telegram-bot; aqui só conta
+            HANDLER_ERROS.inc(handler=nome)
+            raise
+        finally:
+            handler_atual.reset(token)
+
+    return envolvido
+
+
+_proximas_execucoes = {}
+
+
+def instrumentar_job(job, nome=None):
+    """Como `instrumentar`, para jobs: mede também o atraso em relação ao horário agendado."""
+    nome = nome or job.__name__
+
+    @functools.wraps(job)
+    async def envolvido(context):
+        # Vários jobs podem dividir o mesmo callback (ex.: um fechamento por chat): a agenda é por job
+        chave = getattr(getattr(context, 'job', None), 'name', None) or nome
+        agendado = _proximas_execucoes.get(chave)
+        if agendado is not None:
+            JOB_ATRASO.observar(max(0.0, (timezone.now() - agendado).total_seconds()), job=nome)
+        token = handler_atual.set(nome)
+        try:
+            with JOB_SEGUNDOS.cronometrar(job=nome):
+                return await job(context)
+        except Exception:
+            HANDLER_ERROS.inc(handler=nome)
+            raise
+        finally:
+            handler_atual.reset(token)
+            # Durante a execução, next_t já aponta para a próxima rodada
+            proxima = getattr(getattr(context, 'job', None), 'next_t', None)
+            if proxima is not None:
+                _proximas_execucoes[chave] = proxima
+
+    return envolvido
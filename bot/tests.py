@@ -1,3 +1,1313 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import itertools
+import json
+import os
+import pstats
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from telegram.error import BadRequest
+from telegram.ext import JobQueue
+
+from bot import (acervo, agregacao, alertas, aporte, assinaturas, banco, cotacoes, historico, importacao, mensageria,
+                 perfil, projecao, proventos, tarefas, telemetria, views, webhook)
+from bot.agenda import FUSO_B3, AgendadorAdaptativo, CalendarioB3
+from bot.cache import CacheTTL
+from bot.carteira import OperacaoInvalida, reconstruir_posicoes, registrar_operacao
+from bot.indicadores import TabelaIndicadores
+from bot.persistencia import salvar_cotacoes
+from bot.models import (Assinatura, CotacaoHistorica, Dividendo, FeriadoB3, FundoImobiliario, Operacao, Posicao,
+                        RegraAlerta, Tarefa, Versao)
+
+# Tempo máximo (segundos) para subir o Django e importar o runbot num processo novo.
+# Hoje leva ~0,25 s: a folga cobre máquina lenta, mas não a volta do yfinance/pandas na subida.
+ORCAMENTO_IMPORTACAO = 1.5
+# Pesados demais para a inicialização; só entram na primeira busca de cotação
+IMPORTS_PREGUICOSOS = ('yfinance', 'pandas')
+
+SCRIPT_IMPORTACAO = """
+import sys, time
+inicio = time.perf_counter()
+import django
+django.setup()
+import bot.management.commands.runbot
+print(time.perf_counter() - inicio)
+print(','.join(m for m in {modulos!r} if m in sys.modules))
+"""
+
+SCRIPT_TRABALHADOR = """
+import json, sys, time
+import django
+django.setup()
+from bot.concessoes import UPDATES, Trabalhador
+trabalhador = Trabalhador(config={config!r})
+polling = False
+while time.time() < {ate!r}:
+    trabalhador.ciclo()
+    polling = trabalhador.manter(UPDATES)
+    time.sleep({config!r}['renovacao'])
+# Sai sem encerrar(), como um processo que morreu
+print(json.dumps({{'id': trabalhador.identificador, 'fatias': sorted(trabalhador.fatias), 'polling': polling}}))
+"""
+
+
+class InicializacaoTests(SimpleTestCase):
+    def medir_importacao(self):
+        # Processo novo: neste aqui os módulos já estão carregados pelo test runner
+        resultado = subprocess.run(
+            [sys.executable, '-c', SCRIPT_IMPORTACAO.format(modulos=IMPORTS_PREGUICOSOS)],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        segundos, carregados = resultado.stdout.split('\n')[:2]
+        return float(segundos), [m for m in carregados.split(',') if m]
+
+    def test_runbot_nao_importa_yfinance(self):
+        _, carregados = self.medir_importacao()
+        self.assertEqual(carregados, [])
+
+    def test_importacao_dentro_do_orcamento(self):
+        # O melhor de cinco tira o ruído de disco frio e máquina ocupada
+        melhor = min(self.medir_importacao()[0] for _ in range(5))
+        self.assertLess(melhor, ORCAMENTO_IMPORTACAO,
+                        f"Importar o runbot levou {melhor:.2f}s (orçamento: {ORCAMENTO_IMPORTACAO}s)")
+
+
+class ConcessoesTests(SimpleTestCase):
+    """Vários processos de verdade disputando as fatias num mesmo arquivo SQLite em WAL."""
+    CONFIG = {'fatias': 12, 'validade': 2, 'renovacao': 0.2}
+
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        self.banco = Path(pasta.name) / 'concessoes.sqlite3'
+        # Sempre o settings do projeto, que lê FII_BANCO
+        self.ambiente = {**os.environ, 'FII_BANCO': str(self.banco), 'DJANGO_SETTINGS_MODULE': 'core.settings'}
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '-v', '0'], cwd=settings.BASE_DIR,
+                       env=self.ambiente, check=True)
+
+    def rodar(self, processos, segundos):
+        # Prazo absoluto: todos param juntos, mesmo tendo subido em momentos diferentes
+        script = SCRIPT_TRABALHADOR.format(config=self.CONFIG, ate=time.time() + segundos)
+        filhos = [subprocess.Popen([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=self.ambiente,
+                                   stdout=subprocess.PIPE, text=True) for _ in range(processos)]
+        saidas = [json.loads(filho.communicate(timeout=segundos + 60)[0]) for filho in filhos]
+        self.assertTrue(all(filho.returncode == 0 for filho in filhos))
+        return saidas
+
+    def donos(self):
+        with sqlite3.connect(self.banco) as conexao:
+            return dict(conexao.execute("SELECT recurso, dono FROM bot_concessao WHERE recurso LIKE 'fatia:%'"))
+
+    def test_fatias_divididas_e_assumidas(self):
+        saidas = self.rodar(3, 5)
+        donos = self.donos()
+        # Cada fatia com exatamente um dono, e a carga dividida por igual
+        self.assertEqual(len(donos), self.CONFIG['fatias'])
+        self.assertEqual(sorted(Counter(donos.values()).values()), [4, 4, 4])
+        for saida in saidas:
+            self.assertEqual(len(saida['fatias']), 4)
+            self.assertEqual({f"fatia:{n:03d}" for n in saida['fatias']},
+                             {recurso for recurso, dono in donos.items() if dono == saida['id']})
+        self.assertEqual(sum(saida['polling'] for saida in saidas), 1)
+
+        # Os três "morrem"; depois da validade, um processo novo assume tudo
+        time.sleep(self.CONFIG['validade'] + 0.5)
+        [saida] = self.rodar(1, 2)
+        self.assertEqual(saida['fatias'], list(range(self.CONFIG['fatias'])))
+        self.assertTrue(saida['polling'])
+        self.assertEqual(set(self.donos().values()), {saida['id']})
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_benchmark_roda_com_carteira_pequena(self):
+        # Processo novo: o benchmark cria e destrói o próprio banco de teste
+        with tempfile.TemporaryDirectory() as pasta:
+            saida = Path(pasta) / 'resultado.json'
+            subprocess.run([sys.executable, 'manage.py', 'benchmark', '--tamanhos', '10', '--repeticoes', '2',
+                            '--saida', str(saida)], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                           check=True)
+            cenario = json.loads(saida.read_text())['cenarios']['10']
+        self.assertEqual(set(cenario), {'status_handler', 'relatorio_fechamento', 'home_frio', 'home_cache',
+                                        'vigia_precos'})
+        self.assertGreater(cenario['vigia_precos']['tickers_por_s'], 0)
+
+
+def _regra(id_, tipo=RegraAlerta.PRECO_ABAIXO, limite=100.0, histerese=1.0, reaviso=1.0, cooldown=0):
+    return RegraAlerta(id=id_, ticker='HGLG11', tipo=tipo, limite=limite, histerese=histerese, reaviso=reaviso,
+                       cooldown=cooldown)
+
+
+class AvaliacaoAlertasTests(SimpleTestCase):
+    """Transições das regras no índice: dispara, reavisa e rearma (com histerese)."""
+    INICIO = datetime.datetime(2024, 11, 14, 13, 0, tzinfo=datetime.timezone.utc)
+
+    def avaliar(self, indice, preco, segundos=0):
+        instante = self.INICIO + datetime.timedelta(seconds=segundos)
+        return [(regra.id, valor) for regra, valor in indice.avaliar('HGLG11', {'preco': preco}, agora=instante)]
+
+    def test_dispara_reavisa_e_rearma(self):
+        regra = _regra(1)
+        indice = alertas.IndiceAlertas([regra])
+        self.assertEqual(self.avaliar(indice, 101.0), [])
+        self.assertEqual(self.avaliar(indice, 99.5), [(1, 99.5)])
+        self.assertFalse(regra.armada)
+        self.assertEqual(regra.ultimo_valor, 99.5)
+
+        # Desarmada: só avisa de novo se cair mais 1% abaixo do último aviso (99,5 → 98,505)
+        self.assertEqual(self.avaliar(indice, 99.0), [])
+        self.assertEqual(self.avaliar(indice, 98.4), [(1, 98.4)])
+
+        # Voltar acima do limite não basta: rearma só 1% acima dele (101)
+        self.assertEqual(self.avaliar(indice, 100.5), [])
+        self.assertEqual(self.avaliar(indice, 99.9), [])
+        self.assertFalse(regra.armada)
+        self.assertEqual(self.avaliar(indice, 101.5), [])
+        self.assertTrue(regra.armada)
+        self.assertEqual(self.avaliar(indice, 99.9), [(1, 99.9)])
+        self.assertEqual(set(indice.retirar_alteradas()), {regra})
+        self.assertEqual(indice.retirar_alteradas(), [])
+
+    def test_regra_acima_espelhada(self):
+        regra = _regra(1, tipo=RegraAlerta.PRECO_ACIMA, reaviso=0)
+        indice = alertas.IndiceAlertas([regra])
+        self.assertEqual(self.avaliar(indice, 99.0), [])
+        self.assertEqual(self.avaliar(indice, 100.0), [(1, 100.0)])
+        # reaviso=0: desarmada não avisa mais, por mais que suba
+        self.assertEqual(self.avaliar(indice, 120.0), [])
+        self.assertEqual(self.avaliar(indice, 99.5), [])
+        self.assertEqual(self.avaliar(indice, 98.9), [])
+        self.assertTrue(regra.armada)
+        self.assertEqual(self.avaliar(indice, 100.1), [(1, 100.1)])
+
+    def test_cooldown_segura_o_reaviso(self):
+        regra = _regra(1, cooldown=60)
+        indice = alertas.IndiceAlertas([regra, _regra(2, limite=90.0)])
+        self.assertEqual(self.avaliar(indice, 99.0), [(1, 99.0)])
+        self.assertEqual(self.avaliar(indice, 95.0, segundos=30), [])
+        self.assertEqual(self.avaliar(indice, 95.0, segundos=61), [(1, 95.0)])
+        # Só as regras que o preço alcança são tocadas
+        self.assertEqual(sorted(self.avaliar(indice, 89.0, segundos=200)), [(1, 89.0), (2, 89.0)])
+
+
+class IndiceAlertasTests(TestCase):
+    def setUp(self):
+        alertas._indice = None
+        self.assinatura = Assinatura.objects.create(chat_id=1)
+        self.regra = RegraAlerta.objects.create(assinatura=self.assinatura, ticker='HGLG11', limite=150)
+
+    def test_indice_recarrega_quando_outro_processo_muda_as_regras(self):
+        indice = alertas.obter_indice()
+        self.assertIs(alertas.obter_indice(), indice)
+
+        # Outro processo: muda o banco sem passar pelos sinais deste, só pelo contador
+        RegraAlerta.objects.filter(pk=self.regra.pk).update(limite=140)
+        Versao.objects.filter(nome=alertas.VERSAO_REGRAS).update(valor=F('valor') + 1)
+        recarregado = alertas.obter_indice()
+        self.assertIsNot(recarregado, indice)
+        self.assertEqual(recarregado.regras[self.regra.pk].limite, 140)
+
+    def test_sinais_sobem_o_contador_do_banco(self):
+        antes = Versao.objects.get(nome=alertas.VERSAO_REGRAS).valor
+        RegraAlerta.objects.create(assinatura=self.assinatura, ticker='KNRI11', limite=120)
+        self.assinatura.save()
+        self.assertEqual(Versao.objects.get(nome=alertas.VERSAO_REGRAS).valor, antes + 2)
+
+
+class TarefasTests(TestCase):
+    def test_fechamento_agendado_de_segunda_a_sexta(self):
+        assinaturas.ativar(1, {})
+        job_queue = JobQueue()
+        tarefas.sincronizar(job_queue, tarefas.ativas(), {tarefas.FECHAMENTO: lambda context: None},
+                            datetime.timezone.utc)
+        [job] = job_queue.jobs()
+        self.assertEqual(job.name, tarefas.nome_fechamento(1))
+        # No run_daily do PTB 0 = domingo; o cron do APScheduler mostra os dias por nome
+        self.assertEqual(job.data['tarefa'][-1], '1,2,3,4,5')
+        campos = {campo.name: str(campo) for campo in job.job.trigger.fields}
+        self.assertEqual(campos['day_of_week'], 'mon,tue,wed,thu,fri')
+
+
+class BotFalso:
+    """send_message que anota o que foi enviado e recusa Markdown com `recusar_markdown`."""
+
+    def __init__(self, recusar_markdown=False):
+        self.recusar_markdown = recusar_markdown
+        self.enviadas = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if self.recusar_markdown and parse_mode:
+            raise BadRequest("Can't parse entities")
+        self.enviadas.append((time.monotonic(), text, parse_mode))
+
+
+class MensageriaTests(SimpleTestCase):
+    def entregar(self, bot, textos, **opcoes):
+        async def rodar():
+            fila = mensageria.FilaEnvio(bot, janela=0, **opcoes)
+            fila.iniciar()
+            for texto in textos:
+                fila.enfileirar(1, texto)
+            await fila.parar()
+            return fila
+        return asyncio.run(rodar())
+
+    def test_resumo_quebra_em_fim_de_linha(self):
+        linhas = [f"*HGLG11* linha {n} " + 'x' * (n % 70) for n in range(400)]
+        textos = ['\n'.join(linhas[i:i + 40]) for i in range(0, 400, 40)] + ['\n'.join(linhas)]
+        partes = mensageria.montar_resumo(textos)
+        self.assertGreater(len(partes), 3)
+        self.assertTrue(all(len(parte) <= mensageria.TAMANHO_MAXIMO for parte in partes))
+        enviadas = {linha for parte in partes for linha in parte.split('\n')}
+        self.assertTrue(set(linhas) <= enviadas)
+
+    def test_markdown_recusado_vai_como_texto_puro(self):
+        bot = BotFalso(recusar_markdown=True)
+        fila = self.entregar(bot, ['*MXRF11_* abaixo do alvo'])
+        self.assertEqual([(texto, modo) for _, texto, modo in bot.enviadas], [('*MXRF11_* abaixo do alvo', None)])
+        self.assertEqual((fila.enviadas, fila.descartadas), (1, 0))
+
+    def test_cada_parte_do_resumo_gasta_um_token(self):
+        bot = BotFalso()
+        texto = '\n'.join('y' * 100 for _ in range(100))  # ~10 mil caracteres: 3 partes
+        self.entregar(bot, [texto], taxa_por_chat=10)
+        instantes = [instante for instante, _, _ in bot.enviadas]
+        self.assertEqual(len(instantes), 3)
+        # Balde de 1 token a 10/s: a terceira parte sai pelo menos 0,2 s depois da primeira
+        self.assertGreaterEqual(instantes[2] - instantes[0], 0.18)
+
+    def test_parar_desiste_apos_o_tempo_de_drenagem(self):
+        class BotTravado(BotFalso):
+            async def send_message(self, chat_id, text, parse_mode=None):
+                await asyncio.Event().wait()
+
+        async def rodar():
+            fila = mensageria.FilaEnvio(BotTravado(), janela=0, taxa_global=1, tempo_drenagem=0.3)
+            fila.iniciar()
+            for chat_id in range(3):
+                fila.enfileirar(chat_id, 'alerta')
+            await asyncio.sleep(0.05)
+            envios = list(fila._envios)
+            inicio = time.monotonic()
+            with self.assertLogs('bot.mensageria', 'WARNING') as logs:
+                await fila.parar()
+            return fila, envios, time.monotonic() - inicio, logs.output
+
+        fila, envios, duracao, logs = asyncio.run(rodar())
+        self.assertLess(duracao, 1)
+        # Um chat saiu (balde global de 1 token) e travou; os outros dois seguiam na fila
+        self.assertIn('2 chats pendentes, 1 envios cancelados', logs[0])
+        self.assertTrue(envios and all(envio.cancelled() for envio in envios))
+        self.assertFalse(fila._envios)
+
+
+class CarteiraTests(TestCase):
+    def test_preco_com_mais_casas_bate_com_a_reconstrucao(self):
+        registrar_operacao('HGLG11', Operacao.COMPRA, 3, 10.005)
+        registrar_operacao('HGLG11', Operacao.COMPRA, 7, '9.8749')
+        posicao, lucro = registrar_operacao('HGLG11', Operacao.VENDA, 4, Decimal('11.116'))
+        self.assertEqual(list(Operacao.objects.values_list('preco', flat=True).order_by('id')),
+                         [Decimal('10.00'), Decimal('9.87'), Decimal('11.12')])
+        self.assertEqual(lucro, Decimal('11.12') * 4 - (Decimal('10.00') * 3 + Decimal('9.87') * 7) * 4 / 10)
+        self.assertEqual(reconstruir_posicoes(verificar=True), [])
+
+    def test_preco_zero_recusado(self):
+        registrar_operacao('MXRF11', Operacao.COMPRA, 10, '9.74')
+        with self.assertRaises(OperacaoInvalida):
+            registrar_operacao('MXRF11', Operacao.VENDA, 5, 0)
+        self.assertEqual(Operacao.objects.count(), 1)
+
+
+class AgregacaoTests(TestCase):
+    def test_magic_atingidos_bate_com_o_progresso_de_cada_fundo(self):
+        fundos = [
+            # (ticker, quantidade, preço, último dividendo, média mensal de 12 meses)
+            ('MXRF11', 140, '9.80', '0.07', '0.12'),   # exatamente no magic number (pelo último dividendo)
+            ('HGLG11', 100, '160.00', '1.10', '1.70'),  # só atingiria pela média
+            ('KNRI11', 200, '150.00', '1.00', '0.50'),  # só atingiria pelo último dividendo
+            ('XPML11', 139, '9.80', '0.07', '0'),       # uma cota antes
+            ('VISC11', 500, '10.00', '0', '0.10'),      # sem último dividendo: sem magic number
+            ('BCFF11', 50, '0', '0.08', '0'),           # sem cotação
+        ]
+        for ticker, quantidade, preco, div, media in fundos:
+            FundoImobiliario.objects.create(ticker=ticker, tipo='Papel', quantidade=quantidade,
+                                            preco_atual=preco, ultimo_dividendo=div,
+                                            media_mensal_dividendos=media)
+
+        esperado = sum(f.magic_number > 0 and f.progresso_magic >= 100 for f in FundoImobiliario.objects.all())
+        self.assertEqual(esperado, 2)
+        self.assertEqual(agregacao.resumo_carteira(detalhar=False)['totais']['magic_atingidos'], esperado)
+        self.assertEqual(FundoImobiliario.objects.get(ticker='MXRF11').magic_number, 140)
+
+
+class ProventosTests(TestCase):
+    HOJE = datetime.date(2026, 10, 18)
+
+    def setUp(self):
+        for ticker in ('MXRF11', 'HGLG11'):
+            FundoImobiliario.objects.create(ticker=ticker, preco_atual=10)
+
+    def _somas(self):
+        return list(FundoImobiliario.objects.order_by('ticker')
+                    .values_list('ticker', 'dividendos_12m', 'dividendos_12m_eventos', 'media_mensal_dividendos'))
+
+    def _confere_com_recalculo(self, hoje):
+        incremental = self._somas()
+        proventos.recalcular(hoje)
+        self.assertEqual(incremental, self._somas())
+        return incremental
+
+    def test_soma_incremental_igual_ao_recalculo(self):
+        dia = datetime.timedelta(days=1)
+        proventos.registrar_eventos([('MXRF11', self.HOJE - 400 * dia, '0.50'),
+                                     ('MXRF11', self.HOJE - 200 * dia, '0.10'),
+                                     ('HGLG11', self.HOJE - 30 * dia, '1.10')], hoje=self.HOJE)
+        proventos.registrar_eventos([('MXRF11', self.HOJE - 170 * dia, '0.11'),
+                                     ('MXRF11', self.HOJE - 200 * dia, '0.09'),   # correção
+                                     ('HGLG11', self.HOJE - 30 * dia, '1.10'),    # repetido
+                                     ('XXXX11', self.HOJE, '9.99')], hoje=self.HOJE)
+        somas = self._confere_com_recalculo(self.HOJE)
+        self.assertEqual(somas[1][1:], (Decimal('0.2'), 2, Decimal('0.1')))
+
+    def test_evento_sai_da_soma_ao_passar_da_janela(self):
+        dia = datetime.timedelta(days=1)
+        proventos.registrar_eventos([('MXRF11', self.HOJE - 300 * dia, '0.10'),
+                                     ('MXRF11', self.HOJE - 100 * dia, '0.12')], hoje=self.HOJE)
+        depois = self.HOJE + 100 * dia
+        self.assertEqual(proventos.expirar_janelas(depois), 1)
+        somas = self._confere_com_recalculo(depois)
+        self.assertEqual(somas[1][1:], (Decimal('0.12'), 1, Decimal('0.12')))
+        # No dia seguinte nada mais expira
+        self.assertEqual(proventos.expirar_janelas(depois), 0)
+
+    def test_div_manual_substitui_evento_do_provedor_na_mesma_data(self):
+        data = self.HOJE - datetime.timedelta(days=10)
+        proventos.registrar_eventos([('MXRF11', data, '0.10')], hoje=self.HOJE)
+        proventos.registrar_eventos([('MXRF11', data, '0.12')], fonte=Dividendo.MANUAL, hoje=self.HOJE)
+
+        dividendo = Dividendo.objects.get()
+        self.assertEqual((dividendo.valor, dividendo.fonte), (Decimal('0.12'), Dividendo.MANUAL))
+        somas = self._confere_com_recalculo(self.HOJE)
+        self.assertEqual(somas[1][1:], (Decimal('0.12'), 1, Decimal('0.12')))
+        self.assertEqual(FundoImobiliario.objects.get(ticker='MXRF11').ultimo_dividendo, Decimal('0.12'))
+
+    def test_provedor_substitui_div_manual_do_mesmo_mes(self):
+        proventos.registrar_eventos([('MXRF11', datetime.date(2026, 9, 30), '0.10')],
+                                    fonte=Dividendo.MANUAL, hoje=self.HOJE)
+        proventos.registrar_eventos([('MXRF11', datetime.date(2026, 9, 15), '0.11')], hoje=self.HOJE)
+
+        self.assertEqual(list(Dividendo.objects.values_list('data', 'fonte')),
+                         [(datetime.date(2026, 9, 15), Dividendo.PROVEDOR)])
+        somas = self._confere_com_recalculo(self.HOJE)
+        self.assertEqual(somas[1][1:], (Decimal('0.11'), 1, Decimal('0.11')))
+
+
+class HistoricoTests(TestCase):
+    AGORA = datetime.datetime(2026, 10, 18, 12, 0, tzinfo=datetime.timezone.utc)
+
+    def setUp(self):
+        self.fundo = FundoImobiliario.objects.create(ticker='MXRF11')
+        inicio = self.AGORA - datetime.timedelta(days=3, hours=2)   # 10:00 UTC, três dias antes
+        for minutos, preco in ((0, 10.0), (1, 12.0), (4, 9.0), (5, 11.0)):
+            historico.registrar_ticks([(self.fundo, preco)], inicio + datetime.timedelta(minutes=minutos))
+        # Recente demais para compactar
+        historico.registrar_ticks([(self.fundo, 10.5)], self.AGORA - datetime.timedelta(days=1))
+        self.inicio = inicio
+
+    def _barras(self, resolucao):
+        return list(CotacaoHistorica.objects.filter(resolucao=resolucao).order_by('instante')
+                    .values_list('instante', 'abertura', 'maxima', 'minima', 'fechamento', 'amostras'))
+
+    def test_ticks_viram_barras_de_5_min_1_h_e_1_dia(self):
+        removidas = historico.compactar(self.AGORA)
+        self.assertEqual(removidas[CotacaoHistorica.TICK], 4)
+        self.assertEqual(self._barras(CotacaoHistorica.CINCO_MINUTOS), [
+            (self.inicio, 10.0, 12.0, 9.0, 9.0, 3),
+            (self.inicio + datetime.timedelta(minutes=5), 11.0, 11.0, 11.0, 11.0, 1),
+        ])
+        self.assertEqual(len(self._barras(CotacaoHistorica.TICK)), 1)
+
+        historico.compactar(self.AGORA + datetime.timedelta(days=30))
+        self.assertEqual(self._barras(CotacaoHistorica.CINCO_MINUTOS), [])
+        self.assertEqual(self._barras(CotacaoHistorica.HORA)[0], (self.inicio, 10.0, 12.0, 9.0, 11.0, 4))
+
+        historico.compactar(self.AGORA + datetime.timedelta(days=400))
+        meia_noite = self.inicio.replace(hour=0)
+        self.assertEqual(self._barras(CotacaoHistorica.HORA), [])
+        self.assertEqual(self._barras(CotacaoHistorica.DIA)[0], (meia_noite, 10.0, 12.0, 9.0, 11.0, 4))
+
+    def test_retencao_mantem_o_que_ainda_nao_venceu(self):
+        historico.compactar(self.AGORA + datetime.timedelta(days=1))
+        # O tick recente tem 2 dias exatos: ainda não entra no corte
+        self.assertEqual(len(self._barras(CotacaoHistorica.TICK)), 1)
+
+        historico.compactar(self.AGORA + datetime.timedelta(days=26))
+        # As barras de 5 min ainda não têm 30 dias; o tick recente já virou barra
+        self.assertEqual(len(self._barras(CotacaoHistorica.CINCO_MINUTOS)), 3)
+        self.assertEqual(self._barras(CotacaoHistorica.TICK), [])
+        self.assertEqual(self._barras(CotacaoHistorica.HORA), [])
+
+    def test_compactar_duas_vezes_nao_duplica(self):
+        historico.compactar(self.AGORA)
+        antes = self._barras(CotacaoHistorica.CINCO_MINUTOS)
+        self.assertEqual(historico.compactar(self.AGORA), {origem: 0 for origem, _, _ in historico.RETENCAO})
+        # Um tick atrasado num balde já compactado não cria uma segunda barra (historico_unico)
+        historico.registrar_ticks([(self.fundo, 50.0)], self.inicio + datetime.timedelta(minutes=2))
+        historico.compactar(self.AGORA)
+        self.assertEqual(self._barras(CotacaoHistorica.CINCO_MINUTOS), antes)
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fundo = FundoImobiliario.objects.create(ticker='MXRF11', tipo='Papel', quantidade=10,
+                                                     preco_atual='9.80', ultimo_dividendo='0.07')
+
+    def test_revalidacao_com_etag_devolve_304_vazio(self):
+        resposta = self.client.get('/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('MXRF11', resposta.content.decode())
+
+        repetida = self.client.get('/', HTTP_IF_NONE_MATCH=resposta['ETag'])
+        self.assertEqual(repetida.status_code, 304)
+        self.assertEqual(repetida.content, b'')
+
+    def test_salvar_fundo_ou_operacao_muda_etag_e_renderiza_de_novo(self):
+        with mock.patch.object(views, '_renderizar', wraps=views._renderizar) as renderizar:
+            etag = self.client.get('/')['ETag']
+            self.assertEqual(self.client.get('/')['ETag'], etag)
+            self.assertEqual(renderizar.call_count, 1)
+
+            FundoImobiliario.objects.create(ticker='HGLG11', quantidade=2, preco_atual=160)
+            resposta = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resposta.status_code, 200)
+            self.assertIn('HGLG11', resposta.content.decode())
+            self.assertNotEqual(resposta['ETag'], etag)
+            self.assertEqual(renderizar.call_count, 2)
+
+            etag = resposta['ETag']
+            Operacao.objects.create(fundo=self.fundo, tipo=Operacao.COMPRA, quantidade=1, preco='9.80')
+            resposta = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resposta.status_code, 200)
+            self.assertNotEqual(resposta['ETag'], etag)
+            self.assertEqual(renderizar.call_count, 3)
+
+
+class TabelaIndicadoresTests(TestCase):
+    PROPRIEDADES = ('dividend_yield', 'dy_12m', 'p_vp', 'magic_number', 'faltam_para_magic', 'progresso_magic',
+                    'lucro_total', 'falta_quanto')
+
+    def test_colunas_iguais_as_properties_do_modelo(self):
+        fundos = [
+            # (ticker, quantidade, preço, teto, último dividendo, VP, preço médio, média mensal)
+            ('MXRF11', 140, '9.80', '10.00', '0.07', '9.50', '10.10', '0.0850'),
+            ('HGLG11', 3, '160.00', '150.00', '1.10', '155.00', '158.37', '0'),
+            ('SEMP11', 10, '0', '10.00', '0.10', '10.00', '9.00', '0.10'),      # sem preço
+            ('SEMD11', 5, '95.00', '100.00', '0', '100.00', '90.00', '0'),     # sem dividendo
+            ('SEMV11', 7, '12.34', '0', '0.11', '0', '11.00', '0.1234'),        # sem VP e sem teto
+            ('ZERO11', 0, '50.00', '45.00', '0.40', '48.00', '0', '0.39'),      # fora da carteira
+        ]
+        for ticker, qtd, preco, teto, div, vp, medio, media in fundos:
+            FundoImobiliario.objects.create(ticker=ticker, quantidade=qtd, preco_atual=preco, preco_teto=teto,
+                                            ultimo_dividendo=div, valor_patrimonial=vp, preco_medio=medio,
+                                            media_mensal_dividendos=media)
+
+        tabela = TabelaIndicadores().por_ticker()
+        self.assertEqual(len(tabela), len(fundos))
+        for fundo in FundoImobiliario.objects.all():
+            linha = tabela[fundo.ticker]
+            for nome in self.PROPRIEDADES:
+                with self.subTest(ticker=fundo.ticker, indicador=nome):
+                    self.assertAlmostEqual(linha[nome], getattr(fundo, nome), places=9)
+        self.assertEqual(tabela['MXRF11']['magic_number'], 140)
+
+
+class NomeFundoTests(SimpleTestCase):
+    def setUp(self):
+        self.provedor = cotacoes.ProvedorFake(precos={'HGLG11': 160.0, 'XPTO11': 9.5},
+                                              nomes={'HGLG11': 'CSHG Logística FII'})
+        self.anterior = cotacoes.definir_provedor(self.provedor)
+        self.addCleanup(cotacoes.definir_provedor, self.anterior)
+        # O script configura o logging na importação; aqui não
+        with mock.patch('logging.basicConfig'):
+            import bot_fii
+        self.bot_fii = bot_fii
+
+    def test_fii_mostra_o_nome_do_fundo(self):
+        self.assertEqual(self.bot_fii.get_fii_data('hglg11.SA'),
+                         {'nome': 'CSHG Logística FII', 'preco': 160.0, 'moeda': 'BRL'})
+        # Sem nome no provedor, o ticker faz as vezes de nome
+        self.assertEqual(self.bot_fii.get_fii_data('XPTO11')['nome'], 'XPTO11')
+
+    def test_nome_fica_em_cache(self):
+        for _ in range(3):
+            self.assertEqual(cotacoes.buscar_nomes(['HGLG11']), {'HGLG11': 'CSHG Logística FII'})
+        self.assertEqual(self.provedor.chamadas_nomes, 1)
+
+
+class RetratoMetricasTests(SimpleTestCase):
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        self.pasta = Path(pasta.name)
+        configuracao = override_settings(FII_METRICAS_ARQUIVO=self.pasta / 'metricas_bot.prom')
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def test_um_arquivo_por_processo_mesclado_na_view(self):
+        telemetria.ALERTAS.inc(tipo='teste')
+        telemetria.gravar_retrato('maquina:101:aaaaaa')
+        telemetria.gravar_retrato('maquina:202:bbbbbb')
+        # Um processo parado há muito tempo não entra na soma do site
+        velho = telemetria.arquivo_trabalhador('maquina:303:cccccc')
+        velho.write_text(telemetria.exportar())
+        os.utime(velho, (0, 0))
+
+        texto = self.client.get('/metricas/').content.decode()
+        self.assertEqual(texto.count('# TYPE fii_alertas_disparados_total counter'), 1)
+        series = sorted(linha.rsplit(' ', 1)[0] for linha in texto.splitlines()
+                        if linha.startswith('fii_alertas_disparados_total{') and 'tipo="teste"' in linha)
+        self.assertEqual(series, ['fii_alertas_disparados_total{trabalhador="maquina_101_aaaaaa",tipo="teste"}',
+                                  'fii_alertas_disparados_total{trabalhador="maquina_202_bbbbbb",tipo="teste"}'])
+        # ...e o próximo retrato gravado apaga o arquivo abandonado
+        telemetria.gravar_retrato('maquina:101:aaaaaa')
+        self.assertFalse(velho.exists())
+
+
+# Como o extrato de negociação da B3: preâmbulo, ";", números e datas brasileiros, do mais novo ao mais antigo
+EXTRATO_B3 = """Extrato de negociação;;;;;;
+Período: 01/03/2024 a 05/03/2024;;;;;;
+;;;;;;
+Data do Negócio;Tipo de Movimentação;Mercado;Código de Negociação;Quantidade;Preço;Valor
+05/03/2024;Venda;Mercado à Vista;HGLG11;10;162,50;1.625,00
+05/03/2024;Compra;Mercado à Vista;HGLG11;15;160,00;2.400,00
+04/03/2024;Compra;Mercado Fracionário;MXRF11F;7;10,05;70,35
+01/03/2024;Compra;Mercado à Vista;MXRF11;1.000;9,80;9.800,00
+01/03/2024;Compra;Mercado à Vista;MXRF11;1.000;9,80;9.800,00
+"""
+
+
+class ImportacaoTests(TestCase):
+    def extrato(self, conteudo, codificacao='utf-8'):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        caminho = Path(pasta.name) / 'extrato.csv'
+        caminho.write_bytes(conteudo.encode(codificacao))
+        return caminho
+
+    def posicoes(self):
+        return dict(Posicao.objects.values_list('fundo__ticker', 'quantidade'))
+
+    def test_extrato_b3_do_mais_novo_ao_mais_antigo(self):
+        resultado = importacao.importar(self.extrato(EXTRATO_B3, 'latin-1'))
+        self.assertEqual((resultado['lidas'], resultado['inseridas'], resultado['invalidas']), (5, 5, 0))
+        self.assertEqual(resultado['inconsistentes'], [])
+        # A venda do dia 05 vem antes da compra no arquivo; o livro aplica a compra primeiro
+        self.assertEqual(self.posicoes(), {'HGLG11': 5, 'MXRF11': 2007})
+        self.assertEqual(FundoImobiliario.objects.get(ticker='MXRF11').preco_medio, Decimal('9.80'))
+        self.assertEqual(Operacao.objects.get(fundo__ticker='HGLG11', tipo=Operacao.VENDA).preco, Decimal('162.50'))
+
+    def test_reimportar_nao_duplica(self):
+        caminho = self.extrato(EXTRATO_B3)
+        importacao.importar(caminho)
+        resultado = importacao.importar(caminho, tamanho_lote=2)
+        self.assertEqual((resultado['inseridas'], resultado['duplicadas']), (0, 5))
+        self.assertEqual(Operacao.objects.count(), 5)
+        self.assertEqual(self.posicoes(), {'HGLG11': 5, 'MXRF11': 2007})
+
+    def test_extrato_sobreposto_so_traz_o_que_falta(self):
+        importacao.importar(self.extrato(EXTRATO_B3))
+        # Os dois negócios idênticos do dia 01 continuam dois; só o do dia 06 é novo
+        linhas = EXTRATO_B3.splitlines()
+        novo = '\n'.join(linhas[3:4] + ['06/03/2024;Compra;Mercado à Vista;KNRI11;3;140,00;420,00'] + linhas[4:])
+        resultado = importacao.importar(self.extrato(novo))
+        self.assertEqual((resultado['inseridas'], resultado['duplicadas']), (1, 5))
+
+    def test_fundo_que_nao_fecha_e_listado_e_os_outros_recalculados(self):
+        resultado = importacao.importar(self.extrato(
+            "data,ticker,tipo,quantidade,preco\n"
+            "2024-01-02,MXRF11,C,10,9.50\n"
+            "2024-01-03,KNRI11,V,5,140.00\n"))
+        self.assertEqual(resultado['inconsistentes'], ['KNRI11: Você só tem 0 cotas.'])
+        self.assertEqual(self.posicoes(), {'MXRF11': 10})
+        self.assertIn('KNRI11', importacao.resumo(resultado))
+
+    def test_cabecalho_nao_reconhecido(self):
+        with self.assertRaises(importacao.ImportacaoInvalida):
+            importacao.importar(self.extrato("dia;papel;qtd\n01/03/2024;HGLG11;10\n"))
+
+    def test_numeros_e_datas(self):
+        self.assertEqual(importacao._decimal('R$ 1.234,56'), Decimal('1234.56'))
+        self.assertEqual(importacao._decimal('1.000'), Decimal('1000'))
+        self.assertEqual(importacao._decimal('9.80'), Decimal('9.80'))
+        self.assertEqual(importacao._data('05/03/2024'), datetime.date(2024, 3, 5))
+        self.assertEqual(importacao._data('2024-03-05 00:00:00'), datetime.date(2024, 3, 5))
+        self.assertEqual(importacao._data('05/03/24'), datetime.date(2024, 3, 5))
+        with self.assertRaises(ValueError):
+            importacao._data('2024-13-03')
+
+
+class RelogioFalso:
+    def __init__(self, agora):
+        self.agora = agora
+
+    def __call__(self):
+        return self.agora
+
+    def avancar(self, segundos):
+        self.agora += datetime.timedelta(seconds=segundos)
+
+
+def _brt(*args):
+    return datetime.datetime(*args, tzinfo=FUSO_B3)
+
+
+class CalendarioFeriadosTests(TestCase):
+    def test_avisa_quando_o_ano_nao_tem_feriados(self):
+        ano = datetime.datetime.now(FUSO_B3).year
+        FeriadoB3.objects.get_or_create(data=datetime.date(ano, 12, 25), defaults={'descricao': 'Natal'})
+        with self.assertNoLogs('bot.agenda', 'WARNING'):
+            CalendarioB3.carregar()
+
+        FeriadoB3.objects.filter(data__year=ano).delete()
+        with self.assertLogs('bot.agenda', 'WARNING') as logs:
+            CalendarioB3.carregar()
+        self.assertIn(str(ano), logs.output[0])
+
+
+class AgendaTests(SimpleTestCase):
+    # 15/11/2024 (sexta) é feriado da Proclamação da República
+    FERIADO = datetime.date(2024, 11, 15)
+
+    def setUp(self):
+        self.calendario = CalendarioB3([self.FERIADO])
+
+    def test_pregao_so_em_dia_util_no_horario(self):
+        aberto = self.calendario.pregao_aberto
+        self.assertTrue(aberto(_brt(2024, 11, 14, 10, 0)))
+        self.assertTrue(aberto(_brt(2024, 11, 14, 17, 59)))
+        self.assertFalse(aberto(_brt(2024, 11, 14, 9, 59)))
+        self.assertFalse(aberto(_brt(2024, 11, 14, 18, 0)))
+        self.assertFalse(aberto(_brt(2024, 11, 15, 12, 0)))  # feriado
+        self.assertFalse(aberto(_brt(2024, 11, 16, 12, 0)))  # sábado
+        # 13h UTC = 10h em Brasília
+        self.assertTrue(aberto(datetime.datetime(2024, 11, 18, 13, 0, tzinfo=datetime.timezone.utc)))
+
+    def test_proxima_abertura_pula_feriado_e_fim_de_semana(self):
+        self.assertEqual(self.calendario.proxima_abertura(_brt(2024, 11, 14, 18, 30)), _brt(2024, 11, 18, 10, 0))
+        self.assertEqual(self.calendario.proxima_abertura(_brt(2024, 11, 18, 8, 0)), _brt(2024, 11, 18, 10, 0))
+
+    def test_dia_simulado(self):
+        relogio = RelogioFalso(_brt(2024, 11, 14, 9, 0))
+        agenda = AgendadorAdaptativo(self.calendario, relogio=relogio)
+        tickers = ['HGLG11', 'MXRF11']
+
+        # Antes da abertura nada é buscado, e o vigia dorme até as 10h
+        self.assertEqual(agenda.devidos(tickers), [])
+        self.assertEqual(agenda.segundos_ate_proxima(), 3600)
+
+        relogio.avancar(3600)
+        self.assertEqual(agenda.devidos(tickers), tickers)
+        perto = agenda.registrar('HGLG11', 100.0, alvo=100.5)
+        longe = agenda.registrar('MXRF11', 10.0, alvo=5.0)
+        self.assertLess(perto, longe)
+        self.assertEqual(agenda.devidos(tickers), [])
+        self.assertEqual(agenda.segundos_ate_proxima(), perto)
+
+        relogio.avancar(perto)
+        self.assertEqual(agenda.devidos(tickers), ['HGLG11'])
+        relogio.avancar(longe - perto)
+        self.assertEqual(agenda.devidos(tickers), tickers)
+
+        # Preço disparando: o intervalo encurta até o mínimo, nunca abaixo
+        for preco in (10.0, 10.5, 9.8, 10.6):
+            intervalo = agenda.registrar('MXRF11', preco, alvo=5.0)
+        self.assertLess(intervalo, longe)
+        self.assertGreaterEqual(intervalo, agenda.config['intervalo_minimo'])
+        self.assertLessEqual(longe, agenda.config['intervalo_maximo'])
+
+        # Depois do fechamento, só na abertura do próximo pregão (segunda, pulando o feriado)
+        relogio.agora = _brt(2024, 11, 14, 18, 0)
+        self.assertEqual(agenda.devidos(tickers), [])
+        self.assertEqual(agenda.segundos_ate_proxima(), (_brt(2024, 11, 18, 10, 0) - relogio.agora).total_seconds())
+
+
+class AporteTests(SimpleTestCase):
+    """Otimizador comparado à força bruta (todas as combinações de cotas) em universos pequenos."""
+
+    def universo(self, rng, fundos=4):
+        return {
+            'ticker': [f"FII{i}11" for i in range(fundos)],
+            'tipo': [rng.choice(['Tijolo', 'Papel']) for _ in range(fundos)],
+            'preco': np.array([round(rng.uniform(20, 160), 2) for _ in range(fundos)]),
+            'provento': np.array([round(rng.uniform(0.1, 1.5), 2) for _ in range(fundos)]),
+            'quantidade': np.zeros(fundos, dtype=np.int64),
+            'magic_number': np.array([rng.randint(50, 200) for _ in range(fundos)]),
+            'faltam_para_magic': np.array([rng.randint(0, 3) for _ in range(fundos)]),
+            'distribuicao': {'Tijolo': rng.choice([0, 500, 2000]), 'Papel': rng.choice([0, 500, 2000])},
+        }
+
+    def limites(self, universo, orcamento, pesos):
+        patrimonio = sum(universo['distribuicao'].values()) + orcamento
+        return {tipo: max(0.0, peso * patrimonio - universo['distribuicao'].get(tipo, 0.0))
+                for tipo, peso in pesos.items()}
+
+    def forca_bruta(self, universo, orcamento, limites):
+        precos, tipos, proventos = universo['preco'], universo['tipo'], universo['provento']
+        melhor = 0.0
+        for cotas in itertools.product(*[range(int(orcamento // preco) + 1) for preco in precos]):
+            gasto = {}
+            for quantidade, preco, tipo in zip(cotas, precos, tipos):
+                gasto[tipo] = gasto.get(tipo, 0.0) + quantidade * preco
+            if sum(gasto.values()) > orcamento or any(gasto.get(t, 0.0) > limite for t, limite in limites.items()):
+                continue
+            melhor = max(melhor, sum(q * p for q, p in zip(cotas, proventos)))
+        return melhor
+
+    def conferir_limites(self, resultado, orcamento, limites):
+        self.assertLessEqual(resultado['gasto'], orcamento + 1e-9)
+        for tipo, limite in limites.items():
+            self.assertLessEqual(sum(c['custo'] for c in resultado['compras'] if c['tipo'] == tipo), limite + 1e-9)
+
+    def test_renda_perto_do_otimo_e_dentro_dos_limites(self):
+        rng = random.Random(20)
+        pior = 0.0
+        for _ in range(40):
+            universo = self.universo(rng)
+            orcamento = rng.choice([150, 300, 500])
+            pesos = rng.choice([{}, {'Tijolo': 0.5, 'Papel': 0.5}, {'Papel': 0.3}])
+            limites = self.limites(universo, orcamento, pesos)
+            otimo = self.forca_bruta(universo, orcamento, limites)
+
+            resultado = aporte.resolver(universo, orcamento, config={**aporte.PADRAO, 'pesos_tipo': pesos})
+            self.conferir_limites(resultado, orcamento, limites)
+            if otimo:
+                pior = max(pior, (otimo - resultado['renda']) / otimo)
+            # Com poucos passos a solução piora, mas nunca estoura orçamento nem limites
+            grosseiro = aporte.resolver(universo, orcamento,
+                                        config={**aporte.PADRAO, 'pesos_tipo': pesos, 'resolucao': 50})
+            self.conferir_limites(grosseiro, orcamento, limites)
+        self.assertLessEqual(pior, 0.005)
+
+    def test_orcamento_nao_finito_ou_grande_demais_recusado(self):
+        universo = self.universo(random.Random(1))
+        for valor in (float('nan'), float('inf'), -1.0, 0.0, 1e12):
+            self.assertFalse(aporte.orcamento_valido(valor))
+            with self.assertRaises(ValueError):
+                aporte.resolver(universo, valor)
+        self.assertTrue(aporte.orcamento_valido(aporte.PADRAO['maximo_orcamento']))
+
+    def test_magic_nao_passa_do_que_falta(self):
+        universo = self.universo(random.Random(3))
+        resultado = aporte.resolver(universo, 2000, objetivo=aporte.MAGIC)
+        faltam = dict(zip(universo['ticker'], universo['faltam_para_magic']))
+        self.assertTrue(all(compra['cotas'] <= faltam[compra['ticker']] for compra in resultado['compras']))
+        # Orçamento de sobra: completa o Magic Number de todos
+        self.assertEqual(sum(compra['cotas'] for compra in resultado['compras']),
+                         int(universo['faltam_para_magic'].sum()))
+
+
+class ProjecaoTests(SimpleTestCase):
+    def carteira(self):
+        rendimento = np.array([0.008, 0.01, 0.009])
+        retornos, rendimentos = projecao.historico_modelo(3, rendimento, projecao.PADRAO, semente=1)
+        return {'tickers': ['HGLG11', 'MXRF11', 'KNRI11'], 'cotas': np.array([10.0, 100.0, 5.0]),
+                'precos': np.array([160.0, 10.0, 140.0]), 'renda_mensal': 21.3, 'retornos': retornos,
+                'rendimentos': rendimentos, 'fonte': 'modelo', 'meses_historico': 0}
+
+    def simular(self, **opcoes):
+        # Lotes pequenos: a simulação se divide em vários, como numa carteira grande
+        config = {**projecao.PADRAO, 'elementos_por_lote': 300}
+        resultado = projecao.simular(self.carteira(), anos=5, caminhos=500, config=config, **opcoes)
+        resultado.pop('segundos')
+        return resultado
+
+    def tearDown(self):
+        if projecao._pool is not None:
+            projecao._pool.shutdown()
+            projecao._pool = None
+
+    def test_mesma_semente_mesmo_resultado(self):
+        sequencial = self.simular(semente=42, processos=1)
+        self.assertEqual(self.simular(semente=42, processos=1), sequencial)
+        # No pool de processos cada lote tem a sua semente derivada: o resultado não muda
+        self.assertEqual(self.simular(semente=42, processos=2), sequencial)
+        self.assertEqual(projecao._pool._mp_context.get_start_method(), 'forkserver')
+        self.assertNotEqual(self.simular(semente=43, processos=1), sequencial)
+
+        for serie in (sequencial['patrimonio'], sequencial['renda']):
+            self.assertTrue(all(p10 <= p50 <= p90 for p10, p50, p90 in zip(serie[10], serie[50], serie[90])))
+        self.assertEqual(sequencial['patrimonio'][50][0], 10 * 160 + 100 * 10 + 5 * 140)
+
+
+class CacheTTLTests(SimpleTestCase):
+    def setUp(self):
+        self.agora = 0.0
+        self.cache = CacheTTL(ttl=60, max_itens=2, relogio=lambda: self.agora)
+        self.chamadas = []
+
+    def carregar(self, chaves):
+        self.chamadas.append(sorted(chaves))
+        return {chave: chave.lower() for chave in chaves if chave != 'FALHA'}
+
+    def test_expira_depois_do_ttl(self):
+        self.assertEqual(self.cache.obter_muitos(['A'], self.carregar), {'A': 'a'})
+        self.agora = 59.9
+        self.cache.obter_muitos(['A'], self.carregar)
+        self.assertEqual(self.chamadas, [['A']])
+        self.agora = 60.0
+        self.cache.obter_muitos(['A'], self.carregar)
+        self.assertEqual(self.chamadas, [['A'], ['A']])
+        # Valor conhecido gravado com idade expira antes
+        self.cache.definir('B', 'b', idade=50)
+        self.agora = 70.0
+        self.cache.obter_muitos(['B'], self.carregar)
+        self.assertEqual(self.chamadas[-1], ['B'])
+
+    def test_so_busca_o_que_falta_e_nao_guarda_falha(self):
+        self.cache.obter_muitos(['A'], self.carregar)
+        self.assertEqual(self.cache.obter_muitos(['A', 'B', 'FALHA'], self.carregar),
+                         {'A': 'a', 'B': 'b', 'FALHA': None})
+        self.cache.obter_muitos(['FALHA'], self.carregar)
+        self.assertEqual(self.chamadas, [['A'], ['B', 'FALHA'], ['FALHA']])
+
+    def test_descarta_o_menos_usado(self):
+        self.cache.obter_muitos(['A', 'B'], self.carregar)
+        self.cache.obter_muitos(['A'], self.carregar)
+        self.cache.obter_muitos(['C'], self.carregar)
+        self.cache.obter_muitos(['A', 'B'], self.carregar)
+        self.assertEqual(self.chamadas[-1], ['B'])
+        self.assertEqual(self.cache.estatisticas()['descartes'], 2)
+
+    def test_single_flight(self):
+        liberar = threading.Event()
+        chamadas = []
+
+        def lento(chave):
+            chamadas.append(chave)
+            liberar.wait(10)
+            return 'valor'
+
+        resultados = []
+        threads = [threading.Thread(target=lambda: resultados.append(self.cache.obter('A', lento)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        # Todas as outras threads esperando a busca da primeira
+        prazo = time.monotonic() + 10
+        while self.cache.estatisticas()['coalescidos'] < 7 and time.monotonic() < prazo:
+            time.sleep(0.01)
+        liberar.set()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(chamadas, ['A'])
+        self.assertEqual(resultados, ['valor'] * 8)
+
+    def test_erro_chega_a_quem_espera_e_nao_fica_guardado(self):
+        liberar = threading.Event()
+
+        def quebra(chave):
+            liberar.wait(10)
+            raise ConnectionError('provedor fora')
+
+        erros = []
+
+        def pedir():
+            try:
+                self.cache.obter('A', quebra)
+            except ConnectionError as e:
+                erros.append(e)
+
+        threads = [threading.Thread(target=pedir) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        prazo = time.monotonic() + 10
+        while self.cache.estatisticas()['coalescidos'] < 2 and time.monotonic() < prazo:
+            time.sleep(0.01)
+        liberar.set()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(len(erros), 3)
+        self.assertEqual(self.cache.obter('A', lambda chave: 'ok'), 'ok')
+
+
+@override_settings(FII_WEBHOOK_SEGREDO='segredo-de-teste')
+class WebhookTests(SimpleTestCase):
+    def chamar(self, cabecalhos, metodo='POST', caminho='/' + webhook.CAMINHO):
+        repassados, enviados = [], []
+
+        async def django(scope, receive, send):
+            repassados.append(scope['path'])
+
+        async def receive():
+            raise AssertionError("o corpo não deveria ser lido")
+
+        async def send(mensagem):
+            enviados.append(mensagem)
+
+        scope = {'type': 'http', 'method': metodo, 'path': caminho, 'headers': cabecalhos}
+        asyncio.run(webhook.com_bot(django)(scope, receive, send))
+        return repassados, enviados
+
+    def test_segredo_errado_recusado_sem_ler_o_corpo(self):
+        for cabecalhos in ([], [(b'x-telegram-bot-api-secret-token', b'outro')]):
+            repassados, enviados = self.chamar(cabecalhos)
+            self.assertEqual(repassados, [])
+            self.assertEqual(enviados[0]['status'], 403)
+
+    def test_segredo_certo_e_outras_rotas_seguem_para_o_django(self):
+        repassados, _ = self.chamar([(b'x-telegram-bot-api-secret-token', b'segredo-de-teste')])
+        self.assertEqual(repassados, ['/' + webhook.CAMINHO])
+        repassados, _ = self.chamar([], metodo='GET', caminho='/metricas/')
+        self.assertEqual(repassados, ['/metricas/'])
+
+
+class MensagemFalsa:
+    def __init__(self, texto=''):
+        self.text = texto
+        self.respostas = []
+
+    async def reply_text(self, texto, **opcoes):
+        self.respostas.append(texto)
+
+
+class AtualizacaoFalsa:
+    """O mínimo de um Update do Telegram para chamar um handler direto."""
+
+    def __init__(self, chat_id=1):
+        self.message = MensagemFalsa()
+        self.effective_chat = type('Chat', (), {'id': chat_id})()
+        self.effective_user = type('Usuario', (), {'id': chat_id})()
+
+
+class ContextoFalso:
+    def __init__(self, *args):
+        self.args = list(args)
+        self.bot_data = {}
+
+
+class EntradaInvalidaTests(TestCase):
+    def test_view_aporte_recusa_valor_nao_finito(self):
+        for valor in ('nan', 'inf', '-inf', '1e12', '-5'):
+            resposta = self.client.get('/aporte/', {'valor': valor})
+            self.assertEqual(resposta.status_code, 400, valor)
+
+    def test_handler_aporte_recusa_valor_nao_finito(self):
+        from bot.management.commands.runbot import aporte_handler
+        for valor in ('nan', 'inf', '1e12', '0'):
+            atualizacao = AtualizacaoFalsa()
+            asyncio.run(aporte_handler(atualizacao, ContextoFalso(valor)))
+            self.assertEqual(len(atualizacao.message.respostas), 1)
+            self.assertTrue(atualizacao.message.respostas[0].startswith('⚠️ Use: /aporte'), valor)
+
+    def test_handler_div_recusa_valor_nao_finito(self):
+        from bot.management.commands.runbot import dividendo_handler
+        FundoImobiliario.objects.create(ticker='MXRF11')
+        for valor in ('nan', 'inf', '-inf', '0', '-0,10'):
+            atualizacao = AtualizacaoFalsa()
+            asyncio.run(dividendo_handler(atualizacao, ContextoFalso('MXRF11', valor)))
+            self.assertEqual(atualizacao.message.respostas, ['❌ Use: /div TICKER VALOR'], valor)
+        self.assertFalse(Dividendo.objects.exists())
+
+
+class ProvedorContador(cotacoes.ProvedorFake):
+    """ProvedorFake que também anota os tickers pedidos em cada chamada."""
+
+    def __init__(self, precos):
+        super().__init__(precos)
+        self.pedidos = []
+
+    def buscar(self, tickers):
+        self.pedidos.append(sorted(tickers))
+        return super().buscar(tickers)
+
+
+class TrabalhadorUnico:
+    def filtrar_tickers(self, tickers):
+        return list(tickers)
+
+
+async def _na_thread_do_teste(func, *args, **kwargs):
+    # Faz o papel de banco.ler/escrever na mesma conexão (e transação) do teste: rodado por
+    # async_to_sync, o sync_to_async thread_sensitive volta para a thread que chamou
+    return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+
+
+class VigiaTests(TestCase):
+    TICKERS = ['HGLG11', 'KNRI11', 'MXRF11', 'VISC11', 'XPLG11']
+
+    def setUp(self):
+        alertas._indice = None
+        assinatura = Assinatura.objects.create(chat_id=1)
+        for ticker in self.TICKERS:
+            RegraAlerta.objects.create(assinatura=assinatura, ticker=ticker, limite=1)
+        self.contexto = ContextoFalso()
+        self.contexto.bot_data = {
+            # Segunda-feira, pregão aberto
+            'agenda': AgendadorAdaptativo(CalendarioB3(), relogio=RelogioFalso(_brt(2026, 10, 19, 11, 0))),
+            'trabalhador': TrabalhadorUnico(),
+            'fila_envio': mensageria.FilaEnvio(BotFalso()),
+        }
+
+    def ciclo(self, provedor):
+        from bot.management.commands.runbot import vigia_precos
+        anterior = cotacoes.definir_provedor(provedor)
+        self.addCleanup(cotacoes.definir_provedor, anterior)
+        with mock.patch.object(banco, 'ler', _na_thread_do_teste), \
+                mock.patch.object(banco, 'escrever', _na_thread_do_teste):
+            async_to_sync(vigia_precos)(self.contexto)
+
+    def test_um_ciclo_faz_uma_chamada_em_lote(self):
+        provedor = ProvedorContador({ticker: 100.0 + n for n, ticker in enumerate(self.TICKERS)})
+        self.ciclo(provedor)
+        self.assertEqual(provedor.pedidos, [self.TICKERS])
+        self.assertEqual(dict(FundoImobiliario.objects.values_list('ticker', 'preco_atual')),
+                         {ticker: Decimal(100 + n) for n, ticker in enumerate(self.TICKERS)})
+
+        # Logo em seguida nenhum ticker venceu o intervalo: nem chega ao provedor
+        self.ciclo(provedor)
+        self.assertEqual(len(provedor.pedidos), 1)
+
+    def test_tickers_que_faltam_no_lote_voltam_no_ciclo_seguinte(self):
+        provedor = ProvedorContador({'HGLG11': 160.0, 'MXRF11': 9.8, 'XPLG11': 100.0})
+        self.ciclo(provedor)
+        self.assertEqual(provedor.pedidos, [self.TICKERS])
+        self.assertEqual(sorted(FundoImobiliario.objects.values_list('ticker', flat=True)),
+                         ['HGLG11', 'MXRF11', 'XPLG11'])
+
+        # Sem cotação o ticker não foi agendado: só os que faltaram vão, de novo num único lote
+        provedor.precos['KNRI11'] = 150.0
+        self.ciclo(provedor)
+        self.assertEqual(provedor.pedidos[1], ['KNRI11', 'VISC11'])
+        self.assertTrue(FundoImobiliario.objects.filter(ticker='KNRI11', preco_atual=150).exists())
+        self.assertFalse(FundoImobiliario.objects.filter(ticker='VISC11').exists())
+
+
+class SalvarCotacoesTests(TestCase):
+    def gravar(self, quantos):
+        FundoImobiliario.objects.all().delete()
+        FundoImobiliario.objects.bulk_create([FundoImobiliario(ticker=f"F{n:03d}11", preco_atual=10)
+                                              for n in range(quantos)])
+        cotacoes = {f"F{n:03d}11": 11.0 for n in range(quantos)}
+        cotacoes.update({'NOVO11': 5.0, 'SEMP11': None})
+        with CaptureQueriesContext(connection) as consultas:
+            variacoes = salvar_cotacoes(cotacoes, {'F00011': 12})
+        return variacoes, [consulta['sql'] for consulta in consultas.captured_queries]
+
+    def test_ciclo_inteiro_numa_transacao_com_consultas_fixas(self):
+        _, poucos = self.gravar(3)
+        variacoes, muitos = self.gravar(40)
+        # Mesmo número de consultas para 3 ou 40 fundos, tudo dentro de uma única transação
+        # (no TestCase, o atomic vira um savepoint)
+        self.assertEqual(len(muitos), len(poucos))
+        self.assertLessEqual(len(muitos), 8)
+        self.assertTrue(muitos[0].startswith('SAVEPOINT') and muitos[-1].startswith('RELEASE SAVEPOINT'))
+        self.assertEqual(sum('SAVEPOINT' in sql for sql in muitos), 2)
+
+        # Ticker sem cotação fica de fora: nem fundo, nem tick, nem variação
+        self.assertNotIn('SEMP11', variacoes)
+        self.assertFalse(FundoImobiliario.objects.filter(ticker='SEMP11').exists())
+        self.assertEqual(CotacaoHistorica.objects.filter(resolucao=CotacaoHistorica.TICK).count(), 40 + 1)
+        self.assertAlmostEqual(variacoes['F00111'], 10.0)
+        self.assertEqual(FundoImobiliario.objects.get(ticker='F00011').preco_teto, 12)
+
+
+class BancoTests(TransactionTestCase):
+    # Escritor e leitores usam conexões próprias: só enxergam o que foi de fato gravado
+    def tearDown(self):
+        banco.fechar_conexoes()
+
+    def test_escritas_em_serie_na_thread_escritora(self):
+        ativas, pico, threads = [0], [0], set()
+        trava = threading.Lock()
+
+        def gravar(numero):
+            with trava:
+                ativas[0] += 1
+                pico[0] = max(pico[0], ativas[0])
+            threads.add(threading.current_thread().name)
+            time.sleep(0.005)
+            FundoImobiliario.objects.create(ticker=f"F{numero:03d}11")
+            with trava:
+                ativas[0] -= 1
+            return numero
+
+        async def rodar():
+            return await asyncio.gather(*(banco.escrever(gravar, n) for n in range(20)))
+
+        self.assertEqual(asyncio.run(rodar()), list(range(20)))
+        self.assertEqual((pico[0], threads), (1, {'escritor-banco'}))
+        self.assertEqual(FundoImobiliario.objects.count(), 20)
+
+    def test_erro_chega_a_quem_esperava_e_nao_desfaz_o_lote(self):
+        def falhar():
+            FundoImobiliario.objects.create(ticker='FALHA11')
+            raise ValueError('recusado')
+
+        async def rodar():
+            return await asyncio.gather(banco.escrever(FundoImobiliario.objects.create, ticker='HGLG11'),
+                                        banco.escrever(falhar),
+                                        banco.escrever(FundoImobiliario.objects.create, ticker='KNRI11'),
+                                        return_exceptions=True)
+
+        criado, erro, _ = asyncio.run(rodar())
+        self.assertEqual(criado.ticker, 'HGLG11')
+        self.assertIsInstance(erro, ValueError)
+        # A escrita que falhou voltou atrás sozinha (savepoint); as outras do lote ficaram
+        self.assertEqual(sorted(FundoImobiliario.objects.values_list('ticker', flat=True)), ['HGLG11', 'KNRI11'])
+
+    def test_leitores_veem_o_que_foi_gravado(self):
+        def contar():
+            return FundoImobiliario.objects.filter(ticker='MXRF11').count()
+
+        async def rodar():
+            antes = await banco.ler(contar)
+            await banco.escrever(FundoImobiliario.objects.create, ticker='MXRF11')
+            depois = await asyncio.gather(*(banco.ler(contar) for _ in range(banco.LEITORES * 2)))
+            return antes, depois
+
+        antes, depois = asyncio.run(rodar())
+        self.assertEqual(antes, 0)
+        self.assertEqual(depois, [1] * banco.LEITORES * 2)
+
+    def test_fechar_conexoes_reabre_escritor_e_leitores(self):
+        asyncio.run(banco.escrever(FundoImobiliario.objects.create, ticker='HGLG11'))
+        escritor = banco.escritor._thread
+        banco.fechar_conexoes()
+        self.assertFalse(escritor.is_alive())
+
+        async def rodar():
+            await banco.escrever(FundoImobiliario.objects.create, ticker='KNRI11')
+            return await banco.ler(FundoImobiliario.objects.count)
+
+        self.assertEqual(asyncio.run(rodar()), 2)
+
+
+FIM_ACERVO = datetime.date(2026, 10, 16)
+
+
+def baixar_falso(ticker, pasta, inicio):
+    """Faz o papel de acervo.baixar sem rede: pregões determinísticos por ticker até FIM_ACERVO."""
+    datas = np.arange(np.datetime64(inicio, 'D'), np.datetime64(FIM_ACERVO, 'D') + 1)
+    datas = datas[np.is_busday(datas)]
+    rng = np.random.default_rng([sum(map(ord, ticker)), len(datas)])
+    fechamento = 100 * np.cumprod(1 + rng.normal(0, 0.01, len(datas)))
+    colunas = {'abertura': fechamento * 0.999, 'maxima': fechamento * 1.01, 'minima': fechamento * 0.99,
+               'fechamento': fechamento, 'volume': rng.integers(1000, 5000, len(datas)).astype(np.float64)}
+    mensais = np.flatnonzero(np.diff(datas.astype('datetime64[M]'), prepend=datas[:1].astype('datetime64[M]')))
+    return acervo.anexar(pasta, ticker, datas, colunas, datas[mensais], np.full(len(mensais), 0.08))
+
+
+class AcervoTests(SimpleTestCase):
+    NOMES = ('data', 'div_data', 'div_valor', *acervo.CAMPOS)
+
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        self.pasta = Path(pasta.name)
+
+    def colunas(self, pasta, ticker):
+        serie = acervo.abrir(ticker, pasta)
+        return {nome: np.array(getattr(serie, nome)) for nome in self.NOMES}
+
+    def test_anexar_e_reabrir_devolve_os_mesmos_dados(self):
+        datas = np.array(['2026-01-05', '2026-01-06', '2026-01-07'], dtype='datetime64[D]')
+        colunas = {campo: np.array([10.0, 10.5, 10.2]) + n for n, campo in enumerate(acervo.CAMPOS)}
+        div_datas = np.array(['2026-01-06'], dtype='datetime64[D]')
+        self.assertEqual(acervo.anexar(self.pasta, 'MXRF11', datas, colunas, div_datas, np.array([0.1])), (3, 1))
+
+        # Segunda carga sobreposta: só o que vem depois do último dia gravado entra
+        novas = np.array(['2026-01-07', '2026-01-08'], dtype='datetime64[D]')
+        colunas_novas = {campo: np.array([99.0, 11.0]) + n for n, campo in enumerate(acervo.CAMPOS)}
+        self.assertEqual(acervo.anexar(self.pasta, 'MXRF11', novas, colunas_novas,
+                                       np.array(['2026-01-06', '2026-01-08'], dtype='datetime64[D]'),
+                                       np.array([0.1, 0.11])), (1, 1))
+
+        serie = acervo.abrir('mxrf11', self.pasta)
+        self.assertEqual(serie.meta['linhas'], 4)
+        np.testing.assert_array_equal(serie.data, np.concatenate([datas, novas[1:]]))
+        for n, campo in enumerate(acervo.CAMPOS):
+            np.testing.assert_array_equal(getattr(serie, campo), np.array([10.0, 10.5, 10.2, 11.0]) + n)
+        np.testing.assert_array_equal(serie.div_valor, [0.1, 0.11])
+        self.assertEqual(serie.janela('2026-01-06', '2026-01-07'), slice(1, 3))
+        self.assertEqual(acervo.inicio_incremental(self.pasta, 'MXRF11', datetime.date(2025, 1, 1)),
+                         datetime.date(2026, 1, 9))
+
+    def test_backfill_paralelo_igual_ao_sequencial(self):
+        tickers = ['HGLG11', 'KNRI11', 'MXRF11', 'VISC11', 'XPLG11']
+        desde = datetime.date(2024, 1, 1)
+        sequencial, paralelo = self.pasta / 'sequencial', self.pasta / 'paralelo'
+        for ticker in tickers:
+            baixar_falso(ticker, sequencial, desde)
+
+        with mock.patch('bot.management.commands.backfill.baixar', baixar_falso):
+            call_command('backfill', *tickers, desde=desde, pasta=str(paralelo), processos=3, stdout=io.StringIO())
+            # Rodar de novo só retoma do dia seguinte ao último gravado: nada muda
+            call_command('backfill', *tickers, desde=desde, pasta=str(paralelo), processos=3, stdout=io.StringIO())
+
+        for ticker in tickers:
+            esperado, obtido = self.colunas(sequencial, ticker), self.colunas(paralelo, ticker)
+            for nome in self.NOMES:
+                np.testing.assert_array_equal(obtido[nome], esperado[nome], err_msg=f"{ticker} {nome}")
+
+
+class PerfilTests(SimpleTestCase):
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        self.pasta = Path(pasta.name) / 'perfis'
+
+    @staticmethod
+    async def handler(update, context):
+        await asyncio.sleep(0.02)
+        return sum(range(10_000))
+
+    def test_desligado_nao_grava_nada(self):
+        perfilador = perfil.Perfilador(self.pasta)
+        envolvido = perfilador.envolver(self.handler)
+        self.assertEqual(envolvido.__name__, 'handler')
+        self.assertEqual(asyncio.run(envolvido(None, None)), sum(range(10_000)))
+        self.assertEqual(perfilador.gravados, 0)
+        self.assertFalse(self.pasta.exists())
+
+    def test_ligado_grava_um_perfil_por_chamada(self):
+        perfilador = perfil.Perfilador(self.pasta, alvos={'handler'})
+        envolvido = perfilador.envolver(self.handler)
+        outro = perfilador.envolver(self.handler, nome='status')
+        perfilador.ligar()
+        asyncio.run(envolvido(None, None))
+        asyncio.run(outro(None, None))  # fora dos alvos
+
+        arquivos = list(self.pasta.iterdir())
+        self.assertEqual([a.suffix for a in arquivos], ['.prof'])
+        self.assertTrue(arquivos[0].name.startswith('handler-'))
+        self.assertGreater(pstats.Stats(str(arquivos[0])).total_calls, 0)
+
+        perfilador.ligar(perfil.AMOSTRAGEM)
+        asyncio.run(envolvido(None, None))
+        self.assertEqual(sorted(a.suffix for a in self.pasta.iterdir()), ['.folded', '.prof'])
+        self.assertEqual(perfilador.gravados, 2)
+
+        perfilador.desligar()
+        asyncio.run(envolvido(None, None))
+        self.assertEqual(perfilador.gravados, 2)
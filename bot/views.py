@@ -1,38 +1,129 @@
-from django.shortcuts import render
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from . import aporte as otimizador_aporte
+from . import projecao as motor_projecao
+from . import telemetria, webhook
+from .agregacao import resumo_carteira
+from .indicadores import TabelaIndicadores
 from .models import FundoImobiliario
+from .signals import versao_carteira
+
+# O HTML só muda quando a versão da carteira muda; o TTL é só uma rede de segurança
+CACHE_DASHBOARD_TTL = 60 * 60
+
+DASHBOARD_SEGUNDOS = telemetria.Histograma('fii_dashboard_render_segundos', 'Montagem do HTML do dashboard')
+DASHBOARD_CACHE = telemetria.Contador('fii_dashboard_cache_total', 'Acessos ao HTML do dashboard em cache',
+                                      ['resultado'])
+PROJECAO_SEGUNDOS = telemetria.Histograma('fii_projecao_segundos', 'Simulação da projeção do painel do dashboard')
+
+
+def _versao(request):
+    # etag_func e last_modified_func usam a mesma consulta, feita uma vez por request
+    if not hasattr(request, '_versao_carteira'):
+        request._versao_carteira = versao_carteira()
+    return request._versao_carteira
 
-def home(request):
-    fundos = FundoImobiliario.objects.all()
-    fundos_ativos = fundos.filter(quantidade__gt=0)
 
-    # Calculando Totais
-    total_investido = sum(f.quantidade * float(f.preco_medio) for f in fundos if f.quantidade > 0)
-    renda_estimada = sum(f.quantidade * float(f.ultimo_dividendo) for f in fundos if f.quantidade > 0)
+def _etag(request):
+    return _versao(request)[0]
 
-    # Contador de Magic Numbers atingidos
-    magic_atingidos = sum(1 for f in fundos if f.quantidade >= f.magic_number and f.magic_number > 0)
-    total_ativos = fundos.filter(quantidade__gt=0).count()
 
-    total_investido = sum(f.quantidade * float(f.preco_medio or 0) for f in fundos if f.quantidade > 0)
-    renda_estimada = sum(f.quantidade * float(f.ultimo_dividendo or 0) for f in fundos if f.quantidade > 0)
+def _ultima_modificacao(request):
+    return _versao(request)[1]
 
-    # Novo: Cálculo para o Gráfico de Diversificação
-    distribuicao = {}
-    for f in fundos:
-        tipo = (f.tipo or "Tijolo").capitalize()
-        valor_atual = f.quantidade * float(f.preco_atual or 0)
-        distribuicao[tipo] = distribuicao.get(tipo, 0) + valor_atual
 
+def _renderizar():
+    # A tabela só mostra fundos em carteira; os indicadores saem vetorizados
+    fundos = TabelaIndicadores(FundoImobiliario.objects.filter(quantidade__gt=0)).linhas()
+
+    # Totais e diversificação calculados pelo banco numa única consulta
+    resumo = resumo_carteira(detalhar=False)
+    totais = resumo['totais']
+    distribuicao = resumo['distribuicao']
 
     context = {
         'fundos': fundos,
-        'total_investido': total_investido,
-        'renda_estimada': renda_estimada,
-        'magic_atingidos': magic_atingidos,
-        'total_ativos': total_ativos,
-        'labels_grafico': list(distribuicao.keys()),
-        'dados_grafico': list(distribuicao.values()),
+        'total_investido': totais['investido'],
+        'renda_estimada': totais['renda'],
+        'magic_atingidos': totais['magic_atingidos'],
+        'total_ativos': totais['ativos'],
         'labels_grafico': list(distribuicao.keys()),
         'dados_grafico': list(distribuicao.values()),
+        'aporte_painel': otimizador_aporte.configuracao()['aporte_painel'],
     }
-    return render(request, 'index.html', context)
\ No newline at end of file
+    return render_to_string('index.html', context)
+
+
+@condition(etag_func=_etag, last_modified_func=_ultima_modificacao)
+def home(request):
+    chave = f"dashboard:{_etag(request)}"
+    html = cache.get(chave)
+    if html is None:
+        DASHBOARD_CACHE.inc(resultado='miss')
+        with DASHBOARD_SEGUNDOS.cronometrar():
+            html = _renderizar()
+        cache.set(chave, html, CACHE_DASHBOARD_TTL)
+    else:
+        DASHBOARD_CACHE.inc(resultado='hit')
+
+    response = HttpResponse(html)
+    # Os painéis sempre revalidam; com a carteira parada a resposta é um 304 vazio
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@condition(etag_func=_etag, last_modified_func=_ultima_modificacao)
+def projecao(request):
+    """Percentis da projeção Bola de Neve para o painel; carregado à parte para não atrasar o dashboard."""
+    chave = f"projecao:{_etag(request)}"
+    dados = cache.get(chave)
+    if dados is None:
+        config = motor_projecao.configuracao()
+        carteira = motor_projecao.carregar_carteira(config=config)
+        if not carteira['tickers']:
+            dados = {'anos': []}
+        else:
+            with PROJECAO_SEGUNDOS.cronometrar():
+                dados = motor_projecao.simular(carteira, caminhos=config['caminhos_painel'], config=config)
+        cache.set(chave, dados, CACHE_DASHBOARD_TTL)
+
+    response = JsonResponse(dados)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@condition(etag_func=_etag, last_modified_func=_ultima_modificacao)
+def aporte(request):
+    """Sugestão de compra para o valor informado (?valor=); o painel usa FII_APORTE['aporte_painel']."""
+    config = otimizador_aporte.configuracao()
+    objetivo = request.GET.get('objetivo', otimizador_aporte.RENDA)
+    try:
+        valor = float(request.GET.get('valor', config['aporte_painel']))
+    except ValueError:
+        valor = 0
+    if not otimizador_aporte.orcamento_valido(valor, config) or objetivo not in otimizador_aporte.OBJETIVOS:
+        return JsonResponse({'erro': 'valor ou objetivo inválido'}, status=400)
+
+    chave = f"aporte:{_etag(request)}:{objetivo}:{valor:.2f}"
+    dados = cache.get(chave)
+    if dados is None:
+        dados = otimizador_aporte.sugerir(valor, objetivo, config)
+        cache.set(chave, dados, CACHE_DASHBOARD_TTL)
+
+    response = JsonResponse(dados)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def metricas(request):
+    """Métricas no formato do Prometheus: as do site mais os retratos recentes de cada processo do bot."""
+    if webhook.aplicacao() is not None:
+        # Modo webhook: o bot roda neste processo, todas as métricas já estão aqui
+        return HttpResponse(telemetria.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    texto = telemetria.exportar([DASHBOARD_SEGUNDOS, DASHBOARD_CACHE, PROJECAO_SEGUNDOS])
+    texto += telemetria.mesclar_retratos(telemetria.ler_retratos(telemetria.IDADE_MAXIMA_RETRATO))
+    return HttpResponse(texto, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,162 @@
+"""Modo webhook: o Telegram faz POST dos updates numa rota do próprio app ASGI do Django.
+
+Com FII_WEBHOOK_URL definido, `core.asgi` envolve o app do Django com
+`com_bot`: no lifespan do servidor (uvicorn) a aplicação do bot sobe no mesmo
+event loop, registra o webhook e passa a receber os updates pela view
+`receber`, que os coloca direto na update_queue. Os updates pendentes ficam
+guardados no Telegram durante um reinício, em vez de descartados como no
+polling.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed
+from django.views.decorators.csrf import csrf_exempt
+from telegram import Update
+
+from bot import telemetria
+
+logger = logging.getLogger(__name__)
+
+CAMINHO = 'telegram/'
+CABECALHO_SEGREDO = 'X-Telegram-Bot-Api-Secret-Token'
+
+WEBHOOK_UPDATES = telemetria.Contador('fii_webhook_updates_total',
+                                      'Updates recebidos pelo webhook (aceito, negado, invalido, indisponivel)',
+                                      ['resultado'])
+WEBHOOK_SEGUNDOS = telemetria.Histograma('fii_webhook_segundos', 'Do POST do Telegram até o update entrar na fila')
+
+_aplicacao = None
+
+
+def ativo():
+    return bool(settings.FII_WEBHOOK_URL)
+
+
+def aplicacao():
+    return _aplicacao
+
+
+async def iniciar(app=None, registrar=True):
+    """Sobe a aplicação do bot sem Updater (mesma ordem do run_polling) e registra o webhook."""
+    global _aplicacao
+    if not settings.FII_WEBHOOK_SEGREDO:
+        raise ImproperlyConfigured("O modo webhook exige FII_WEBHOOK_SEGREDO.")
+    if app is None:
+        from bot.management.commands.runbot import criar_perfilador, montar_aplicacao
+        app = montar_aplicacao(criar_perfilador(), webhook=True)
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    if registrar:
+        url = settings.FII_WEBHOOK_URL.rstrip('/') + '/' + CAMINHO
+        await app.bot.set_webhook(url=url, secret_token=settings.FII_WEBHOOK_SEGREDO,
+                                  allowed_updates=Update.ALL_TYPES, drop_pending_updates=False)
+        logger.info("Webhook registrado em %s", url)
+    _aplicacao = app
+    return app
+
+
+async def parar():
+    global _aplicacao
+    app, _aplicacao = _aplicacao, None
+    if app is None:
+        return
+    # O webhook continua registrado: o Telegram guarda os updates até o servidor voltar
+    await app.stop()
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+
+def _segredo_valido(recebido):
+    # compare_digest leva o mesmo tempo acerte ou erre, para não entregar o segredo por tentativa e erro
+    segredo = settings.FII_WEBHOOK_SEGREDO.encode()
+    return bool(segredo) and hmac.compare_digest(recebido, segredo)
+
+
+async def _negar(send):
+    WEBHOOK_UPDATES.inc(resultado='negado')
+    await send({'type': 'http.response.start', 'status': 403, 'headers': [(b'content-length', b'0')]})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def com_bot(app_django):
+    """Envolve o app ASGI do Django tratando o lifespan, que o Django não implementa.
+
+    Também confere o segredo dos POSTs do webhook só pelos cabeçalhos, antes
+    de repassar ao Django, que leria o corpo inteiro antes de chamar a view.
+    """
+    cabecalho = CABECALHO_SEGREDO.lower().encode()
+
+    async def app_asgi(scope, receive, send):
+        if scope['type'] == 'http':
+            if (scope['method'] == 'POST' and scope['path'].endswith('/' + CAMINHO)
+                    and not _segredo_valido(dict(scope['headers']).get(cabecalho, b''))):
+                return await _negar(send)
+            return await app_django(scope, receive, send)
+        if scope['type'] != 'lifespan':
+            return await app_django(scope, receive, send)
+        while True:
+            mensagem = await receive()
+            if mensagem['type'] == 'lifespan.startup':
+                try:
+                    await iniciar()
+                except Exception as e:
+                    logger.exception("Falha ao iniciar o bot em modo webhook")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensagem['type'] == 'lifespan.shutdown':
+                await parar()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    return app_asgi
+
+
+def _gravar(corpo):
+    with open(settings.FII_WEBHOOK_GRAVAR, 'ab') as arquivo:
+        arquivo.write(corpo.replace(b'\n', b' ') + b'\n')
+
+
+@csrf_exempt
+async def receber(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    # Sob o com_bot os POSTs sem o segredo já foram recusados antes de o corpo ser lido;
+    # aqui vale para quando a view é servida sem ele (ex.: runserver), antes de tocar no corpo
+    if not _segredo_valido(request.headers.get(CABECALHO_SEGREDO, '').encode()):
+        WEBHOOK_UPDATES.inc(resultado='negado')
+        return HttpResponseForbidden()
+
+    app = _aplicacao
+    if app is None:
+        # 503 faz o Telegram tentar de novo mais tarde; nada se perde
+        WEBHOOK_UPDATES.inc(resultado='indisponivel')
+        return HttpResponse(status=503)
+
+    inicio = time.perf_counter()
+    try:
+        update = Update.de_json(json.loads(request.body), app.bot)
+    except (ValueError, TypeError, KeyError):
+        WEBHOOK_UPDATES.inc(resultado='invalido')
+        return HttpResponseBadRequest()
+    if settings.FII_WEBHOOK_GRAVAR:
+        await asyncio.to_thread(_gravar, request.body)
+
+    # Responde assim que o update entra na fila: o Telegram não espera o handler
+    await app.update_queue.put(update)
+    WEBHOOK_SEGUNDOS.observar(time.perf_counter() - inicio)
+    WEBHOOK_UPDATES.inc(resultado='aceito')
+    return HttpResponse()
@@ -1,43 +1,37 @@
+import asyncio
 import logging
-import yfinance as yf
 from telegram import Update
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler
 
+from bot.cotacoes import buscar_cotacoes, buscar_nomes
+
 # Configuração de logs para ver erros no terminal
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
+logger = logging.getLogger(__name__)
 
 
 # Função para pegar dados do FII
 def get_fii_data(ticker):
-    # Adiciona .SA se o usuário esqueceu (padrão B3 no Yahoo Finance)
-    if not ticker.endswith('.SA'):
-        ticker_search = f"{ticker}.SA"
-    else:
-        ticker_search = ticker
-
-    try:
-        fii = yf.Ticker(ticker_search)
-        info = fii.info
-
-        # Yahoo Finance as vezes retorna dados incompletos para FIIs,
-        # mas 'currentPrice' ou 'regularMarketPrice' costumam funcionar.
-        preco = info.get('currentPrice') or info.get('regularMarketPrice')
-
-        if preco is None:
-            return None
-
-        return {
-            'nome': info.get('longName', ticker),
-            'preco': preco,
-            'moeda': info.get('currency', 'BRL')
-        }
-    except Exception as e:
-        print(f"Erro ao buscar {ticker}: {e}")
+    # Aceita com ou sem .SA; o provedor acrescenta o sufixo da B3 no Yahoo Finance
+    ticker = ticker.upper().strip().removesuffix('.SA')
+
+    # Mesmo provedor e cache (cache_cotacoes) do bot principal: vários chats pedindo o mesmo
+    # /fii geram uma única busca, e o yfinance só é importado na primeira consulta
+    preco = buscar_cotacoes([ticker]).get(ticker)
+    if preco is None:
+        logger.info("Sem cotação para %s", ticker)
         return None
 
+    # O nome vem do cache de metadados (um dia); sem ele, mostra o próprio ticker
+    return {
+        'nome': buscar_nomes([ticker]).get(ticker) or ticker,
+        'preco': preco,
+        'moeda': 'BRL'
+    }
+
 
 # Comando /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -56,7 +50,7 @@ async def consultar_fii(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ticker = context.args[0].upper()
     await update.message.reply_text(f"🔍 Buscando dados de {ticker}...")
 
-    dados = get_fii_data(ticker)
+    dados = await asyncio.to_thread(get_fii_data, ticker)
 
     if dados:
         msg = (
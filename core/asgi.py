@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+# Modo webhook (FII_WEBHOOK_URL definido): o bot roda neste processo e recebe os updates por POST
+from bot import webhook  # noqa: E402 (precisa das apps carregadas por get_asgi_application)
+
+if webhook.ativo():
+    application = webhook.com_bot(application)
@@ -77,9 +77,23 @@ WSGI_APPLICATION = 'core.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        # FII_BANCO permite apontar vários processos (ou um teste) para outro arquivo
+        'NAME': os.environ.get('FII_BANCO', BASE_DIR / 'db.sqlite3'),
+        # Conexões persistentes: cada thread reaproveita a sua em vez de abrir uma por operação
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
         'OPTIONS': {
             'timeout': 20, # Espera até 20 segundos se o banco estiver ocupado
+            # WAL: leitores (dashboard) não bloqueiam o escritor (bot) e vice-versa
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA temp_store=MEMORY;'
+                'PRAGMA mmap_size=134217728;'
+            ),
+            # Transações já pegam o lock de escrita no BEGIN, sem upgrade no meio (evita SQLITE_BUSY)
+            'transaction_mode': 'IMMEDIATE',
         },
     }
 }
@@ -120,3 +134,18 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+
+
+# Usuários do Telegram (IDs numéricos) autorizados a usar comandos de administração, como /perfil
+FII_ADMINS = [int(i) for i in os.environ.get('FII_ADMINS', '').split(',') if i.strip()]
+
+# Token do bot (@BotFather). Prefira a variável de ambiente; o valor fixo é o do bot de desenvolvimento
+FII_TELEGRAM_TOKEN = os.environ.get('FII_TELEGRAM_TOKEN', '7982038153:AAF9iP9-XVgVN3wFSSRyhkwj943_K3-NeJY')
+
+# Modo webhook: com a URL pública definida, o bot roda dentro do app ASGI (uvicorn core.asgi:application)
+# e o Telegram entrega os updates por POST em /telegram/. Vazio = long polling pelo `manage.py runbot`.
+FII_WEBHOOK_URL = os.environ.get('FII_WEBHOOK_URL', '')
+# Segredo enviado pelo Telegram no cabeçalho X-Telegram-Bot-Api-Secret-Token (obrigatório no modo webhook)
+FII_WEBHOOK_SEGREDO = os.environ.get('FII_WEBHOOK_SEGREDO', '')
+# Arquivo JSONL onde os updates recebidos são gravados para o `manage.py reproduzir_updates` (vazio = não grava)
+FII_WEBHOOK_GRAVAR = os.environ.get('FII_WEBHOOK_GRAVAR', '')
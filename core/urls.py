@@ -1,8 +1,13 @@
 from django.contrib import admin
 from django.urls import path
-from bot.views import home # Importe sua view aqui
+from bot import webhook
+from bot.views import aporte, home, metricas, projecao # Importe sua view aqui
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', home, name='home'), # Página inicial do site
+    path('metricas/', metricas, name='metricas'),  # Prometheus (site + bot)
+    path('projecao/', projecao, name='projecao'),  # Painel Bola de Neve (JSON)
+    path('aporte/', aporte, name='aporte'),  # Sugestão de aporte (JSON)
+    path(webhook.CAMINHO, webhook.receber, name='telegram_webhook'),  # Updates do Telegram (modo webhook)
 ]